@@ -0,0 +1,205 @@
+"""
+Benchmark the controller pipeline on a synthetic stream of runner events
+
+Usage:
+
+    python benchmarks/bench_controller.py [--hosts N,N,...] [--processes N]
+        [--encoding records|columnar] [--output-format json|ndjson]
+
+Every host reports the setup facts, a cpu_utilization result and an
+ansible_proc_stats payload of --processes processes. The events go through
+the plugins' ok_callback and the result callbacks exactly as during a real
+run, without any SSH connection. Each scenario runs in a fresh interpreter so
+its peak RSS is its own.
+"""
+
+import argparse
+import multiprocessing
+import resource
+import time
+from unittest.mock import MagicMock
+
+from machine_stats import (
+    MeasurementsResultCallback,
+    PluginManager,
+    ResultCallback,
+    ShimResult,
+)
+from machine_stats.modules.proc_stats import encode_columnar
+from machine_stats.output import OUTPUT_FORMATS, make_writer
+
+CALLBACKS = {
+    "servers": ResultCallback,
+    "measurements": MeasurementsResultCallback,
+}
+
+
+class CountingStream:
+    """Output stream that only counts what is written to it"""
+
+    def __init__(self):
+        self.size = 0
+
+    def write(self, data):
+        self.size += len(data)
+
+    def flush(self):
+        pass
+
+
+def facts(host):
+    return {
+        "ansible_hostname": host,
+        "ansible_fqdn": host + ".example.com",
+        "ansible_all_ipv4_addresses": ["10.0.0.1", "172.17.0.1"],
+        "ansible_all_ipv6_addresses": ["fe80::1"],
+        "ansible_memtotal_mb": 16384,
+        "ansible_memfree_mb": 4096,
+        "ansible_mounts": [
+            {"size_total": 107374182400, "size_available": 53687091200},
+        ],
+        "ansible_processor_vcpus": 8,
+        "ansible_distribution": "Ubuntu",
+        "ansible_distribution_version": "24.04",
+        "ansible_processor": ["0", "GenuineIntel", "Intel(R) Xeon(R) CPU"],
+    }
+
+
+def cpu_utilization():
+    return {
+        "average": 12.5,
+        "peak": 87.0,
+        "p50": 10.0,
+        "p95": 60.0,
+        "p99": 80.0,
+        "per_core_peak": [87.0, 40.0, 30.0, 20.0, 10.0, 10.0, 10.0, 10.0],
+        "core_peak": 87.0,
+        "user": 8.0,
+        "system": 3.0,
+        "iowait": 1.0,
+        "steal": 0.5,
+        "interval": 1.0,
+        "rtc_date": "2024-05-17",
+        "rtc_time": "11:59:54",
+    }
+
+
+def processes(count):
+    return [
+        {
+            "pid": pid,
+            "ppid": 1,
+            "name": "worker%d" % (pid % 50),
+            "path": "/opt/app%d/bin/worker%d" % (pid % 10, pid % 50),
+            "user": "user%d" % (pid % 5),
+            "memory_used_mb": 5.0,
+            "max_memory_used_mb": 8.0,
+            "total_alive_time": 3600 + pid,
+        }
+        for pid in range(1, count + 1)
+    ]
+
+
+def events(host, process_count, encoding):
+    """Yield the runner events of a host"""
+    proc_stats = processes(process_count)
+    if encoding == "columnar":
+        proc_stats = encode_columnar(proc_stats)
+    for res in (
+        {"ansible_facts": facts(host)},
+        {"timeout": 30, "ansible_cpu_utilization": cpu_utilization()},
+        {"ansible_proc_stats": proc_stats},
+    ):
+        yield ShimResult({"event_data": {"host": host, "res": res}})
+
+
+def scenario(callback_name, hosts, process_count, encoding, output_format):
+    """Feed the events of ``hosts`` hosts to a result callback"""
+    stream = CountingStream()
+    callback_cls = CALLBACKS[callback_name]
+    callback = callback_cls(
+        plugins=PluginManager(),
+        writer=make_writer(output_format, callback_cls.output_key, stream),
+        expected_tasks=3,
+    )
+    callback._display = MagicMock()  # pylint: disable=protected-access
+
+    processing = 0.0
+    for index in range(hosts):
+        for result in events("host%d" % index, process_count, encoding):
+            start = time.perf_counter()
+            callback.v2_runner_on_ok(result)
+            processing += time.perf_counter() - start
+
+    start = time.perf_counter()
+    callback.v2_playbook_on_stats({})
+    serialization = time.perf_counter() - start
+
+    return {
+        "callback": callback_name,
+        "hosts": hosts,
+        "processing": processing,
+        "serialization": serialization,
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "output_mb": stream.size / 1024**2,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument(
+        "--hosts",
+        type=lambda value: [int(hosts) for hosts in value.split(",")],
+        default=[1000, 10000],
+        help="comma-separated host counts, e.g. 1000,10000,100000",
+    )
+    parser.add_argument("--processes", type=int, default=100)
+    parser.add_argument(
+        "--encoding", choices=["records", "columnar"], default="records"
+    )
+    parser.add_argument("--output-format", choices=OUTPUT_FORMATS, default="json")
+    args = parser.parse_args()
+
+    context = multiprocessing.get_context("spawn")
+    print(
+        "%-12s %7s %12s %12s %10s %10s %10s"
+        % (
+            "callback",
+            "hosts",
+            "process ms",
+            "serialize ms",
+            "hosts/s",
+            "RSS MB",
+            "out MB",
+        )
+    )
+    for callback_name in CALLBACKS:
+        for hosts in args.hosts:
+            with context.Pool(1) as pool:
+                result = pool.apply(
+                    scenario,
+                    (
+                        callback_name,
+                        hosts,
+                        args.processes,
+                        args.encoding,
+                        args.output_format,
+                    ),
+                )
+            total = result["processing"] + result["serialization"]
+            print(
+                "%-12s %7d %12.1f %12.1f %10.0f %10.1f %10.1f"
+                % (
+                    result["callback"],
+                    result["hosts"],
+                    result["processing"] * 1000,
+                    result["serialization"] * 1000,
+                    result["hosts"] / total,
+                    result["peak_rss_mb"],
+                    result["output_mb"],
+                )
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,196 @@
+"""
+Benchmark the target-side modules on fixture /proc trees
+
+Usage:
+
+    python benchmarks/bench_modules.py [--processes N,N,...] [--repeat N]
+        [--cpu-timeout SECONDS] [--save FILE] [--compare FILE]
+
+Every scenario builds a /proc tree with the given number of processes, plus
+the stat, driver/rtc, meminfo, cpuinfo and mounts files, and runs the module
+functions against it through their proc_root argument. For each scenario the
+wall time (best of --repeat), the CPU time, the read syscalls (syscr of
+/proc/self/io) and the Python peak memory (tracemalloc) are reported. The
+wall time of CPU sampling is mostly its sampling window, so its CPU time is
+the one to look at.
+
+--save writes the results as JSON and --compare prints the change of every
+measure against a file written by --save, e.g. before and after a change.
+"""
+
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import time
+import tracemalloc
+
+from bench_proc_stats import build_proc_tree
+
+from machine_stats.modules import cpu_utilization, machine_facts, proc_stats
+
+CPUS = 8
+
+RTC = "rtc_time\t: 11:59:54\nrtc_date\t: 2024-05-17\n"
+
+MEMINFO = "MemTotal:       16384000 kB\nMemFree:         4096000 kB\n"
+
+CPUINFO = (
+    "processor\t: {index}\nvendor_id\t: GenuineIntel\n"
+    "model name\t: Intel(R) Xeon(R) CPU\n\n"
+)
+
+MOUNTS = "proc /proc proc rw 0 0\n/dev/root / ext4 rw 0 0\n"
+
+MEASURES = ("wall_ms", "cpu_ms", "syscalls", "peak_kb")
+
+
+def build_fixture(root, processes):
+    """Create a /proc like tree for every module"""
+    build_proc_tree(root, processes)
+    cpu_line = "cpu%s 4705 356 584 3699 23 23 0 0 0 0\n"
+    with open(os.path.join(root, "stat"), "w") as f:
+        f.write(cpu_line % " ")
+        for index in range(CPUS):
+            f.write(cpu_line % index)
+        f.write("intr 0\nctxt 0\nbtime 1715940000\nprocesses %d\n" % processes)
+    os.mkdir(os.path.join(root, "driver"))
+    with open(os.path.join(root, "driver", "rtc"), "w") as f:
+        f.write(RTC)
+    with open(os.path.join(root, "meminfo"), "w") as f:
+        f.write(MEMINFO)
+    with open(os.path.join(root, "cpuinfo"), "w") as f:
+        f.write("".join(CPUINFO.format(index=index) for index in range(CPUS)))
+    with open(os.path.join(root, "mounts"), "w") as f:
+        f.write(MOUNTS)
+
+
+def read_syscalls():
+    """Return the number of read syscalls made by this process so far"""
+    with open("/proc/self/io") as f:
+        for line in f:
+            key, _, value = line.partition(":")
+            if key == "syscr":
+                return int(value)
+    return 0
+
+
+def measure(function, repeat):
+    """Run ``function`` ``repeat`` times and return its best measures"""
+    best = None
+    for _ in range(repeat):
+        tracemalloc.start()
+        syscalls = read_syscalls()
+        cpu = time.process_time()
+        start = time.perf_counter()
+        function()
+        wall = time.perf_counter() - start
+        cpu = time.process_time() - cpu
+        # Minus the read of /proc/self/io itself
+        syscalls = read_syscalls() - syscalls - 1
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        run = {
+            "wall_ms": wall * 1000,
+            "cpu_ms": cpu * 1000,
+            "syscalls": syscalls,
+            "peak_kb": peak / 1024.0,
+        }
+        if best is None:
+            best = run
+        else:
+            best = {key: min(best[key], run[key]) for key in MEASURES}
+    return best
+
+
+def scenarios(root, cpu_timeout):
+    """Return the module functions to run against ``root``, by name"""
+    return {
+        "proc_stats fast": lambda: proc_stats.process_stats(
+            engine="fast", proc_root=root
+        ),
+        "proc_stats legacy": lambda: proc_stats.process_stats(
+            engine="legacy", proc_root=root
+        ),
+        "cpu sampling": lambda: cpu_utilization.sample_cpu_utilization(
+            cpu_timeout, cpu_timeout / 10.0, proc_root=root
+        ),
+        "machine_facts usage": lambda: machine_facts.usage_facts(root),
+    }
+
+
+def compare(results, baseline):
+    """Print the change of every measure against ``baseline``"""
+    print()
+    print("%-20s %8s %s" % ("scenario", "procs", "  ".join(MEASURES)))
+    for key, result in sorted(results.items()):
+        if key not in baseline:
+            continue
+        changes = []
+        for measure_name in MEASURES:
+            before = baseline[key][measure_name]
+            after = result[measure_name]
+            change = (after - before) / before * 100 if before else 0.0
+            changes.append("%+.1f%%" % change)
+        name, processes = key.rsplit(" ", 1)
+        print("%-20s %8s %s" % (name, processes, "  ".join(changes)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument(
+        "--processes",
+        type=lambda value: [int(processes) for processes in value.split(",")],
+        default=[100, 1000, 10000, 50000],
+        help="comma-separated process counts, e.g. 100,1000,10000,50000",
+    )
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument(
+        "--cpu-timeout",
+        type=float,
+        default=1.0,
+        help="sampling window of the CPU sampling, sampled 10 times",
+    )
+    parser.add_argument("--save", metavar="FILE", help="write the results as JSON")
+    parser.add_argument(
+        "--compare", metavar="FILE", help="compare with results written by --save"
+    )
+    args = parser.parse_args()
+
+    results = {}
+    print(
+        "%-20s %8s %10s %10s %10s %10s"
+        % ("scenario", "procs", "wall ms", "CPU ms", "syscalls", "peak KB")
+    )
+    for processes in args.processes:
+        root = tempfile.mkdtemp(prefix="machine_stats_proc_")
+        try:
+            build_fixture(root, processes)
+            for name, function in scenarios(root, args.cpu_timeout).items():
+                result = measure(function, args.repeat)
+                results["%s %d" % (name, processes)] = result
+                print(
+                    "%-20s %8d %10.1f %10.1f %10d %10.1f"
+                    % (
+                        name,
+                        processes,
+                        result["wall_ms"],
+                        result["cpu_ms"],
+                        result["syscalls"],
+                        result["peak_kb"],
+                    )
+                )
+        finally:
+            shutil.rmtree(root)
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=4, sort_keys=True)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
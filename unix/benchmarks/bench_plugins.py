@@ -0,0 +1,83 @@
+"""
+Benchmark dispatching runner events to the plugins
+
+Usage:
+
+    python benchmarks/bench_plugins.py [--events N]
+
+Every event goes to the ok_callback of the built-in plugins, the way
+ResultCallback.v2_runner_on_ok dispatches them. The legacy dispatch lists and
+loads the plugins again for every call, as PluginManager used to; the
+registry one goes through PluginManager and its per-hook dispatch table.
+"""
+
+import argparse
+import time
+
+from machine_stats import PluginManager, ShimResult
+
+
+class Parent:
+    """Result callback stand-in that only counts the results it gets"""
+
+    def __init__(self):
+        self.results = 0
+
+    def update_results(self, host, data):
+        del host, data  # Unused
+        self.results += 1
+
+
+def legacy_dispatch(plugins):
+    """Return an ok_callback dispatching the way PluginManager used to"""
+    source = plugins._source  # pylint: disable=protected-access
+
+    def ok_callback(*args, **kwargs):
+        for plugin_name in source.list_plugins():
+            plugin = source.load_plugin(plugin_name)
+            if not hasattr(plugin, "ok_callback"):
+                break
+            plugin.ok_callback(*args, **kwargs)
+
+    return ok_callback
+
+
+def events(count):
+    """Return ``count`` runner_on_ok results, alternating the plugins' tasks"""
+    results = []
+    for index in range(count):
+        if index % 2:
+            res = {"ansible_proc_stats": []}
+        else:
+            res = {"timeout": 30, "ansible_cpu_utilization": None}
+        results.append(
+            ShimResult({"event_data": {"host": "host%d" % index, "res": res}})
+        )
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--events", type=int, default=100000)
+    args = parser.parse_args()
+
+    results = events(args.events)
+    print("%-8s %8s %10s %12s" % ("dispatch", "events", "ms", "events/s"))
+    for name, make_dispatch in (
+        ("legacy", legacy_dispatch),
+        ("registry", lambda plugins: plugins.ok_callback),
+    ):
+        ok_callback = make_dispatch(PluginManager())
+        parent = Parent()
+        start = time.perf_counter()
+        for result in results:
+            ok_callback(parent, result)
+        elapsed = time.perf_counter() - start
+        print(
+            "%-8s %8d %10.1f %12.0f"
+            % (name, args.events, elapsed * 1000, args.events / elapsed)
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+"""
+Benchmark the proc_stats collection engines on a synthetic /proc tree
+
+Usage:
+
+    python benchmarks/bench_proc_stats.py [--processes N] [--repeat N]
+
+Every synthetic process has an ``exe`` link and a ``status`` file shaped like
+the Linux ones, so both engines do the same work as on a real host.
+"""
+
+import argparse
+import os
+import shutil
+import tempfile
+import timeit
+
+from machine_stats.modules import proc_stats
+
+STATUS_TEMPLATE = """\
+Name:\t{name}
+Umask:\t0022
+State:\tS (sleeping)
+Tgid:\t{pid}
+Ngid:\t0
+Pid:\t{pid}
+PPid:\t1
+TracerPid:\t0
+Uid:\t{uid}\t{uid}\t{uid}\t{uid}
+Gid:\t{uid}\t{uid}\t{uid}\t{uid}
+FDSize:\t64
+Groups:\t{uid}
+NStgid:\t{pid}
+NSpid:\t{pid}
+NSpgid:\t{pid}
+NSsid:\t{pid}
+VmPeak:\t  {vm_peak} kB
+VmSize:\t  {vm_size} kB
+VmLck:\t       0 kB
+VmPin:\t       0 kB
+VmHWM:\t    5120 kB
+VmRSS:\t    5120 kB
+RssAnon:\t    1024 kB
+RssFile:\t    4096 kB
+RssShmem:\t       0 kB
+VmData:\t    2048 kB
+VmStk:\t     132 kB
+VmExe:\t     964 kB
+VmLib:\t    3484 kB
+VmPTE:\t      64 kB
+VmSwap:\t       0 kB
+HugetlbPages:\t       0 kB
+CoreDumping:\t0
+THP_enabled:\t1
+Threads:\t1
+SigQ:\t0/63541
+SigPnd:\t0000000000000000
+ShdPnd:\t0000000000000000
+SigBlk:\t0000000000000000
+SigIgn:\t0000000000001000
+SigCgt:\t0000000180000000
+CapInh:\t0000000000000000
+CapPrm:\t0000000000000000
+CapEff:\t0000000000000000
+CapBnd:\t000001ffffffffff
+CapAmb:\t0000000000000000
+NoNewPrivs:\t0
+Seccomp:\t0
+Seccomp_filters:\t0
+Speculation_Store_Bypass:\tthread vulnerable
+Cpus_allowed:\tff
+Cpus_allowed_list:\t0-7
+Mems_allowed:\t00000000,00000001
+Mems_allowed_list:\t0
+voluntary_ctxt_switches:\t150
+nonvoluntary_ctxt_switches:\t3
+"""
+
+
+def build_proc_tree(root, processes):
+    """Create a /proc like tree with the given number of processes"""
+    for pid in range(1, processes + 1):
+        process_path = os.path.join(root, str(pid))
+        os.mkdir(process_path)
+        name = "worker%d" % (pid % 50)
+        # The executables don't exist, so resolving the link never goes further
+        os.symlink("/opt/app%d/bin/%s" % (pid % 10, name), process_path + "/exe")
+        with open(process_path + "/status", "w") as status:
+            status.write(
+                STATUS_TEMPLATE.format(
+                    name=name,
+                    pid=pid,
+                    uid=pid % 5,
+                    vm_peak=4096 + pid,
+                    vm_size=2048 + pid,
+                )
+            )
+
+
+def comparable(processes):
+    """Return the processes sorted by PID, without the alive time which
+    depends on when the engine ran"""
+    return sorted(
+        (
+            {key: value for key, value in process.items() if key != "total_alive_time"}
+            for process in processes
+        ),
+        key=lambda process: process["pid"],
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--processes", type=int, default=20000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    root = tempfile.mkdtemp(prefix="machine_stats_proc_")
+    try:
+        build_proc_tree(root, args.processes)
+
+        results = {}
+        for engine in proc_stats.ENGINES:
+            results[engine] = comparable(
+                proc_stats.process_stats(engine=engine, proc_root=root)
+            )
+            best = min(
+                timeit.repeat(
+                    lambda: proc_stats.process_stats(engine=engine, proc_root=root),
+                    number=1,
+                    repeat=args.repeat,
+                )
+            )
+            print(
+                "%-8s %6d processes  %8.1f ms  %6.2f us/process"
+                % (engine, args.processes, best * 1000, best / args.processes * 1e6)
+            )
+
+        if results["fast"] != results["legacy"]:
+            print("WARNING: engines returned different results")
+    finally:
+        shutil.rmtree(root)
+
+
+if __name__ == "__main__":
+    main()
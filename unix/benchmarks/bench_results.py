@@ -0,0 +1,116 @@
+"""
+Benchmark merging the contributions of the facts and plugins to host results
+
+Usage:
+
+    python benchmarks/bench_results.py [--hosts N] [--plugins N] [--repeat N]
+
+Every host gets its facts and then --plugins contributions of custom fields,
+as many plugins adding cpu_utilization-like fields would. The eager strategy
+is how ResultCallback.update_results used to merge every contribution as it
+arrived, the builder one is HostResult, which merges them once per host. The
+time, the peak memory of a host including the intermediate copies and the
+memory kept per host (tracemalloc) are reported.
+"""
+
+import argparse
+import time
+import tracemalloc
+
+from machine_stats.results import HostResult
+
+
+def contributions(host, plugins):
+    """Return the contributions of the facts and the plugins to a host"""
+    yield {
+        "host_name": host,
+        "fqdn": host + ".example.com",
+        "ram_allocated_gb": 16.0,
+        "cpu_count": 8,
+        "custom_fields": {"source": "machine_stats"},
+    }
+    for plugin in range(plugins):
+        yield {
+            "custom_fields": {
+                "plugin%d_%s" % (plugin, field): float(plugin)
+                for field in ("average", "peak", "p95")
+            }
+        }
+
+
+def eager(total_results, host, plugins):
+    """Merge every contribution as it arrives, copying the custom fields"""
+    for data in contributions(host, plugins):
+        if host not in total_results:
+            total_results[host] = data
+            continue
+        if "custom_fields" in data and "custom_fields" in total_results[host]:
+            combined_custom_fields = {
+                **total_results[host]["custom_fields"],
+                **data["custom_fields"],
+            }
+            data["custom_fields"].update(combined_custom_fields)
+        total_results[host].update(data)
+    return total_results[host]
+
+
+def builder(total_results, host, plugins):
+    """Collect the contributions and merge them once the host is done"""
+    for data in contributions(host, plugins):
+        results = total_results.get(host)
+        if results is None:
+            total_results[host] = HostResult(data)
+        else:
+            results.add(data)
+    return total_results[host].build()
+
+
+def measure(strategy, hosts, plugins, repeat):
+    """Return the best time of ``strategy`` and its memory per host
+
+    The memory is the high-water mark above what was allocated before the
+    host, so it includes the intermediate copies freed along the way.
+    """
+    best = None
+    for _ in range(repeat):
+        total_results = {}
+        start = time.perf_counter()
+        for index in range(hosts):
+            strategy(total_results, "host%d" % index, plugins)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    total_results = {}
+    peak = 0
+    tracemalloc.start()
+    for index in range(hosts):
+        before = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        strategy(total_results, "host%d" % index, plugins)
+        peak += tracemalloc.get_traced_memory()[1] - before
+    retained = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return best, peak / float(hosts), retained / float(hosts)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--hosts", type=int, default=10000)
+    parser.add_argument("--plugins", type=int, default=10)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    print(
+        "%-8s %6s %8s %10s %16s %16s"
+        % ("strategy", "hosts", "plugins", "ms", "peak bytes/host", "kept bytes/host")
+    )
+    for name, strategy in (("eager", eager), ("builder", builder)):
+        best, peak, retained = measure(strategy, args.hosts, args.plugins, args.repeat)
+        print(
+            "%-8s %6d %8d %10.1f %16.0f %16.0f"
+            % (name, args.hosts, args.plugins, best * 1000, peak, retained)
+        )
+
+
+if __name__ == "__main__":
+    main()
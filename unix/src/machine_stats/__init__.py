@@ -3,17 +3,29 @@ Script to prepare JSON output for tidal sync servers from the list of hosts
 """
 
 import argparse
-import json
 import os
 import shutil
+import time
+from contextlib import nullcontext
 from functools import partial
+from machine_stats.cache import DEFAULT_TTLS, FIELD_GROUPS, ResultCache, parse_ttl
+from machine_stats.checkpoint import Checkpoint
+from machine_stats import collector
+from machine_stats.collector import collector_tasks, read_modules
 from machine_stats.config import load_config
+from machine_stats.forks import ForkTuner, parse_forks
+from machine_stats.inventory import list_connections, list_hosts
+from machine_stats.output import OUTPUT_FORMATS, make_writer
+from machine_stats.profiling import Profiler, TimedWriter
+from machine_stats.ssh import (
+    SSH_PROFILES,
+    requires_tty,
+    ssh_envvars,
+    without_pipelining,
+)
 import tempfile
-import ansible_runner
-import ansible.constants as C
-from ansible.plugins.callback import CallbackBase
-from ansible.utils.color import colorize, hostcolor
-from ansible.utils.display import Display
+from importlib import import_module
+from importlib.util import find_spec
 from pluginbase import PluginBase
 from machine_stats._version import __version__
 # Setting default configuration parameters
@@ -29,92 +41,196 @@ for k, v in default_config.items():
 here = os.path.abspath(os.path.dirname(__file__))
 get_path = partial(os.path.join, here)
 
-display = Display()
+# Names imported on first use, with the module providing them. Importing
+# Ansible takes hundreds of milliseconds and parses ansible.cfg, which
+# --version, --help and the argument parsing of the plugins don't need.
+LAZY_IMPORTS = {
+    "ansible_runner": ("ansible_runner", None),
+    "ssh_engine": (".ssh_engine", None),
+    "display": (".callbacks", "display"),
+    "ResultCallback": (".callbacks", "ResultCallback"),
+    "MeasurementsResultCallback": (".callbacks", "MeasurementsResultCallback"),
+    "ram_allocated_gb": (".callbacks", "ram_allocated_gb"),
+    "ram_used_gb": (".callbacks", "ram_used_gb"),
+    "storage_allocated_gb": (".callbacks", "storage_allocated_gb"),
+    "storage_used_gb": (".callbacks", "storage_used_gb"),
+    "cpu_logical_processors": (".callbacks", "cpu_logical_processors"),
+    "cpu_name": (".callbacks", "cpu_name"),
+    "ip_addresses": (".callbacks", "ip_addresses"),
+}
 
 
-class PluginManager:
-    """
-    Plugin manager for machine_stats
-    """
+def __getattr__(name):
+    """Import the names of LAZY_IMPORTS on first use"""
+    if name not in LAZY_IMPORTS:
+        raise AttributeError("module %r has no attribute %r" % (__name__, name))
+    module_name, attribute = LAZY_IMPORTS[name]
+    value = import_module(module_name, __name__)
+    if attribute is not None:
+        value = getattr(value, attribute)
+    globals()[name] = value
+    return value
 
-    def __init__(self):
-        # Setup a plugin base for "machine_stats.plugins" and make sure to load
-        # all the default built-in plugins from the plugins folder.
-        self._base = PluginBase(
-            package="machine_stats_plugins", searchpath=[get_path("./plugins")]
-        )
 
-        self._source = self._base.make_plugin_source(searchpath=[])
+def _lazy(name):
+    """Return a name of LAZY_IMPORTS from inside this module"""
+    return globals()[name] if name in globals() else __getattr__(name)
 
-    def __getattr__(self, fn):
-        def method(*args, **kwargs):
-            for plugin_name in self._source.list_plugins():
-                plugin = self._source.load_plugin(plugin_name)
-                if not hasattr(plugin, fn):
-                    display.warning(
-                        "no method '%s' for plugin '%s'" % (fn, plugin_name)
-                    )
-                    break
-                # calling a function of a module by using its name (a string)
-                getattr(plugin, fn)(*args, **kwargs)
 
-        return method
+DEFAULT_FORKS = 10
 
+# Engines running the play: Ansible, or the collector script over SSH
+ENGINES = ("ansible", "ssh")
 
-def ram_allocated_gb(facts):
-    """Return total memory allocation in GB"""
-    return facts["ansible_memtotal_mb"] / 1024
+# Hosts collected at the same time by the ssh engine
+DEFAULT_SSH_CONCURRENCY = 500
 
+# Ansible verbosity of the runs, and of the runs writing --debug-artifacts
+DEFAULT_VERBOSITY = 0
+DEBUG_VERBOSITY = 3
 
-def ram_used_gb(facts):
-    """Return used memory in GB"""
-    return (facts["ansible_memtotal_mb"] - facts["ansible_memfree_mb"]) / 1024
+# Name the current machine is reported under by --local
+LOCAL_HOST = "localhost"
 
+# Write buffer used for the --output file.
+OUTPUT_BUFFER_SIZE = 1024 * 1024
 
-def _size(key, mounts):
-    return sum([item.get(key, 0) for item in mounts])
+# Runner events forwarded to the result callback as soon as they arrive.
+RUNNER_EVENT_CALLBACKS = {
+    "runner_on_ok": "v2_runner_on_ok",
+    "runner_on_unreachable": "v2_runner_on_unreachable",
+    "runner_on_failed": "v2_runner_on_failed",
+    "runner_on_skipped": "v2_runner_on_skipped",
+}
 
+# Task actions gathering the facts for each --fact-gathering mode
+FACT_ACTIONS = {
+    # ANSIBLE_GATHER_TIMEOUT only applies to the implicit fact gathering
+    "full": dict(
+        module="setup",
+        args=dict(gather_timeout=int(default_config["ANSIBLE_GATHER_TIMEOUT"])),
+    ),
+    "minimal": dict(module="machine_facts"),
+}
 
-def storage_allocated_gb(facts):
-    """Return total storage allocation in GB"""
-    if "ansible_mounts" not in facts:
-        return 0
-    return _size("size_total", facts["ansible_mounts"]) / 1024**3
+# Runner events of hosts that can be retried
+RETRY_EVENTS = ("runner_on_failed", "runner_on_unreachable")
 
+# Task action gathering only the facts of the fields that aren't cached
+USAGE_FACTS_ACTION = dict(module="machine_facts", args=dict(subset="usage"))
 
-def storage_used_gb(facts):
-    """Return used storage in GB"""
-    if "ansible_mounts" not in facts:
-        return 0
-    return (
-        _size("size_total", facts["ansible_mounts"])
-        - _size("size_available", facts["ansible_mounts"])
-    ) / 1024**3
+# Extra variable listing the hosts whose static fields are served from the cache
+CACHED_HOSTS_VAR = "machine_stats_cached_hosts"
 
 
-def cpu_logical_processors(facts):
-    """Return the number of CPU logical processors."""
-    return int(facts.get("ansible_processor_vcpus", 0))
+class PluginManager:
+    """
+    Plugin manager for machine_stats
 
+    Plugins are discovered and imported once, the first time a hook is
+    called. Every hook, e.g. ``plugins.ok_callback(parent, result)``, then
+    calls the plugins defining it, in plugin name order, from a dispatch
+    table built on its first call.
+    """
 
-def cpu_name(proc):
-    """Return CPU name"""
-    items_count = len(proc)
-    if items_count == 1:
-        return proc[0]
-    if items_count >= 3:
-        return proc[2]
-    return "Unknown"
+    def __init__(self, searchpath=None):
+        # Setup a plugin base for "machine_stats.plugins" and make sure to load
+        # all the default built-in plugins from the plugins folder.
+        if searchpath is None:
+            searchpath = [get_path("./plugins")]
+        self._base = PluginBase(package="machine_stats_plugins", searchpath=searchpath)
 
+        self._source = self._base.make_plugin_source(searchpath=[])
+        self._plugins = None
+
+    def plugins(self):
+        """Return the loaded plugins, as (name, module) pairs"""
+        if self._plugins is None:
+            self._plugins = [
+                (plugin_name, self._source.load_plugin(plugin_name))
+                for plugin_name in self._source.list_plugins()
+            ]
+        return self._plugins
+
+    def hooks(self, fn):
+        """Return the functions of the plugins implementing hook ``fn``"""
+        hooks = []
+        for plugin_name, plugin in self.plugins():
+            hook = getattr(plugin, fn, None)
+            if hook is None:
+                _lazy("display").vvv(
+                    "no method '%s' for plugin '%s'" % (fn, plugin_name)
+                )
+                continue
+            hooks.append(hook)
+        return hooks
 
-def ip_addresses(facts):
-    """Return IP addresses formatted for the tidal API"""
-    return list(
-        map(
-            lambda ip: {"address": ip},
-            facts["ansible_all_ipv4_addresses"] + facts["ansible_all_ipv6_addresses"],
+    def __getattr__(self, fn):
+        if fn.startswith("_"):
+            raise AttributeError(fn)
+        hooks = self.hooks(fn)
+
+        if len(hooks) == 1:
+            method = hooks[0]
+        else:
+
+            def method(*args, **kwargs):
+                for hook in hooks:
+                    hook(*args, **kwargs)
+
+        # Cached on the instance, so later calls don't go through __getattr__
+        setattr(self, fn, method)
+        return method
+
+
+def positive_int(value):
+    """argparse type for options that only accept positive numbers"""
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError("%r is not a positive number" % value)
+    return number
+
+
+def non_negative_int(value):
+    """argparse type for options that accept zero or positive numbers"""
+    number = int(value)
+    if number < 0:
+        raise argparse.ArgumentTypeError("%r is a negative number" % value)
+    return number
+
+
+def non_negative_float(value):
+    """argparse type for durations and other zero or positive quantities"""
+    number = float(value)
+    if not number >= 0:
+        raise argparse.ArgumentTypeError("%r is not a non-negative number" % value)
+    return number
+
+
+def merge_stats(total, stats):
+    """Add the per-host counters of ``stats`` to ``total``"""
+    for key, hosts in stats.items():
+        counters = total.setdefault(key, {})
+        for host, count in hosts.items():
+            counters[host] = counters.get(host, 0) + count
+    return total
+
+
+def runner_stats(event_data):
+    """Return the play recap stats from a ``playbook_on_stats`` event"""
+    return {
+        key: dict(event_data.get(key, {}))
+        for key in (
+            "skipped",
+            "ok",
+            "dark",
+            "failures",
+            "ignored",
+            "rescued",
+            "processed",
+            "changed",
         )
-    )
+    }
 
 
 class ShimHost:
@@ -136,269 +252,426 @@ class ShimResult:
         self._host = ShimHost(event["event_data"]["host"])
 
 
-class ResultCallback(CallbackBase):
-    """A sample callback plugin used for performing an action as results come in
-
-    If you want to collect all results into a single object for processing at
-    the end of the execution, look into utilizing the ``json`` callback plugin
-    or writing your own custom callback plugin.
-    """
+class Application:  # pylint: disable=too-few-public-methods
+    """Machine Stats application"""
 
-    def __init__(self, plugins, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        self._total_results = None
+    def __init__(
+        self, *, sources: list = None, plugins: PluginManager, args: argparse.Namespace
+    ):
+        if sources is None:
+            sources = []
+        self._sources = sources
         self._plugins = plugins
+        self.args = args
 
-    def v2_runner_on_unreachable(self, result):
-        host = result._host  # pylint: disable=protected-access
-        self._display.error(
-            "{0}: {1}".format(
-                host.get_name(),
-                result._result["msg"],  # pylint: disable=protected-access
-            ),
-            wrap_text=False,
-        )
-
-    def v2_runner_on_failed(self, result, *args, **kwargs):
-        del args, kwargs  # Unused
-        host = result._host  # pylint: disable=protected-access
-        self._display.error(
-            "{0}: {1}".format(
-                host.get_name(),
-                result._result["msg"],  # pylint: disable=protected-access
-            ),
-            wrap_text=False,
-        )
+        self._playbook_pre_tasks = []
+        self._playbook_tasks = []
+        self._playbook_post_tasks = []
+        self._forks = ForkTuner(forks=getattr(args, "forks", DEFAULT_FORKS))
+        self._cache = None
+        if getattr(args, "cache", None):
+            ttls = dict(getattr(args, "cache_ttl", None) or [])
+            self._cache = ResultCache(args.cache, ttls)
+        self._profiler = None
+        if getattr(args, "profile", False) or getattr(args, "profile_file", None):
+            self._profiler = Profiler()
+        self._debug_artifacts = getattr(args, "debug_artifacts", None)
+        self._ssh_engine = None
+        self._ssh_connections = None
+        self._checkpoint = None
+        if getattr(args, "checkpoint", None):
+            self._checkpoint = Checkpoint(
+                args.checkpoint, resume=getattr(args, "resume", False)
+            )
 
-    def update_results(self, host, data: dict):
-        if self._total_results is None:
-            self._total_results = {}
+        self._plugins.setup(self)
 
-        if host not in self._total_results:
-            self._total_results[host] = data
-            return
+    @staticmethod
+    def _add_tasks(tasks, args):
+        for arg in args:
+            if isinstance(arg, list):
+                tasks.extend(arg)
+            else:
+                tasks.append(arg)
 
-        # Ensure we append any custom fields, rather than overwriting them
-        if "custom_fields" in data and "custom_fields" in self._total_results[host]:
-            combined_custom_fields = {
-                **self._total_results[host]["custom_fields"],
-                **data["custom_fields"],
-            }
-            data["custom_fields"].update(combined_custom_fields)
-            self._total_results[host].update(data)
-            return
+    def add_playbook_pre_tasks(self, *args):
+        """Add tasks to run before facts are gathered"""
+        self._add_tasks(self._playbook_pre_tasks, args)
 
-        self._total_results[host].update(data)
+    def add_playbook_tasks(self, *args):
+        self._add_tasks(self._playbook_tasks, args)
 
-    def v2_runner_on_ok(self, result):
-        self._plugins.ok_callback(self, result)
-        facts = result._result.get("ansible_facts")  # pylint: disable=protected-access
-        if facts is None:
-            return
+    def add_playbook_post_tasks(self, *args):
+        """Add tasks to run after all other tasks"""
+        self._add_tasks(self._playbook_post_tasks, args)
 
-        host = result._host.get_name()
-        self.update_results(
-            host,
-            {
-                "host_name": facts["ansible_hostname"],
-                "fqdn": facts["ansible_fqdn"],
-                "ip_addresses": facts["ansible_all_ipv4_addresses"]
-                + facts["ansible_all_ipv6_addresses"],
-                "ram_allocated_gb": ram_allocated_gb(facts),
-                "ram_used_gb": ram_used_gb(facts),
-                "storage_allocated_gb": storage_allocated_gb(facts),
-                "storage_used_gb": storage_used_gb(facts),
-                "cpu_count": cpu_logical_processors(facts),
-                "operating_system": facts["ansible_distribution"],
-                "operating_system_version": facts["ansible_distribution_version"],
-                "cpu_name": cpu_name(facts["ansible_processor"]),
-            },
-        )
+    def playbook_tasks(self):
+        if not self._playbook_tasks:
+            return None
+        return self._playbook_tasks
 
-    def _display_results(self, host, result):
-        self._display.display(
-            "%s : %s %s %s %s %s %s %s"
-            % (
-                hostcolor(host, result),
-                colorize("ok", result["ok"], C.COLOR_OK),  # pylint: disable=no-member
-                colorize(
-                    "changed",
-                    result["changed"],
-                    C.COLOR_CHANGED,  # pylint: disable=no-member
-                ),
-                colorize(
-                    "unreachable",
-                    result["unreachable"],
-                    C.COLOR_UNREACHABLE,  # pylint: disable=no-member
-                ),
-                colorize(
-                    "failed",
-                    result["failures"],
-                    C.COLOR_ERROR,  # pylint: disable=no-member
-                ),
-                colorize(
-                    "skipped",
-                    result["skipped"],
-                    C.COLOR_SKIP,  # pylint: disable=no-member
-                ),
-                colorize(
-                    "rescued",
-                    result["rescued"],
-                    C.COLOR_OK,  # pylint: disable=no-member
-                ),
-                colorize(
-                    "ignored",
-                    result["ignored"],
-                    C.COLOR_WARN,  # pylint: disable=no-member
-                ),
-            ),
-            screen_only=True,
-            stderr=True,
-        )
+    def play_source(self):
+        """Return the play to run against the inventory"""
+        fact_gathering = getattr(self.args, "fact_gathering", "full")
+        if (
+            fact_gathering == "full"
+            and self._cache is None
+            and not self._playbook_pre_tasks
+            and not self._playbook_post_tasks
+        ):
+            return dict(
+                name="Ansible Play",
+                hosts="all",
+                gather_facts="yes",
+                tasks=self.playbook_tasks(),
+            )
 
-    def v2_playbook_on_stats(self, stats):
-        if self._total_results is not None:
-            print(
-                json.dumps(
-                    {"servers": list(self._total_results.values())},
-                    indent=4,
-                    sort_keys=True,
+        # Implicit fact gathering always runs before pre_tasks, so gather facts
+        # with an explicit task to let pre_tasks start first.
+        gather = [dict(action=FACT_ACTIONS[fact_gathering])]
+        if self._cache is not None:
+            gather[0]["when"] = "inventory_hostname not in " + CACHED_HOSTS_VAR
+            gather.append(
+                dict(
+                    action=USAGE_FACTS_ACTION,
+                    when="inventory_hostname in " + CACHED_HOSTS_VAR,
                 )
             )
+        return dict(
+            name="Ansible Play",
+            hosts="all",
+            gather_facts="no",
+            pre_tasks=self._playbook_pre_tasks,
+            tasks=gather + self._playbook_tasks,
+            post_tasks=self._playbook_post_tasks,
+        )
 
-        self._display.display("MACHINE STATS RECAP", stderr=True)
-
-        hosts = sorted(stats.get("processed", {}).keys())
-        for host in hosts:  # pylint: disable=invalid-name
-            result = {
-                "ok": stats.get("ok", {}).get(host, 0),
-                "changed": stats.get("changed", {}).get(host, 0),
-                "unreachable": stats.get("dark", {}).get(host, 0),
-                "failures": stats.get("failures", {}).get(host, 0),
-                "skipped": stats.get("skipped", {}).get(host, 0),
-                "rescued": stats.get("rescued", {}).get(host, 0),
-                "ignored": stats.get("ignored", {}).get(host, 0),
-            }
-            self._display_results(host, result)
-
-        self._display.display("", screen_only=True, stderr=True)
-
+    def _event_handler(self, results_callback, stats, tty_hosts=None, retry_hosts=None):
+        """Return an ansible_runner event handler feeding the results callback.
 
-class MeasurementsResultCallback(ResultCallback):
-    """
-    How to measure fields
+        The handler is invoked by ansible_runner for every event while the play
+        is still running, so each host result reaches the callback as soon as
+        it is available instead of after the whole play has finished.
 
-    The fields that need to be tracked can be added in the fields_to_measure list.
-    If it's a custom field, please add it to the custom_fields_to_measure list.
-    """
+        When ``tty_hosts`` is given, hosts failing because sudo requires a tty
+        are added to it instead of being reported, and their partial results
+        dropped, so they can be run again without pipelining.
 
-    def v2_playbook_on_stats(self, stats):
-        """Process JSON payload
+        When ``retry_hosts`` is given, failed and unreachable hosts are added to
+        it with a warning instead of being reported, so they can be retried.
 
-        Go through each server in the results, and for the fields mentioned in the
-        `fields_to_measure` or `custom_fields_to_measure`, add its measurements to the
-        transformed data.
+        The events are only written to the ansible_runner artifacts with
+        ``--debug-artifacts``, the handler returning whether to write them.
         """
 
-        fields_to_measure = []
-        custom_fields_to_measure = ["cpu_average", "cpu_peak", "cpu_utilization"]
-
-        transformed_json_payload = []
-        if self._total_results:
-            for server in list(self._total_results.values()):
-                for field in server:
-                    # Add data (ram_used_gb) from fields_to_measure list to the transformed_json_payload list
-                    if field in fields_to_measure:
-                        server_dict = {}
-                        server_dict["measurable_type"] = "server"
-                        server_dict["field_name"] = field + "_timeseries"
-                        server_dict["value"] = server[field]
-                        server_dict["measurable"] = {"host_name": server["host_name"]}
-
-                        transformed_json_payload.append(server_dict)
-
-                    # Add custom fields data (cpu_average) from custom_fields_to_measure list to the transformed_json_payload list
-                    elif field == "custom_fields":
-                        for custom_field in server["custom_fields"]:
-                            if custom_field in custom_fields_to_measure:
-                                server_dict = {}
-                                server_dict["measurable_type"] = "server"
-                                server_dict["field_name"] = custom_field + "_timeseries"
-                                server_dict["value"] = server["custom_fields"][
-                                    custom_field
-                                ]
-                                server_dict["external_timestamp"] = server[
-                                    "custom_fields"
-                                ]["cpu_utilization_timestamp"]
-                                server_dict["measurable"] = {
-                                    "host_name": server["host_name"]
-                                }
-
-                                transformed_json_payload.append(server_dict)
-
-        if self._total_results is not None:
-            print(
-                json.dumps(
-                    {"measurements": list(transformed_json_payload)},
-                    indent=4,
-                    sort_keys=True,
+        def handler(event):
+            if self._profiler is None:
+                return handle(event)
+            self._profiler.event()
+            with self._profiler.phase("events"):
+                return handle(event)
+
+        def handle(event):
+            callback = RUNNER_EVENT_CALLBACKS.get(event.get("event"))
+            if (
+                tty_hosts is not None
+                and event.get("event") == "runner_on_failed"
+                and requires_tty(event["event_data"].get("res", {}))
+            ):
+                tty_hosts.add(event["event_data"]["host"])
+                results_callback.restart_host(event["event_data"]["host"])
+            elif retry_hosts is not None and event.get("event") in RETRY_EVENTS:
+                host = event["event_data"]["host"]
+                retry_hosts.add(host)
+                results_callback.restart_host(host)
+                _lazy("display").warning(
+                    "%s: %s (retrying)"
+                    % (host, event["event_data"].get("res", {}).get("msg"))
                 )
+            elif callback is not None:
+                event_data = event["event_data"]
+                duration = event_data.get("duration")
+                if duration is not None:
+                    self._forks.observe(event_data["host"], duration)
+                    if self._profiler is not None:
+                        self._profiler.task(
+                            event_data["host"],
+                            event_data.get("task_action") or event_data.get("task"),
+                            duration,
+                        )
+                getattr(results_callback, callback)(ShimResult(event))
+            elif event.get("event") == "playbook_on_stats":
+                run_stats = runner_stats(event["event_data"])
+                # Hosts that are run again are counted by the next run only.
+                for host in (tty_hosts or set()) | (retry_hosts or set()):
+                    for counters in run_stats.values():
+                        counters.pop(host, None)
+                merge_stats(stats, run_stats)
+            return self._debug_artifacts is not None
+
+        return handler
+
+    def _batches(self, private_data_dir, hosts=None):
+        """Yield the ``limit`` to use for every runner invocation.
+
+        Without a batch size the whole inventory, or ``hosts`` if given, is run
+        at once. Otherwise the hosts are split into shards of ``--batch-size``
+        hosts, each written to a file that is passed to Ansible as
+        ``--limit @file``.
+        """
+        batch_size = getattr(self.args, "batch_size", None)
+        if hosts is None:
+            if not batch_size:
+                yield None
+                return
+            hosts = list_hosts(self._sources)
+        batch_size = batch_size or max(len(hosts), 1)
+
+        for index, start in enumerate(range(0, len(hosts), batch_size)):
+            yield self._limit(
+                private_data_dir, f"batch_{index}", hosts[start : start + batch_size]
             )
 
+    @staticmethod
+    def _limit(private_data_dir, name, hosts):
+        """Write ``hosts`` to a file and return the ``limit`` selecting them"""
+        limit_file = os.path.join(private_data_dir, name)
+        with open(limit_file, "w") as f:  # pylint: disable=invalid-name
+            f.write("\n".join(hosts) + "\n")
+        return "@" + limit_file
 
-class Application:  # pylint: disable=too-few-public-methods
-    """Machine Stats application"""
+    def _results_callback(self, play_source, stream=None):
+        """Return the result callback and output writer for the play"""
+        if self.args.measurement:
+            callback_cls = _lazy("MeasurementsResultCallback")
+        else:
+            callback_cls = _lazy("ResultCallback")
 
-    def __init__(
-        self, *, sources: list = None, plugins: PluginManager, args: argparse.Namespace
-    ):
-        if sources is None:
-            sources = []
-        self._sources = sources
-        self._plugins = plugins
-        self.args = args
+        writer = make_writer(
+            getattr(self.args, "output_format", "json"), callback_cls.output_key, stream
+        )
+        if self._profiler is not None:
+            writer = TimedWriter(writer, self._profiler)
+        expected_tasks = sum(
+            len(play_source.get(section) or [])
+            for section in ("pre_tasks", "tasks", "post_tasks")
+        )
+        if play_source.get("gather_facts") == "yes":
+            expected_tasks += 1
+
+        return callback_cls(
+            plugins=self._plugins,
+            writer=writer,
+            expected_tasks=expected_tasks,
+            cache=self._cache,
+            checkpoint=self._checkpoint,
+        )
 
-        self._playbook_tasks = []
+    def _resume(self, results_callback):
+        """Write out the hosts completed by the previous run.
 
-        self._plugins.setup(self)
+        Return the hosts that are left to run.
+        """
+        resumed = self._checkpoint.resumed()
+        results_callback.write_resumed(resumed)
+        results_callback.add_recap("resumed", len(resumed))
+        return [host for host in list_hosts(self._sources) if host not in resumed]
 
-    def add_playbook_tasks(self, *args):
-        for arg in args:
-            if isinstance(arg, list):
-                self._playbook_tasks.extend(arg)
-            else:
-                self._playbook_tasks.append(arg)
+    def _serve_cache(self, results_callback, hosts=None):
+        """Feed the cached fields of every host to the results callback.
 
-    def playbook_tasks(self):
-        if not self._playbook_tasks:
-            return None
-        return self._playbook_tasks
+        The fields of the hosts that still have to be run are held until the
+        run of the host is done. Return the hosts that still have to be run, and among them the ones
+        whose static fields were served from the cache.
+        """
+        run_hosts = []
+        cached_hosts = []
+        if hosts is None:
+            hosts = list_hosts(self._sources)
+        for host in hosts:
+            served = self._cache.plan(host)
+            fields = {}
+            for group_fields in served.values():
+                fields.update(group_fields)
+            if len(served) < len(FIELD_GROUPS):
+                run_hosts.append(host)
+                if "static" in served:
+                    cached_hosts.append(host)
+                if fields:
+                    results_callback.hold_cached(host, fields)
+            elif fields:
+                results_callback.update_results(host, fields)
+        return run_hosts, cached_hosts
+
+    def _runner(  # pylint: disable=too-many-arguments
+        self, play_source, private_data_dir, passwords, limit, event_handler, **options
+    ):
+        """Run the play against the ``limit`` hosts"""
+        with self._profiler.run() if self._profiler is not None else nullcontext():
+            if getattr(self.args, "engine", "ansible") == "ssh":
+                self._run_ssh_engine(
+                    play_source, limit, event_handler, options.get("extravars")
+                )
+                return
+            if options.get("forks") is None:
+                options["forks"] = self._forks.forks()
+            if self._debug_artifacts is None:
+                options.update(verbosity=DEFAULT_VERBOSITY, suppress_output_file=True)
+            else:
+                options.update(
+                    verbosity=DEBUG_VERBOSITY, artifact_dir=self._debug_artifacts
+                )
+            self._forks.record(options["forks"])
+            _lazy("ansible_runner").run(
+                private_data_dir=private_data_dir,
+                playbook=[play_source],
+                passwords=passwords,
+                limit=limit,
+                quiet=True,
+                event_handler=event_handler,
+                **options,
+            )
 
-    def _run_ansible(self, play_source, private_data_dir, passwords):
-        """Run Ansible playbook and process events."""
-        runner = ansible_runner.run(
-            private_data_dir=private_data_dir,
-            playbook=[play_source],
-            passwords=passwords,
-            forks=10,
-            verbosity=3,
-            quiet=True,
+    def _run_ssh_engine(self, play_source, limit, event_handler, extravars=None):
+        """Run the play against the ``limit`` hosts with the ssh engine"""
+        ssh_engine = _lazy("ssh_engine")
+        if self._ssh_engine is None:
+            self._ssh_engine = ssh_engine.SSHEngine(
+                ssh_engine.AsyncSSHTransport(),
+                read_modules(get_path("modules")),
+                collector_tasks(play_source),
+                getattr(self.args, "ssh_concurrency", DEFAULT_SSH_CONCURRENCY),
+            )
+            self._ssh_connections = list_connections(self._sources)
+
+        hosts = list(self._ssh_connections)
+        if limit is not None:
+            with open(limit[1:]) as f:  # pylint: disable=invalid-name
+                hosts = f.read().split()
+        self._ssh_engine.run(
+            [
+                ssh_engine.SSHTarget(host, **self._ssh_connections[host])
+                for host in hosts
+            ],
+            event_handler,
+            extravars,
         )
 
-        if self.args.measurement:
-            results_callback = MeasurementsResultCallback(plugins=self._plugins)
-        else:
-            results_callback = ResultCallback(plugins=self._plugins)
+    def _run_ansible(self, play_source, private_data_dir, passwords, stream=None):
+        """Run Ansible playbook and process events as they are emitted."""
+        start = time.perf_counter()
+        results_callback = self._results_callback(play_source, stream)
+        envvars = ssh_envvars(
+            getattr(self.args, "ssh_profile", "default"), private_data_dir
+        )
+        # Hosts to run again without pipelining, if pipelining is enabled
+        tty_hosts = set() if envvars.get("ANSIBLE_PIPELINING") == "True" else None
+        retries = getattr(self.args, "retries", 0)
+        retry_hosts = set() if retries > 0 else None
+
+        hosts = None
+        extravars = {}
+        if self._checkpoint is not None and getattr(self.args, "resume", False):
+            hosts = self._resume(results_callback)
+        if self._cache is not None:
+            hosts, cached_hosts = self._serve_cache(results_callback, hosts)
+            extravars[CACHED_HOSTS_VAR] = cached_hosts
+
+        stats = {}
+        for limit in self._batches(private_data_dir, hosts):
+            self._runner(
+                play_source,
+                private_data_dir,
+                passwords,
+                limit,
+                self._event_handler(results_callback, stats, tty_hosts, retry_hosts),
+                envvars=envvars,
+                extravars=extravars,
+            )
+            # Write out the finished batch so its results can be released.
+            results_callback.flush()
+
+        if tty_hosts:
+            envvars = without_pipelining(envvars)
+            self._runner(
+                play_source,
+                private_data_dir,
+                passwords,
+                self._limit(private_data_dir, "requiretty", sorted(tty_hosts)),
+                self._event_handler(results_callback, stats, retry_hosts=retry_hosts),
+                envvars=envvars,
+                extravars=extravars,
+            )
+            results_callback.flush()
+            results_callback.add_recap("pipelining disabled", len(tty_hosts))
+
+        if retries > 0:
+            stats["attempts"] = {}
+        for attempt in range(1, retries + 1):
+            if not retry_hosts:
+                break
+            hosts = sorted(retry_hosts)
+            # Failures of the last attempt are reported.
+            retry_hosts = set() if attempt < retries else None
+            for host in hosts:
+                stats["attempts"][host] = attempt + 1
+            time.sleep(getattr(self.args, "retry_backoff", 0) * 2 ** (attempt - 1))
+            self._runner(
+                play_source,
+                private_data_dir,
+                passwords,
+                self._limit(private_data_dir, f"retry_{attempt}", hosts),
+                self._event_handler(results_callback, stats, retry_hosts=retry_hosts),
+                envvars=envvars,
+                extravars=extravars,
+                forks=getattr(self.args, "retry_forks", None),
+            )
+            results_callback.flush()
 
-        for event in runner.events:
-            if event["event"] == "runner_on_ok":
-                results_callback.v2_runner_on_ok(ShimResult(event))
-            elif event["event"] == "runner_on_unreachable":
-                results_callback.v2_runner_on_unreachable(ShimResult(event))
-            elif event["event"] == "runner_on_failed":
-                results_callback.v2_runner_on_failed(ShimResult(event))
+        if self._cache is not None:
+            results_callback.add_recap("cache", self._cache.describe())
 
-        results_callback.v2_playbook_on_stats(runner.stats)
+        if getattr(self.args, "engine", "ansible") == "ssh":
+            results_callback.add_recap(
+                "ssh concurrency",
+                getattr(self.args, "ssh_concurrency", DEFAULT_SSH_CONCURRENCY),
+            )
+        else:
+            results_callback.add_recap("forks", self._forks.describe())
+        if self._profiler is not None:
+            results_callback.flush()
+            self._profiler.add("total", time.perf_counter() - start)
+            for label, value in self._profiler.recap():
+                results_callback.add_recap(label, value)
+            profile_file = getattr(self.args, "profile_file", None)
+            if profile_file:
+                self._profiler.write(profile_file)
+        results_callback.v2_playbook_on_stats(stats)
+        if self._checkpoint is not None:
+            self._checkpoint.close()
+
+    def _run_local(self, play_source, stream=None):
+        """Run the play against the current machine, in-process"""
+        results_callback = self._results_callback(play_source, stream)
+        stats = {}
+        handler = self._event_handler(results_callback, stats)
+        tasks = [
+            dict(task, skip=not collector.applies(task, LOCAL_HOST, {}))
+            for task in collector_tasks(play_source)
+        ]
+        modules = collector.load_modules(read_modules(get_path("modules")))
+        counters = {key: {} for key in ("ok", "dark", "failures", "skipped")}
+        counters["processed"] = {LOCAL_HOST: 1}
+
+        def report(index, result, duration):
+            event = collector.runner_event(LOCAL_HOST, tasks[index], result, duration)
+            counter = counters[collector.EVENT_COUNTERS[event["event"]]]
+            counter[LOCAL_HOST] = counter.get(LOCAL_HOST, 0) + 1
+            handler(event)
+
+        collector.run_tasks(modules, tasks, report)
+        handler({"event": "playbook_on_stats", "event_data": counters})
+        results_callback.v2_playbook_on_stats(stats)
 
     def _copy_inventory_files(self, private_data_dir):
         # for each source in self._sources: copy it to private_data_dir/inventory
@@ -410,12 +683,16 @@ class Application:  # pylint: disable=too-few-public-methods
 
     def run(self):
         """Run the Application"""
-        play_source = dict(
-            name="Ansible Play",
-            hosts="all",
-            gather_facts="yes",
-            tasks=self.playbook_tasks(),
-        )
+        play_source = self.play_source()
+        output = getattr(self.args, "output", None)
+
+        if getattr(self.args, "local", False):
+            if output is None:
+                self._run_local(play_source)
+            else:
+                with open(output, "w", buffering=OUTPUT_BUFFER_SIZE) as stream:
+                    self._run_local(play_source, stream)
+            return
 
         private_data_dir = tempfile.mkdtemp()
         passwords = dict(vault_pass="secret")
@@ -423,7 +700,16 @@ class Application:  # pylint: disable=too-few-public-methods
 
         self._copy_inventory_files(private_data_dir)
 
-        self._run_ansible(play_source, private_data_dir, passwords)
+        if self._forks.adaptive:
+            self._forks.host_count = getattr(self.args, "batch_size", None) or len(
+                list_hosts(self._sources)
+            )
+
+        if output is None:
+            self._run_ansible(play_source, private_data_dir, passwords)
+        else:
+            with open(output, "w", buffering=OUTPUT_BUFFER_SIZE) as stream:
+                self._run_ansible(play_source, private_data_dir, passwords, stream)
 
         # Remove ansible tmpdir
         shutil.rmtree(private_data_dir)
@@ -448,6 +734,160 @@ def main():
         help="print the machine stats version",
         action="store_true",)
 
+    parser.add_argument(
+        "-f",
+        "--forks",
+        metavar="N",
+        type=parse_forks,
+        default=DEFAULT_FORKS,
+        help="number of parallel processes to use, or 'auto' to pick it from "
+        "the CPU count, the open files limit and the observed host latency "
+        "(default %d)" % DEFAULT_FORKS,
+    )
+
+    parser.add_argument(
+        "--batch-size",
+        metavar="N",
+        type=positive_int,
+        help="run the inventory in batches of N hosts, writing out and releasing "
+        "the results of each batch before starting the next one",
+    )
+
+    parser.add_argument(
+        "--ssh-profile",
+        choices=SSH_PROFILES,
+        default="default",
+        help="'performance' reuses one SSH connection per host for all tasks and "
+        "pipelines modules through it, falling back to no pipelining for hosts "
+        "where sudo requires a tty (default 'default')",
+    )
+
+    engine_args = parser.add_argument_group("engine arguments")
+    engine_args.add_argument(
+        "--engine",
+        choices=ENGINES,
+        default="ansible",
+        help="'ansible' runs the play with Ansible, 'ssh' connects to the hosts "
+        "directly and runs the machine_stats modules in a single Python script "
+        "on each, without Ansible on the way; it requires asyncssh "
+        "(default 'ansible')",
+    )
+    engine_args.add_argument(
+        "--ssh-concurrency",
+        metavar="N",
+        type=positive_int,
+        default=DEFAULT_SSH_CONCURRENCY,
+        help="number of hosts the ssh engine collects at the same time "
+        "(default %d)" % DEFAULT_SSH_CONCURRENCY,
+    )
+    engine_args.add_argument(
+        "--local",
+        action="store_true",
+        help="collect the current machine in-process instead of an inventory, "
+        "without running Ansible or SSH, e.g. from a cron job on hosts that can't be "
+        "reached over SSH",
+    )
+
+    parser.add_argument(
+        "--debug-artifacts",
+        metavar="DIR",
+        help="run Ansible verbosely and keep the ansible_runner artifacts, every "
+        "event and the output of every run, in DIR",
+    )
+
+    parser.add_argument(
+        "--fact-gathering",
+        choices=list(FACT_ACTIONS),
+        default="full",
+        help="'full' runs Ansible's setup module, 'minimal' reads only the facts "
+        "machine_stats reports straight from /proc and /etc/os-release "
+        "(default 'full')",
+    )
+
+    profile_args = parser.add_argument_group("profiling arguments")
+    profile_args.add_argument(
+        "--profile",
+        action="store_true",
+        help="report where the run spent its time in the recap: controller "
+        "phases, task durations and the slowest hosts",
+    )
+    profile_args.add_argument(
+        "--profile-file",
+        metavar="FILE",
+        help="write the profile to FILE as JSON (implies --profile)",
+    )
+
+    retry_args = parser.add_argument_group("retry arguments")
+    retry_args.add_argument(
+        "--retries",
+        metavar="N",
+        type=non_negative_int,
+        default=0,
+        help="run failed and unreachable hosts again up to N times (default 0)",
+    )
+    retry_args.add_argument(
+        "--retry-backoff",
+        metavar="SECONDS",
+        type=non_negative_float,
+        default=5.0,
+        help="wait SECONDS before the first retry, doubling before each next "
+        "one (default 5)",
+    )
+    retry_args.add_argument(
+        "--retry-forks",
+        metavar="N",
+        type=positive_int,
+        help="number of parallel processes to use for retries (default: the "
+        "same as --forks)",
+    )
+
+    parser.add_argument(
+        "--checkpoint",
+        metavar="DIR",
+        help="append every completed host to a journal in DIR, so an "
+        "interrupted run can be resumed",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="only run the hosts missing from the --checkpoint journal and "
+        "merge the journaled results into the output",
+    )
+
+    cache_args = parser.add_argument_group("cache arguments")
+    cache_args.add_argument(
+        "--cache",
+        metavar="DIR",
+        help="keep the results of every host in DIR and serve them from there "
+        "on the next runs while they are fresh",
+    )
+    cache_args.add_argument(
+        "--cache-ttl",
+        metavar="GROUP=SECONDS",
+        type=parse_ttl,
+        action="append",
+        help="how long the 'static' fields (CPU, RAM and storage sizes, OS, "
+        "names and addresses) or the 'volatile' fields (usage, CPU and process "
+        "stats) are served from the cache (default static=%d, volatile=0)"
+        % DEFAULT_TTLS["static"],
+    )
+
+    output_args = parser.add_argument_group("output arguments")
+    output_args.add_argument(
+        "--output-format",
+        choices=OUTPUT_FORMATS,
+        default="json",
+        help="'json' prints a single document once the run is finished, "
+        "'ndjson' writes one compact record per line as each host completes "
+        "(default 'json')",
+    )
+    output_args.add_argument(
+        "-o",
+        "--output",
+        metavar="FILE",
+        help="write the results to FILE instead of the standard output",
+    )
+
     measurement_args = parser.add_argument_group("measurements arguments")
     measurement_args.add_argument(
         "-m",
@@ -464,6 +904,12 @@ def main():
         print(f"machine_stats, version {__version__}")
         return
 
+    if getattr(args, "resume", False) and not args.checkpoint:
+        parser.error("--resume requires --checkpoint")
+
+    if getattr(args, "engine", "ansible") == "ssh" and find_spec("asyncssh") is None:
+        parser.error("--engine ssh requires asyncssh: pip install 'machine_stats[ssh]'")
+
     if not args.hosts:
         try:
             with open("hosts", "r") as f:  # pylint: disable=invalid-name
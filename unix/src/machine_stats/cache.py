@@ -0,0 +1,135 @@
+"""
+Per-host result cache for machine_stats
+"""
+
+import argparse
+import json
+import os
+import time
+from urllib.parse import quote
+
+from machine_stats.output import dumps
+
+# Result fields by how often they change. Fields that are not listed here,
+# including the ones added by plugins, are volatile.
+STATIC_FIELDS = (
+    "host_name",
+    "fqdn",
+    "ip_addresses",
+    "cpu_count",
+    "cpu_name",
+    "operating_system",
+    "operating_system_version",
+    "ram_allocated_gb",
+    "storage_allocated_gb",
+)
+
+FIELD_GROUPS = ("static", "volatile")
+
+# Seconds the fields of every group are served from the cache by default
+DEFAULT_TTLS = {
+    "static": 24 * 60 * 60,
+    "volatile": 0,
+}
+
+
+def field_group(field):
+    """Return the group of a result field"""
+    return "static" if field in STATIC_FIELDS else "volatile"
+
+
+def parse_ttl(value):
+    """argparse type for GROUP=SECONDS cache TTLs"""
+    group, _, seconds = value.partition("=")
+    if group not in FIELD_GROUPS:
+        raise argparse.ArgumentTypeError(
+            "unknown field group '%s', expected one of %s"
+            % (group, ", ".join(FIELD_GROUPS))
+        )
+    try:
+        seconds = int(seconds)
+    except ValueError:
+        raise argparse.ArgumentTypeError(  # pylint: disable=raise-missing-from
+            "invalid TTL '%s', expected GROUP=SECONDS" % value
+        )
+    if seconds < 0:
+        raise argparse.ArgumentTypeError("TTL must not be negative")
+    return group, seconds
+
+
+class ResultCache:
+    """On-disk cache of the results of every host
+
+    Every host has a JSON file in ``directory``, named after its inventory
+    hostname, holding the fields of each group together with the time they
+    were collected. A group is served from the cache while it is younger than
+    its TTL. The volatile fields are collected again whenever a host is run,
+    so they are only served when the whole host can be skipped.
+    """
+
+    def __init__(self, directory, ttls=None, now=None):
+        self.directory = directory
+        self.ttls = dict(DEFAULT_TTLS)
+        self.ttls.update(ttls or {})
+        self._now = time.time() if now is None else now
+        self._served = {}
+        self.hits = {group: 0 for group in FIELD_GROUPS}
+        self.misses = {group: 0 for group in FIELD_GROUPS}
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, host):
+        return os.path.join(self.directory, quote(host, safe="") + ".json")
+
+    def _load(self, host):
+        try:
+            with open(self._path(host)) as f:  # pylint: disable=invalid-name
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _fresh(self, entry, group):
+        return group in entry and self._now - entry[group]["time"] < self.ttls[group]
+
+    def plan(self, host):
+        """Return the cached fields to serve for ``host``, by group"""
+        entry = self._load(host)
+        served = {}
+        if self._fresh(entry, "static"):
+            served["static"] = entry["static"]["fields"]
+            if self._fresh(entry, "volatile"):
+                served["volatile"] = entry["volatile"]["fields"]
+
+        for group in FIELD_GROUPS:
+            if group in served:
+                self.hits[group] += 1
+            else:
+                self.misses[group] += 1
+        self._served[host] = set(served)
+        return served
+
+    def store(self, host, server):
+        """Save the fields of ``server`` that were not served from the cache"""
+        served = self._served.pop(host, set())
+        if len(served) == len(FIELD_GROUPS):
+            return
+
+        entry = self._load(host)
+
+        fields = {group: {} for group in FIELD_GROUPS}
+        for field, value in server.items():
+            fields[field_group(field)][field] = value
+        for group in FIELD_GROUPS:
+            if group not in served and fields[group]:
+                entry[group] = {"time": self._now, "fields": fields[group]}
+
+        path = self._path(host)
+        with open(path + ".tmp", "w") as f:  # pylint: disable=invalid-name
+            f.write(dumps(entry))
+        os.replace(path + ".tmp", path)
+
+    def describe(self):
+        """Return the cache hits and misses of every group for the recap"""
+        return ", ".join(
+            "%s %d hits %d misses" % (group, self.hits[group], self.misses[group])
+            for group in FIELD_GROUPS
+        )
@@ -0,0 +1,393 @@
+"""
+Ansible result callbacks of machine_stats
+
+Importing this module imports Ansible, so machine_stats only imports it once a
+play is about to run.
+"""
+
+import ansible.constants as C
+from ansible.plugins.callback import CallbackBase
+from ansible.utils.color import colorize, hostcolor
+from ansible.utils.display import Display
+
+from machine_stats.output import JSONDocumentWriter
+from machine_stats.results import HostResult
+
+display = Display()
+
+
+def ram_allocated_gb(facts):
+    """Return total memory allocation in GB"""
+    return facts["ansible_memtotal_mb"] / 1024
+
+
+def ram_used_gb(facts):
+    """Return used memory in GB"""
+    return (facts["ansible_memtotal_mb"] - facts["ansible_memfree_mb"]) / 1024
+
+
+def _size(key, mounts):
+    return sum([item.get(key, 0) for item in mounts])
+
+
+def storage_allocated_gb(facts):
+    """Return total storage allocation in GB"""
+    if "ansible_mounts" not in facts:
+        return 0
+    return _size("size_total", facts["ansible_mounts"]) / 1024**3
+
+
+def storage_used_gb(facts):
+    """Return used storage in GB"""
+    if "ansible_mounts" not in facts:
+        return 0
+    return (
+        _size("size_total", facts["ansible_mounts"])
+        - _size("size_available", facts["ansible_mounts"])
+    ) / 1024**3
+
+
+def cpu_logical_processors(facts):
+    """Return the number of CPU logical processors."""
+    return int(facts.get("ansible_processor_vcpus", 0))
+
+
+def cpu_name(proc):
+    """Return CPU name"""
+    items_count = len(proc)
+    if items_count == 1:
+        return proc[0]
+    if items_count >= 3:
+        return proc[2]
+    return "Unknown"
+
+
+def ip_addresses(facts):
+    """Return IP addresses formatted for the tidal API"""
+    return list(
+        map(
+            lambda ip: {"address": ip},
+            facts["ansible_all_ipv4_addresses"] + facts["ansible_all_ipv6_addresses"],
+        )
+    )
+
+
+class ResultCallback(CallbackBase):
+    """A sample callback plugin used for performing an action as results come in
+
+    If you want to collect all results into a single object for processing at
+    the end of the execution, look into utilizing the ``json`` callback plugin
+    or writing your own custom callback plugin.
+    """
+
+    output_key = "servers"
+
+    def __init__(  # pylint: disable=too-many-arguments
+        self,
+        plugins,
+        *args,
+        writer=None,
+        expected_tasks=None,
+        cache=None,
+        checkpoint=None,
+        **kwargs,
+    ):
+        super().__init__(*args, **kwargs)
+        self._total_results = None
+        self._plugins = plugins
+        self._recap = []
+        if writer is None:
+            writer = JSONDocumentWriter(self.output_key)
+        self._writer = writer
+        # Number of tasks every host runs, used to tell when a host is done.
+        self._expected_tasks = expected_tasks
+        self._finished_tasks = {}
+        self._cache = cache
+        self._checkpoint = checkpoint
+        # Cached fields of the hosts, added once their run succeeds
+        self._cached_fields = {}
+
+    def add_recap(self, label, value):
+        """Add an extra line to the MACHINE STATS RECAP"""
+        self._recap.append((label, value))
+
+    def _task_finished(self, host, last=False):
+        """Count a finished task and write the host out once it is done"""
+        finished = self._finished_tasks.get(host, 0) + 1
+        self._finished_tasks[host] = finished
+        if last or finished == self._expected_tasks:
+            del self._finished_tasks[host]
+            cached = self._cached_fields.pop(host, None)
+            # Hosts failing before anything was collected are left out, the
+            # others are completed from the cache like the successful ones.
+            collected = bool(self._total_results) and host in self._total_results
+            if cached is not None and (collected or not last):
+                self.update_results(host, cached)
+            self._host_done(host)
+
+    def hold_cached(self, host, fields):
+        """Add the cached fields of a host once its run is done, unless it
+        failed before anything was collected"""
+        self._cached_fields[host] = fields
+
+    def restart_host(self, host):
+        """Drop the results and finished tasks of a host that is going to be
+        run again, so the new run starts from a clean record
+
+        Its cached fields are kept until the new run succeeds.
+        """
+        self._finished_tasks.pop(host, None)
+        if self._total_results:
+            self._total_results.pop(host, None)
+
+    def _host_done(self, host):
+        if not self._total_results:
+            return
+        if self._checkpoint is not None and host in self._total_results:
+            self._checkpoint.record(host, self._total_results[host].build())
+        if not self._writer.streaming:
+            return
+        server = self._total_results.pop(host, None)
+        if server is not None:
+            self._finish_host(host, server.build())
+
+    def _finish_host(self, host, server):
+        """Save a completed host to the cache and write it out"""
+        if self._cache is not None:
+            self._cache.store(host, server)
+        if self._checkpoint is not None:
+            self._checkpoint.record(host, server)
+        self._write_server(server)
+
+    def v2_runner_on_unreachable(self, result):
+        host = result._host  # pylint: disable=protected-access
+        self._display.error(
+            "{0}: {1}".format(
+                host.get_name(),
+                result._result["msg"],  # pylint: disable=protected-access
+            ),
+            wrap_text=False,
+        )
+        self._task_finished(host.get_name(), last=True)
+
+    def v2_runner_on_failed(self, result, *args, **kwargs):
+        del args, kwargs  # Unused
+        host = result._host  # pylint: disable=protected-access
+        self._display.error(
+            "{0}: {1}".format(
+                host.get_name(),
+                result._result["msg"],  # pylint: disable=protected-access
+            ),
+            wrap_text=False,
+        )
+        self._task_finished(host.get_name(), last=True)
+
+    def v2_runner_on_skipped(self, result):
+        self._task_finished(result._host.get_name())
+
+    def update_results(self, host, data: dict):
+        """Add fields to the result of a host
+
+        Nested dicts such as ``custom_fields`` are merged with the ones added
+        before, once the host is done.
+        """
+        if self._total_results is None:
+            self._total_results = {}
+
+        results = self._total_results.get(host)
+        if results is None:
+            self._total_results[host] = HostResult(data)
+        else:
+            results.add(data)
+
+    def v2_runner_on_ok(self, result):
+        self._plugins.ok_callback(self, result)
+        host = result._host.get_name()
+        # pylint: disable-next=protected-access
+        facts = result._result.get("ansible_facts") or {}
+        # Other modules can return facts too, e.g. the discovered interpreter.
+        if "ansible_hostname" in facts:
+            self.update_results(
+                host,
+                {
+                    "host_name": facts["ansible_hostname"],
+                    "fqdn": facts["ansible_fqdn"],
+                    "ip_addresses": facts["ansible_all_ipv4_addresses"]
+                    + facts["ansible_all_ipv6_addresses"],
+                    "ram_allocated_gb": ram_allocated_gb(facts),
+                    "ram_used_gb": ram_used_gb(facts),
+                    "storage_allocated_gb": storage_allocated_gb(facts),
+                    "storage_used_gb": storage_used_gb(facts),
+                    "cpu_count": cpu_logical_processors(facts),
+                    "operating_system": facts["ansible_distribution"],
+                    "operating_system_version": facts["ansible_distribution_version"],
+                    "cpu_name": cpu_name(facts["ansible_processor"]),
+                },
+            )
+        elif "ansible_memtotal_mb" in facts:
+            # Only the usage facts were gathered, the rest is cached.
+            self.update_results(
+                host,
+                {
+                    "ram_allocated_gb": ram_allocated_gb(facts),
+                    "ram_used_gb": ram_used_gb(facts),
+                    "storage_allocated_gb": storage_allocated_gb(facts),
+                    "storage_used_gb": storage_used_gb(facts),
+                },
+            )
+        self._task_finished(host)
+
+    def _display_results(self, host, result):
+        line = "%s : %s %s %s %s %s %s %s" % (
+            hostcolor(host, result),
+            colorize("ok", result["ok"], C.COLOR_OK),  # pylint: disable=no-member
+            colorize(
+                "changed",
+                result["changed"],
+                C.COLOR_CHANGED,  # pylint: disable=no-member
+            ),
+            colorize(
+                "unreachable",
+                result["unreachable"],
+                C.COLOR_UNREACHABLE,  # pylint: disable=no-member
+            ),
+            colorize(
+                "failed",
+                result["failures"],
+                C.COLOR_ERROR,  # pylint: disable=no-member
+            ),
+            colorize(
+                "skipped",
+                result["skipped"],
+                C.COLOR_SKIP,  # pylint: disable=no-member
+            ),
+            colorize(
+                "rescued",
+                result["rescued"],
+                C.COLOR_OK,  # pylint: disable=no-member
+            ),
+            colorize(
+                "ignored",
+                result["ignored"],
+                C.COLOR_WARN,  # pylint: disable=no-member
+            ),
+        )
+        if "attempts" in result:
+            line += " " + colorize(
+                "attempts",
+                result["attempts"],
+                # pylint: disable-next=no-member
+                C.COLOR_WARN if result["attempts"] > 1 else None,
+            )
+        self._display.display(line, screen_only=True, stderr=True)
+
+    def _write_server(self, server):
+        self._writer.write(server)
+
+    def write_resumed(self, servers):
+        """Write out the hosts completed by a previous run, by name
+
+        They are neither journaled nor cached again, so the cache keeps the
+        time they were actually collected at.
+        """
+        self._writer.open()
+        for server in servers.values():
+            self._write_server(server)
+
+    def flush(self):
+        """Write the results collected so far and release them"""
+        if not self._total_results:
+            return
+        self._writer.open()
+        for host, results in self._total_results.items():
+            self._finish_host(host, results.build())
+        self._total_results.clear()
+
+    def v2_playbook_on_stats(self, stats):
+        self.flush()
+        self._writer.close()
+
+        self._display.display("MACHINE STATS RECAP", stderr=True)
+
+        hosts = sorted(stats.get("processed", {}).keys())
+        for host in hosts:  # pylint: disable=invalid-name
+            result = {
+                "ok": stats.get("ok", {}).get(host, 0),
+                "changed": stats.get("changed", {}).get(host, 0),
+                "unreachable": stats.get("dark", {}).get(host, 0),
+                "failures": stats.get("failures", {}).get(host, 0),
+                "skipped": stats.get("skipped", {}).get(host, 0),
+                "rescued": stats.get("rescued", {}).get(host, 0),
+                "ignored": stats.get("ignored", {}).get(host, 0),
+            }
+            if "attempts" in stats:
+                result["attempts"] = stats["attempts"].get(host, 1)
+            self._display_results(host, result)
+
+        for label, value in self._recap:
+            self._display.display("%s: %s" % (label, value), stderr=True)
+
+        self._display.display("", screen_only=True, stderr=True)
+
+
+class MeasurementsResultCallback(ResultCallback):
+    """
+    How to measure fields
+
+    The fields that need to be tracked can be added in the fields_to_measure list.
+    If it's a custom field, please add it to the custom_fields_to_measure list.
+    """
+
+    output_key = "measurements"
+
+    fields_to_measure = []
+    custom_fields_to_measure = [
+        "cpu_average",
+        "cpu_peak",
+        "cpu_utilization",
+        "cpu_user",
+        "cpu_system",
+        "cpu_iowait",
+        "cpu_steal",
+        "cpu_core_peak",
+    ]
+
+    def measurements(self, server):
+        """Process JSON payload
+
+        Go through the fields of the server, and for the fields mentioned in the
+        `fields_to_measure` or `custom_fields_to_measure`, yield its measurements.
+        """
+        for field in server:
+            # Add data (ram_used_gb) from fields_to_measure list to the measurements
+            if field in self.fields_to_measure:
+                server_dict = {}
+                server_dict["measurable_type"] = "server"
+                server_dict["field_name"] = field + "_timeseries"
+                server_dict["value"] = server[field]
+                server_dict["measurable"] = {"host_name": server["host_name"]}
+
+                yield server_dict
+
+            # Add custom fields data (cpu_average) from custom_fields_to_measure list to the measurements
+            elif field == "custom_fields":
+                for custom_field in server["custom_fields"]:
+                    if custom_field in self.custom_fields_to_measure:
+                        server_dict = {}
+                        server_dict["measurable_type"] = "server"
+                        server_dict["field_name"] = custom_field + "_timeseries"
+                        server_dict["value"] = server["custom_fields"][custom_field]
+                        server_dict["external_timestamp"] = server["custom_fields"][
+                            "cpu_utilization_timestamp"
+                        ]
+                        server_dict["measurable"] = {"host_name": server["host_name"]}
+
+                        yield server_dict
+
+    def _write_server(self, server):
+        for measurement in self.measurements(server):
+            self._writer.write(measurement)
+
+    def v2_playbook_on_stats(self, stats):
+        self.flush()
+        self._writer.close()
@@ -0,0 +1,71 @@
+"""
+Checkpoint journal for resumable machine_stats runs
+"""
+
+import json
+import os
+
+from machine_stats.output import dumps
+
+JOURNAL_FILE = "journal.ndjson"
+
+
+class Checkpoint:
+    """Journal of the hosts completed by a run
+
+    Every completed host is appended to ``journal.ndjson`` in ``directory`` as
+    a ``{"host": ..., "result": ...}`` line and flushed right away, so the
+    journal survives the controller dying in the middle of a run. A new run
+    starts a new journal unless it resumes the previous one.
+    """
+
+    def __init__(self, directory, resume=False):
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, JOURNAL_FILE)
+        self._results = self._load() if resume else {}
+        self._hosts = set(self._results)
+        # pylint: disable-next=consider-using-with
+        self._journal = open(self.path, "a" if resume else "w")
+        if self._journal.tell() and not self._ends_with_newline():
+            # Keep a torn last line from swallowing the next record
+            self._journal.write("\n")
+
+    def _load(self):
+        results = {}
+        try:
+            with open(self.path) as f:  # pylint: disable=invalid-name
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:  # torn write of an interrupted run
+                        continue
+                    results[entry["host"]] = entry["result"]
+        except FileNotFoundError:
+            pass
+        return results
+
+    def _ends_with_newline(self):
+        with open(self.path, "rb") as f:  # pylint: disable=invalid-name
+            f.seek(-1, os.SEEK_END)
+            return f.read(1) == b"\n"
+
+    def resumed(self):
+        """Return the results of the hosts completed by the previous run"""
+        results, self._results = self._results, {}
+        return results
+
+    def __contains__(self, host):
+        return host in self._hosts
+
+    def record(self, host, server):
+        """Append a completed host to the journal, once"""
+        if host in self._hosts:
+            return
+        self._hosts.add(host)
+        self._journal.write(
+            dumps({"host": host, "result": server}, separators=(",", ":")) + "\n"
+        )
+        self._journal.flush()
+
+    def close(self):
+        self._journal.close()
@@ -0,0 +1,200 @@
+"""
+Run the tasks of the machine_stats play without Ansible
+
+The machine_stats modules are run with a minimal stand-in for AnsibleModule,
+so they report exactly what they report under Ansible. The ssh engine sends
+this file to the hosts and runs ``main`` there, so it has to stay compatible
+with Python 2.7 and can't import anything from machine_stats. ``--local``
+runs the modules in-process with ``load_modules`` and ``run_tasks``.
+"""
+
+import json
+import os
+import re
+import sys
+import threading
+import time
+import types
+
+# Modules the collector can run, with the Ansible modules they replace
+COLLECTOR_MODULES = ("machine_facts", "cpu_utilization", "proc_stats")
+REPLACED_MODULES = {"setup": "machine_facts"}
+
+# Conditions of the play tasks the collector understands, see
+# Application.play_source
+WHEN = re.compile(r"^inventory_hostname (not )?in (\w+)$")
+
+# Counters of the play recap stats of each runner event
+EVENT_COUNTERS = {
+    "runner_on_ok": "ok",
+    "runner_on_skipped": "skipped",
+    "runner_on_failed": "failures",
+    "runner_on_unreachable": "dark",
+}
+
+_local = threading.local()
+
+
+class Exit(BaseException):
+    """Raised by exit_json and fail_json, not an Exception like the SystemExit
+    of Ansible's, so the modules' error handling doesn't catch it"""
+
+
+class AnsibleModule(object):
+    """Stand-in for Ansible's AnsibleModule, with the args of the current task"""
+
+    def __init__(self, argument_spec, supports_check_mode=False):
+        del supports_check_mode  # Unused
+        self.check_mode = False
+        self.params = dict((k, v.get("default")) for k, v in argument_spec.items())
+        self.params.update(_local.args)
+
+    def exit_json(self, **result):
+        raise Exit(result)
+
+    def fail_json(self, **result):
+        result["failed"] = True
+        raise Exit(result)
+
+
+def collector_tasks(play_source):
+    """Return the tasks of the play, as the collector runs them
+
+    Facts gathered by Ansible's setup module are read by machine_facts
+    instead, under the same names, and async_status tasks wait for the result
+    of the oldest asynchronous task still running.
+    """
+    tasks = []
+    if play_source.get("gather_facts") == "yes":
+        tasks.append(dict(module="machine_facts", args={}))
+    for section in ("pre_tasks", "tasks", "post_tasks"):
+        for task in play_source.get(section) or []:
+            action = task["action"]
+            module = REPLACED_MODULES.get(action["module"], action["module"])
+            collector_task = dict(module=module, args={}, when=task.get("when"))
+            if module == "async_status":
+                collector_task["async_status"] = True
+            elif module not in COLLECTOR_MODULES:
+                raise ValueError("the collector can't run the %s module" % module)
+            elif module == action["module"]:
+                collector_task["args"] = dict(action.get("args") or {})
+            if task.get("async"):
+                collector_task["async"] = True
+            tasks.append(collector_task)
+    return tasks
+
+
+def applies(task, host, extravars):
+    """Return whether the ``when`` condition of a task holds for ``host``"""
+    when = task.get("when")
+    if not when:
+        return True
+    match = WHEN.match(when)
+    if match is None:
+        raise ValueError("the collector can't evaluate %r" % when)
+    hosts = extravars.get(match.group(2)) or []
+    return (host in hosts) != bool(match.group(1))
+
+
+def runner_event(host, task, res, duration):
+    """Return the ansible_runner event of the result of a task"""
+    if res.get("skipped"):
+        event = "runner_on_skipped"
+    elif res.get("failed"):
+        event = "runner_on_failed"
+    else:
+        event = "runner_on_ok"
+    return {
+        "event": event,
+        "event_data": dict(
+            host=host, res=res, task_action=task["module"], duration=duration
+        ),
+    }
+
+
+def read_modules(modules_dir):
+    """Return the sources of the collector modules, by name"""
+    sources = {}
+    for name in COLLECTOR_MODULES:
+        with open(os.path.join(modules_dir, name + ".py")) as f:
+            sources[name] = f.read()
+    return sources
+
+
+def load_modules(sources):
+    """Return the namespaces of the modules of ``sources``, by name
+
+    The modules use the stand-in AnsibleModule, even if they imported
+    Ansible's.
+    """
+    modules = {}
+    for name, source in sources.items():
+        namespace = {"__name__": "machine_stats_" + name}
+        exec(compile(source, name, "exec"), namespace)  # pylint: disable=exec-used
+        namespace["AnsibleModule"] = AnsibleModule
+        modules[name] = namespace
+    return modules
+
+
+def run_task(modules, task):
+    """Run a task and return its result and duration"""
+    _local.args = task["args"]
+    start = time.time()
+    try:
+        modules[task["module"]]["run_module"]()
+        result = {}
+    except Exit as e:
+        result = e.args[0]
+    except Exception as e:  # pylint: disable=broad-except
+        result = {"failed": True, "msg": str(e)}
+    return result, time.time() - start
+
+
+def run_tasks(modules, tasks, report):
+    """Run ``tasks`` with the ``modules`` namespaces, by name, and call
+    ``report(index, result, duration)`` with the result of every task
+
+    Asynchronous tasks run in a thread until their async_status task. Tasks
+    marked ``skip`` are reported as skipped, and a failed task stops the run.
+    """
+    jobs = []
+    for index, task in enumerate(tasks):
+        if task.get("async"):
+            job = {}
+            thread = threading.Thread(
+                target=lambda t=task, j=job: j.update(r=run_task(modules, t))
+            )
+            thread.start()
+            jobs.append((thread, job))
+            report(index, {"started": 1, "finished": 0}, 0.0)
+            continue
+        if task.get("async_status"):
+            thread, job = jobs.pop(0)
+            thread.join()
+            result, duration = job["r"]
+        elif task.get("skip"):
+            result, duration = {"skipped": True}, 0.0
+        else:
+            result, duration = run_task(modules, task)
+        report(index, result, duration)
+        if result.get("failed"):
+            break
+
+
+def main(payload):
+    """Run the tasks of ``payload`` with the module sources it carries and
+    write every result to the standard output as a JSON line"""
+    for name in ("ansible", "ansible.module_utils"):
+        sys.modules.setdefault(name, types.ModuleType(name))
+    basic = types.ModuleType("ansible.module_utils.basic")
+    basic.AnsibleModule = AnsibleModule
+    sys.modules["ansible.module_utils.basic"] = basic
+
+    modules = load_modules(payload["modules"])
+
+    def report(index, result, duration):
+        line = {"task": index, "res": result, "duration": duration}
+        sys.stdout.write(json.dumps(line, default=str) + "\n")
+        sys.stdout.flush()
+
+    run_tasks(modules, payload["tasks"], report)
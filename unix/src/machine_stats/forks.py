@@ -0,0 +1,107 @@
+"""
+Concurrency tuning for machine_stats
+"""
+
+import os
+import resource
+import statistics
+
+# File descriptors used by a single fork: the SSH client, its pipes and the
+# control socket.
+FDS_PER_FORK = 8
+
+# File descriptors kept back for the controller itself.
+RESERVED_FDS = 64
+
+# Controller CPU time spent on a single host (module packaging, result
+# parsing). Forks waiting on the network do not use the CPU, so the longer a
+# host takes the more forks one CPU can drive.
+CPU_SECONDS_PER_HOST = 0.5
+
+# Per-host latency assumed until real hosts have been observed.
+DEFAULT_HOST_LATENCY = 5.0
+
+
+def parse_forks(value):
+    """Parse the --forks argument: a positive number or 'auto'"""
+    if value == "auto":
+        return None
+    forks = int(value)
+    if forks < 1:
+        raise ValueError("forks must be a positive number")
+    return forks
+
+
+def fd_limit():
+    """Return the soft limit of open file descriptors, or None if unlimited"""
+    soft, _ = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft == resource.RLIM_INFINITY:
+        return None
+    return soft
+
+
+class ForkTuner:
+    """Pick the number of Ansible forks
+
+    With a fixed fork count the tuner simply returns it. In adaptive mode
+    (``forks=None``) the count is derived from the local CPU count, the
+    file descriptor limit and the per-host latency observed so far.
+    """
+
+    def __init__(self, forks=None, host_count=None, latency=DEFAULT_HOST_LATENCY):
+        self._forks = forks
+        self.host_count = host_count
+        self._default_latency = latency
+        self._host_latency = {}
+        # Fork counts the runs were started with, and the limits and latency
+        # behind the last adaptive one
+        self._used = []
+        self._decision = None
+
+    @property
+    def adaptive(self):
+        return self._forks is None
+
+    def observe(self, host, seconds):
+        """Record the time a host spent on a single task"""
+        self._host_latency[host] = self._host_latency.get(host, 0) + seconds
+
+    @property
+    def latency(self):
+        """Median per-host latency, falling back to the default estimate"""
+        if not self._host_latency:
+            return self._default_latency
+        return statistics.median(self._host_latency.values())
+
+    def limits(self):
+        """Return the upper bounds considered in adaptive mode"""
+        per_cpu = max(1, int(self.latency / CPU_SECONDS_PER_HOST))
+        limits = {"cpu": (os.cpu_count() or 1) * per_cpu}
+        fds = fd_limit()
+        if fds is not None:
+            limits["fd"] = max(1, (fds - RESERVED_FDS) // FDS_PER_FORK)
+        if self.host_count:
+            limits["hosts"] = self.host_count
+        return limits
+
+    def forks(self):
+        """Return the number of forks to use for the next run"""
+        if not self.adaptive:
+            return self._forks
+        limits = self.limits()
+        self._decision = (limits, self.latency)
+        return max(1, min(limits.values()))
+
+    def record(self, forks):
+        """Record the number of forks a run is started with"""
+        if not self._used or self._used[-1] != forks:
+            self._used.append(forks)
+
+    def describe(self):
+        """Return a human readable summary of the forks used, for the recap"""
+        used = ", ".join(str(forks) for forks in self._used) or str(self.forks())
+        if self._decision is None:
+            return used
+        limits, latency = self._decision
+        limits = ", ".join("%s=%d" % item for item in sorted(limits.items()))
+        return "%s (auto: %s, latency=%.1fs)" % (used, limits, latency)
@@ -0,0 +1,51 @@
+"""
+Inventory helpers for machine_stats
+"""
+
+
+def list_hosts(sources):
+    """Return the names of all hosts defined in the given inventory sources"""
+    if not sources:
+        return []
+    # Imported here, see machine_stats.LAZY_IMPORTS
+    # pylint: disable-next=import-outside-toplevel
+    from ansible.inventory.manager import InventoryManager
+
+    # pylint: disable-next=import-outside-toplevel
+    from ansible.parsing.dataloader import DataLoader
+
+    inventory = InventoryManager(loader=DataLoader(), sources=list(sources))
+    return [host.name for host in inventory.get_hosts()]
+
+
+# Inventory variables of the connection settings of a host
+CONNECTION_VARS = dict(
+    address="ansible_host",
+    port="ansible_port",
+    user="ansible_user",
+    key_file="ansible_ssh_private_key_file",
+    password="ansible_password",
+)
+
+
+def list_connections(sources):
+    """Return the connection settings of all hosts defined in the given
+    inventory sources, by host name"""
+    if not sources:
+        return {}
+    # pylint: disable=import-outside-toplevel
+    from ansible.inventory.manager import InventoryManager
+    from ansible.parsing.dataloader import DataLoader
+    from ansible.vars.manager import VariableManager
+
+    # pylint: enable=import-outside-toplevel
+    loader = DataLoader()
+    inventory = InventoryManager(loader=loader, sources=list(sources))
+    variables = VariableManager(loader=loader, inventory=inventory)
+    connections = {}
+    for host in inventory.get_hosts():
+        host_vars = variables.get_vars(host=host, include_hostvars=False)
+        settings = {key: host_vars.get(name) for key, name in CONNECTION_VARS.items()}
+        settings["address"] = settings["address"] or host.name
+        connections[host.name] = settings
+    return connections
@@ -2,8 +2,14 @@
 
 ANSIBLE_METADATA = {"metadata_version": "1.1"}
 
+import os
 from time import sleep
 
+try:
+    from time import monotonic
+except ImportError:  # Python 2
+    from time import time as monotonic
+
 from ansible.module_utils.basic import AnsibleModule
 
 
@@ -11,7 +17,9 @@ def run_module():
     # define available arguments/parameters a user can pass to the module
     module_args = dict(
         timeout=dict(type="int", required=False, default=30),
+        interval=dict(type="float", required=False, default=1.0),
         only_value=dict(type="bool", required=False, default=False),
+        proc_root=dict(type="str", required=False, default=PROC_ROOT),
     )
 
     # seed the result dict in the object
@@ -36,19 +44,30 @@ def run_module():
     if module.params["timeout"] == 0 or module.check_mode:
         return module.exit_json(**result)
 
+    interval = module.params["interval"]
+    if not MIN_INTERVAL <= interval <= MAX_INTERVAL:
+        return module.fail_json(
+            msg="interval must be between %s and %s seconds"
+            % (MIN_INTERVAL, MAX_INTERVAL),
+            **result
+        )
+
     # get CPU utilization values
+    proc_root = module.params["proc_root"]
     try:
         if module.params["only_value"]:
-            value, rtc_date, rtc_time = cpu_utilization_value(module.params["timeout"])
+            value, rtc_date, rtc_time = cpu_utilization_value(
+                module.params["timeout"], proc_root=proc_root
+            )
             result["ansible_cpu_utilization"] = dict(
                 value=value, rtc_date=rtc_date, rtc_time=rtc_time
             )
         else:
-            average, peak, rtc_date, rtc_time = cpu_utilization(
-                module.params["timeout"]
+            summary, rtc_date, rtc_time = cpu_utilization(
+                module.params["timeout"], interval, proc_root=proc_root
             )
             result["ansible_cpu_utilization"] = dict(
-                average=average, peak=peak, rtc_date=rtc_date, rtc_time=rtc_time
+                summary, interval=interval, rtc_date=rtc_date, rtc_time=rtc_time
             )
     except Exception as e:
         return module.fail_json(msg=str(e), **result)
@@ -59,15 +78,99 @@ def run_module():
     return module.exit_json(**result)
 
 
-def get_perf():
-    with open("/proc/stat") as f:
-        fields = [float(column) for column in f.readline().strip().split()[1:]]
-        idle, total = fields[3], sum(fields)
-        return idle, total
+PROC_ROOT = "/proc"
+
+# Allowed range of the sampling interval, in seconds
+MIN_INTERVAL = 0.1
+MAX_INTERVAL = 10.0
+
+
+def _pread(fd, size=4096, offset=0):
+    """Read a file from ``offset`` without reopening it"""
+    if hasattr(os, "pread"):
+        return os.pread(fd, size, offset)
+    os.lseek(fd, offset, os.SEEK_SET)
+    return os.read(fd, size)
+
+
+def _read_cpu_lines(fd):
+    """Read /proc/stat up to the first complete line after the CPU lines,
+    with a single read unless the host has several hundred CPUs."""
+    data = b""
+    while True:
+        chunk = _pread(fd, 65536, len(data))
+        if not chunk:
+            return data
+        data += chunk
+        end = data.rfind(b"\n")
+        if end == -1:
+            continue
+        # The CPU lines come first, so the last complete line tells whether
+        # all of them have been read
+        last_line = data[data.rfind(b"\n", 0, end) + 1 : end]
+        if not last_line.startswith(b"cpu"):
+            return data
+
+
+def get_cpu_times(fd):
+    """Return the time columns of the aggregate "cpu" line and of every
+    "cpuN" line of /proc/stat, all taken from the same reading."""
+    times = {}
+    for line in _read_cpu_lines(fd).decode().split("\n"):
+        # The CPU lines come first, followed by intr, ctxt, ...
+        if not line.startswith("cpu"):
+            break
+        columns = line.split()
+        times[columns[0]] = [float(column) for column in columns[1:]]
+    return times
+
+
+def _utilization(previous, current):
+    """Return the CPU utilization between two readings of the same CPU line"""
+    idle_delta = current[3] - previous[3]
+    total_delta = sum(current) - sum(previous)
+    if total_delta == 0:
+        return 0.0
+    return 100.0 * (1.0 - idle_delta / total_delta)
+
+
+# Columns of the /proc/stat CPU lines reported in the utilization breakdown
+BREAKDOWN_COLUMNS = dict(
+    user=(0, 1),  # user, nice
+    system=(2, 5, 6),  # system, irq, softirq
+    iowait=(4,),
+    steal=(7,),
+)
+
+
+def _breakdown(first, last):
+    """Return the share of the CPU time spent in each breakdown category
+    between two readings of the same CPU line, in percent."""
+    deltas = [after - before for before, after in zip(first, last)]
+    total = sum(deltas)
+    breakdown = {}
+    for name, columns in BREAKDOWN_COLUMNS.items():
+        # Old kernels don't report the steal time
+        spent = sum(deltas[column] for column in columns if column < len(deltas))
+        breakdown[name] = 100.0 * spent / total if total else 0.0
+    return breakdown
+
+
+def get_perf(fd=None, proc_root=PROC_ROOT):
+    """Return the idle and total CPU time. An already open /proc/stat file
+    descriptor can be passed in to avoid reopening the file."""
+    if fd is None:
+        with open(os.path.join(proc_root, "stat")) as f:
+            line = f.readline()
+    else:
+        line = _pread(fd).decode().split("\n", 1)[0]
+    fields = [float(column) for column in line.strip().split()[1:]]
+    idle, total = fields[3], sum(fields)
+    return idle, total
 
 
-def get_date_time():
-    with open("/proc/driver/rtc") as t:
+def get_date_time(proc_root=PROC_ROOT):
+    with open(os.path.join(proc_root, "driver", "rtc")) as t:
         rtc_time_line = t.readline().strip().split()
         rtc_date_line = t.readline().strip().split()
 
@@ -77,54 +180,111 @@ def get_date_time():
         return rtc_date, rtc_time
 
 
-def cpu_utilization(timeout=1):
-    """
-    Calculate CPU utilization over a given timeout period.
-    :param timeout: Duration in seconds to monitor CPU utilization.
-    :return: Tuple containing average utilization, peak utilization,
-                RTC date, and RTC time.
+def percentile(samples, percent):
+    """Return the given percentile of the sorted samples, interpolating
+    linearly between the closest ranks."""
+    rank = (len(samples) - 1) * percent / 100.0
+    lower = int(rank)
+    upper = min(lower + 1, len(samples) - 1)
+    return samples[lower] + (samples[upper] - samples[lower]) * (rank - lower)
 
-    The default value is 1, which causes the function to run 1 time.
-    So if timeout is less than 1, return zeros.
 
+def sample_cpu_utilization(timeout, interval=1.0, proc_root=PROC_ROOT):
     """
-    last_idle = last_total = total_runs = 0
-    cpu_stats = []
+    Sample CPU utilization every interval seconds during timeout seconds.
+    :param timeout: Duration in seconds of the sampling window.
+    :param interval: Time in seconds between two samples.
+    :param proc_root: Mount point of the proc filesystem.
+    :return: Dictionary with the overall utilization "samples", one per
+                interval, the "per_core_peak" utilization of every core, and
+                the "breakdown" of the window into user, system, iowait and
+                steal time.
+
+    The first reading of /proc/stat only serves as the baseline, so that no
+    sample covers the time since boot. Samples are scheduled on a monotonic
+    clock, so the time spent reading does not make the window drift, and
+    /proc/stat is kept open for the whole window.
+    """
+    count = max(1, int(round(timeout / float(interval))))
+    samples = []
 
-    if timeout < 1:
-        return 0, 0, 0, 0
-
-    while total_runs < timeout:
-        idle, total = get_perf()
-        idle_delta, total_delta = idle - last_idle, total - last_total
-        last_idle, last_total = idle, total
-        if total_delta == 0:
-            utilisation = 0.0
-        else:
-            utilisation = 100.0 * (1.0 - idle_delta / total_delta)
-        cpu_stats.append(utilisation)
-        total_runs += 1
-        sleep(1)
+    fd = os.open(os.path.join(proc_root, "stat"), os.O_RDONLY)
+    try:
+        first = last = get_cpu_times(fd)
+        cores = sorted(
+            (name for name in first if name != "cpu"), key=lambda n: int(n[3:])
+        )
+        per_core_peak = dict((core, 0.0) for core in cores)
+        start = monotonic()
+        for run in range(1, count + 1):
+            delay = start + run * interval - monotonic()
+            if delay > 0:
+                sleep(delay)
+            current = get_cpu_times(fd)
+            samples.append(_utilization(last["cpu"], current["cpu"]))
+            for core in cores:
+                # CPUs can go offline during the window
+                if core in current and core in last:
+                    utilization = _utilization(last[core], current[core])
+                    per_core_peak[core] = max(per_core_peak[core], utilization)
+            last = current
+    finally:
+        os.close(fd)
+
+    return dict(
+        samples=samples,
+        per_core_peak=[per_core_peak[core] for core in cores],
+        breakdown=_breakdown(first["cpu"], last["cpu"]),
+    )
 
-    rtc_date, rtc_time = get_date_time()
 
-    average = sum(cpu_stats) / len(cpu_stats)
-    peak = max(cpu_stats)
+def cpu_utilization(timeout=1, interval=1.0, proc_root=PROC_ROOT):
+    """
+    Calculate CPU utilization over a given timeout period.
+    :param timeout: Duration in seconds to monitor CPU utilization.
+    :param interval: Time in seconds between two samples.
+    :param proc_root: Mount point of the proc filesystem.
+    :return: Tuple containing a dictionary with the average, peak, p50, p95
+                and p99 utilization, the user, system, iowait and steal
+                percentages, the peak utilization of every core and of the
+                busiest core, the RTC date, and the RTC time.
+
+    If timeout is less than 1, return zeros.
+    """
+    if timeout < 1:
+        return dict(average=0, peak=0, p50=0, p95=0, p99=0), 0, 0
+
+    sampled = sample_cpu_utilization(timeout, interval, proc_root)
+    rtc_date, rtc_time = get_date_time(proc_root)
+
+    samples = sampled["samples"]
+    ordered = sorted(samples)
+    summary = dict(
+        average=sum(samples) / len(samples),
+        peak=ordered[-1],
+        p50=percentile(ordered, 50),
+        p95=percentile(ordered, 95),
+        p99=percentile(ordered, 99),
+        per_core_peak=sampled["per_core_peak"],
+        core_peak=max(sampled["per_core_peak"] or [0.0]),
+    )
+    summary.update(sampled["breakdown"])
 
-    return average, peak, rtc_date, rtc_time
+    return summary, rtc_date, rtc_time
 
 
-def cpu_utilization_value(timeout):
+def cpu_utilization_value(timeout, proc_root=PROC_ROOT):
     """
     Calculate CPU utilization over a given timeout period.
     :param timeout: Duration in seconds to monitor CPU utilization.
+    :param proc_root: Mount point of the proc filesystem.
     :return: Tuple containing utilization, RTC date, and RTC time.
     """
-    last_idle, last_total = get_perf()
-    rtc_date, rtc_time = get_date_time()
+    last_idle, last_total = get_perf(proc_root=proc_root)
+    rtc_date, rtc_time = get_date_time(proc_root)
 
     sleep(timeout)
-    idle, total = get_perf()
+    idle, total = get_perf(proc_root=proc_root)
     idle_delta, total_delta = idle - last_idle, total - last_total
     if total_delta == 0:
         utilization = 0.0
@@ -0,0 +1,217 @@
+#!/usr/bin/python
+
+ANSIBLE_METADATA = {"metadata_version": "1.1"}
+
+import binascii
+import os
+import platform
+import socket
+
+from ansible.module_utils.basic import AnsibleModule
+
+
+def run_module():
+    # define available arguments/parameters a user can pass to the module
+    module_args = dict(
+        subset=dict(
+            type="str", required=False, default="all", choices=["all", "usage"]
+        ),
+        proc_root=dict(type="str", required=False, default="/proc"),
+    )
+
+    # seed the result dict in the object
+    # we primarily care about changed and state
+    # change is if this module effectively modified the target
+    # state will include any data that you want your module to pass back
+    # for consumption, for example, in a subsequent task
+    result = dict(changed=False, ansible_facts=dict())
+
+    # the AnsibleModule object will be our abstraction working with Ansible
+    # this includes instantiation, a couple of common attr would be the
+    # args/params passed to the execution, as well as if the module
+    # supports check mode
+    module = AnsibleModule(argument_spec=module_args, supports_check_mode=True)
+
+    # reading facts doesn't modify the target, so check mode collects them too
+    proc_root = module.params["proc_root"]
+    try:
+        if module.params["subset"] == "usage":
+            result["ansible_facts"] = usage_facts(proc_root)
+        else:
+            result["ansible_facts"] = machine_facts(proc_root)
+    except Exception as e:
+        return module.fail_json(msg=str(e), **result)
+
+    return module.exit_json(**result)
+
+
+# Names Ansible reports as ansible_distribution for the os-release ID values
+DISTRIBUTIONS = {
+    "almalinux": "AlmaLinux",
+    "alpine": "Alpine",
+    "amzn": "Amazon",
+    "arch": "Archlinux",
+    "centos": "CentOS",
+    "debian": "Debian",
+    "fedora": "Fedora",
+    "ol": "OracleLinux",
+    "opensuse-leap": "openSUSE Leap",
+    "rhel": "RedHat",
+    "rocky": "Rocky",
+    "sles": "SLES",
+    "ubuntu": "Ubuntu",
+}
+
+# /proc/net/if_inet6 scope of addresses only reachable from the host itself
+IPV6_SCOPE_HOST = 0x10
+
+
+def read_meminfo(path="/proc/meminfo"):
+    """Return the total and free memory in MB"""
+    memory = {}
+    with open(path) as f:
+        for line in f:
+            key, _, value = line.partition(":")
+            if key in ("MemTotal", "MemFree"):
+                memory[key] = int(value.split()[0]) // 1024
+    return dict(
+        ansible_memtotal_mb=memory.get("MemTotal", 0),
+        ansible_memfree_mb=memory.get("MemFree", 0),
+    )
+
+
+def read_cpuinfo(path="/proc/cpuinfo"):
+    """Return the processor list and the number of logical processors
+
+    Every processor is reported as its index, vendor and model name, the same
+    layout as the ansible_processor fact.
+    """
+    processor = []
+    vcpus = 0
+    with open(path) as f:
+        for line in f:
+            key, _, value = line.partition(":")
+            key = key.strip()
+            value = value.strip()
+            if key == "processor":
+                processor.append(str(vcpus))
+                vcpus += 1
+            elif key in ("vendor_id", "model name", "Processor", "cpu model"):
+                processor.append(value)
+    return dict(ansible_processor=processor, ansible_processor_vcpus=vcpus)
+
+
+def read_mounts(path="/proc/mounts"):
+    """Return the size of every mounted block device or network filesystem"""
+    mounts = []
+    with open(path) as f:
+        for line in f:
+            fields = line.split()
+            if len(fields) < 4:
+                continue
+            device, mount, fstype = fields[:3]
+            # Same filter as Ansible's mount facts
+            if fstype == "none" or (
+                not device.startswith(("/", "\\")) and ":/" not in device
+            ):
+                continue
+            mount = mount.replace("\\040", " ")
+            try:
+                st = os.statvfs(mount)
+            except OSError:
+                continue
+            mounts.append(
+                dict(
+                    mount=mount,
+                    device=device,
+                    fstype=fstype,
+                    size_total=st.f_frsize * st.f_blocks,
+                    size_available=st.f_frsize * st.f_bavail,
+                )
+            )
+    return dict(ansible_mounts=mounts)
+
+
+def read_os_release(paths=("/etc/os-release", "/usr/lib/os-release")):
+    """Return the distribution name and version"""
+    release = {}
+    for path in paths:
+        try:
+            with open(path) as f:
+                for line in f:
+                    key, _, value = line.strip().partition("=")
+                    release[key] = value.strip("\"'")
+        except (IOError, OSError):
+            continue
+        break
+    distribution = DISTRIBUTIONS.get(release.get("ID"), release.get("NAME", "Unknown"))
+    return dict(
+        ansible_distribution=distribution,
+        ansible_distribution_version=release.get("VERSION_ID", ""),
+    )
+
+
+def ipv4_addresses(path="/proc/net/fib_trie"):
+    """Return the local non-loopback IPv4 addresses"""
+    addresses = []
+    address = None
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if line.startswith("|--"):
+                address = line[3:].strip()
+            elif line == "/32 host LOCAL" and address is not None:
+                if not address.startswith("127.") and address not in addresses:
+                    addresses.append(address)
+    return addresses
+
+
+def ipv6_addresses(path="/proc/net/if_inet6"):
+    """Return the non-loopback IPv6 addresses"""
+    addresses = []
+    try:
+        f = open(path)
+    except (IOError, OSError):  # IPv6 is disabled
+        return addresses
+    with f:
+        for line in f:
+            fields = line.split()
+            if len(fields) < 4 or int(fields[3], 16) == IPV6_SCOPE_HOST:
+                continue
+            address = socket.inet_ntop(socket.AF_INET6, binascii.unhexlify(fields[0]))
+            if address not in addresses:
+                addresses.append(address)
+    return addresses
+
+
+def usage_facts(proc_root="/proc"):
+    """Return only the memory and storage facts"""
+    facts = read_meminfo(os.path.join(proc_root, "meminfo"))
+    facts.update(read_mounts(os.path.join(proc_root, "mounts")))
+    return facts
+
+
+def machine_facts(proc_root="/proc"):
+    """Return the facts machine_stats reports, named as Ansible's setup module does"""
+    facts = dict(
+        ansible_hostname=platform.node().split(".")[0],
+        ansible_fqdn=socket.getfqdn(),
+        ansible_all_ipv4_addresses=ipv4_addresses(
+            os.path.join(proc_root, "net", "fib_trie")
+        ),
+        ansible_all_ipv6_addresses=ipv6_addresses(
+            os.path.join(proc_root, "net", "if_inet6")
+        ),
+    )
+    facts.update(usage_facts(proc_root))
+    facts.update(read_cpuinfo(os.path.join(proc_root, "cpuinfo")))
+    facts.update(read_os_release())
+    return facts
+
+
+def main():
+    run_module()
+
+
+if __name__ == "__main__":
+    main()
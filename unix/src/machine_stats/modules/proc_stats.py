@@ -2,17 +2,34 @@
 
 ANSIBLE_METADATA = {"metadata_version": "1.1"}
 
+import heapq
 import os
 from time import time
 from pathlib import Path
-from pwd import getpwuid
+from pwd import getpwall, getpwuid
 
 from ansible.module_utils.basic import AnsibleModule
 
 
 def run_module():
     # define available arguments/parameters a user can pass to the module
-    module_args = dict(process_stats=dict(type="bool", required=False, default=True))
+    module_args = dict(
+        process_stats=dict(type="bool", required=False, default=True),
+        engine=dict(type="str", required=False, default="fast", choices=list(ENGINES)),
+        preload_users=dict(type="bool", required=False, default=False),
+        encoding=dict(
+            type="str",
+            required=False,
+            default="records",
+            choices=["records", "columnar"],
+        ),
+        min_memory_mb=dict(type="float", required=False, default=0),
+        min_alive_time=dict(type="int", required=False, default=0),
+        exclude_kernel_threads=dict(type="bool", required=False, default=False),
+        group_by_executable=dict(type="bool", required=False, default=False),
+        top=dict(type="int", required=False, default=0),
+        proc_root=dict(type="str", required=False, default="/proc"),
+    )
 
     # seed the result dict in the object
     # we primarily care about changed and state
@@ -33,7 +50,23 @@ def run_module():
     else:
         # get stats from processes running on server
         try:
-            stats = process_stats()
+            stats = process_stats(
+                engine=module.params["engine"],
+                proc_root=module.params["proc_root"],
+                preload_users=module.params["preload_users"],
+            )
+            stats = filter_processes(
+                stats,
+                min_memory_mb=module.params["min_memory_mb"],
+                min_alive_time=module.params["min_alive_time"],
+                exclude_kernel_threads=module.params["exclude_kernel_threads"],
+            )
+            if module.params["group_by_executable"]:
+                stats = group_by_executable(stats)
+            if module.params["top"]:
+                stats = top_processes(stats, module.params["top"])
+            if module.params["encoding"] == "columnar":
+                stats = encode_columnar(stats)
             result["ansible_proc_stats"] = stats
             module.exit_json(**result)
         except Exception as e:
@@ -77,17 +110,35 @@ def _parse_proc_status_file(process_path):
     return status
 
 
+# UID to user name lookups of the current run, see process_stats(). Most
+# processes share a handful of UIDs, and each getpwuid() call can be a network
+# round-trip on hosts backed by LDAP/SSSD.
+_usernames = {}
+
+
+def _load_usernames():
+    """
+    Fills the user name cache with a single read of the passwd database.
+    """
+    for user_entry in getpwall():
+        # Keep the first entry like getpwuid() does
+        _usernames.setdefault(user_entry.pw_uid, user_entry.pw_name)
+
+
 def _get_username_from_uid(uid_str):
     """
     Takes a UID string from a proc status file and returns the username.
     Falls back to the UID if the username cannot be found.
     """
     uid = int(uid_str.split()[0])
+    if uid in _usernames:
+        return _usernames[uid]
     try:
-        user_entry = getpwuid(uid)
-        return user_entry.pw_name
+        username = getpwuid(uid).pw_name
     except KeyError:
-        return str(uid)  # Fallback to UID
+        username = str(uid)  # Fallback to UID
+    _usernames[uid] = username
+    return username
 
 
 def parse_status(process_path):
@@ -147,18 +198,225 @@ def parse_status(process_path):
     return stats
 
 
-def process_stats():
+# Keys of /proc/<pid>/status read by the fast engine. VmSize is the last one
+# of them in the file, so reading can stop as soon as it has been seen.
+_STATUS_KEYS = ("Name", "Pid", "PPid", "Uid", "VmPeak", "VmSize")
+_STATUS_LAST_KEY = "VmSize"
+_STATUS_LAST_LINE = b"\nVmSize:"
+
+
+def _read_status_fields(process_path):
+    """
+    Reads only the wanted fields of the /proc/<pid>/status file, with a single
+    read in the common case, and stops parsing after the last wanted key.
+    """
+    data = b""
+    fd = os.open(process_path + "/status", os.O_RDONLY)
+    try:
+        while True:
+            # Stop once the VmSize line is complete, not as soon as it starts
+            start = data.find(_STATUS_LAST_LINE)
+            if start != -1 and data.find(b"\n", start + 1) != -1:
+                break
+            chunk = os.read(fd, 4096)
+            if not chunk:
+                break
+            data += chunk
+    finally:
+        os.close(fd)
+
+    fields = {}
+    for line in data.decode("utf-8", "replace").split("\n"):
+        key, _, value = line.partition(":")
+        if key in _STATUS_KEYS:
+            fields[key] = value.strip()
+            if key == _STATUS_LAST_KEY:
+                break
+    return fields
+
+
+def read_process(process_path):
+    """Fast alternative to parse_status() returning the same dictionary.
+
+    It resolves the executable with a single readlink() call and reads only
+    the needed keys of the status file instead of parsing all of it.
+    """
+    try:
+        status = _read_status_fields(process_path)
+        alive_since = os.stat(process_path).st_ctime
+    except OSError:
+        # The process has exited while we were looking at it
+        return {}
+
+    stats = {}
+    try:
+        stats["path"], stats["name"] = os.readlink(process_path + "/exe").rsplit("/", 1)
+    except OSError:
+        # Kernel threads have no executable, and the ones of other users
+        # can't be read without enough privileges. Fall back to the name
+        # from the status file like parse_status() does.
+        stats["path"], stats["name"] = "/", status.get("Name")
+
+    stats["total_alive_time"] = round(time() - alive_since)
+
+    if status.get("Pid"):
+        stats["pid"] = int(status["Pid"])
+
+    if status.get("PPid"):
+        stats["ppid"] = int(status["PPid"])
+
+    if status.get("VmSize"):
+        stats["memory_used_mb"] = int(status["VmSize"].split()[0]) / 1024
+
+    if status.get("VmPeak"):
+        stats["max_memory_used_mb"] = int(status["VmPeak"].split()[0]) / 1024
+
+    if status.get("Uid"):
+        stats["user"] = _get_username_from_uid(status["Uid"])
+
+    return stats
+
+
+# "fast" uses read_process(), "legacy" the original parse_status()
+ENGINES = ("fast", "legacy")
+
+
+def process_stats(engine="fast", proc_root="/proc", preload_users=False):
     """Returns a list of dictionaries representing important stats for
     processes. These attributes include ['path', 'name', 'total_alive_time', 'pid',
-    'ppid', 'max_memory_used_mb', 'memory_used_mb']"""
+    'ppid', 'max_memory_used_mb', 'memory_used_mb']
+
+    User names are looked up once per distinct UID. With preload_users the
+    whole passwd database is read upfront instead."""
+
+    _usernames.clear()
+    if preload_users:
+        _load_usernames()
+
+    reader = parse_status if engine == "legacy" else read_process
 
     process_paths = [
         folder.path
-        for folder in os.scandir("/proc")
-        if folder.is_dir() and str.isdigit(folder.name)
+        for folder in os.scandir(proc_root)
+        if str.isdigit(folder.name) and folder.is_dir()
     ]
 
-    return list(filter(None, [parse_status(process) for process in process_paths]))
+    return list(filter(None, [reader(process) for process in process_paths]))
+
+
+def filter_processes(
+    processes, min_memory_mb=0, min_alive_time=0, exclude_kernel_threads=False
+):
+    """Returns the processes matching all the given criteria.
+
+    Kernel threads are recognized by having no virtual memory at all, which
+    also leaves out zombie processes.
+    """
+    filtered = []
+    for process in processes:
+        if exclude_kernel_threads and "memory_used_mb" not in process:
+            continue
+        if process.get("memory_used_mb", 0) < min_memory_mb:
+            continue
+        if process.get("total_alive_time", 0) < min_alive_time:
+            continue
+        filtered.append(process)
+    return filtered
+
+
+def group_by_executable(processes):
+    """Aggregates the processes running the same executable.
+
+    Every group has the executable 'path' and 'name', the 'count' of processes,
+    their summed 'memory_used_mb' and 'max_memory_used_mb', the longest
+    'total_alive_time' and the sorted list of 'users' running them.
+    """
+    groups = {}
+    for process in processes:
+        key = (process.get("path"), process.get("name"))
+        group = groups.get(key)
+        if group is None:
+            group = groups[key] = dict(
+                path=key[0],
+                name=key[1],
+                count=0,
+                memory_used_mb=0,
+                max_memory_used_mb=0,
+                total_alive_time=0,
+                users=set(),
+            )
+        group["count"] += 1
+        group["memory_used_mb"] += process.get("memory_used_mb", 0)
+        group["max_memory_used_mb"] += process.get("max_memory_used_mb", 0)
+        group["total_alive_time"] = max(
+            group["total_alive_time"], process.get("total_alive_time", 0)
+        )
+        if process.get("user") is not None:
+            group["users"].add(process["user"])
+
+    for group in groups.values():
+        group["users"] = sorted(group["users"])
+    return list(groups.values())
+
+
+def top_processes(processes, count):
+    """Returns the given number of processes (or groups) using the most memory"""
+    return heapq.nlargest(
+        count, processes, key=lambda process: process.get("memory_used_mb", 0)
+    )
+
+
+# Fields of the columnar encoding, see encode_columnar()
+COLUMNAR_FIELDS = (
+    "path",
+    "name",
+    "user",
+    "pid",
+    "ppid",
+    "memory_used_mb",
+    "max_memory_used_mb",
+    "total_alive_time",
+    "count",
+    "users",
+)
+# Columnar fields holding indexes into the table of strings
+INTERNED_FIELDS = ("path", "name", "user")
+
+
+def encode_columnar(processes):
+    """Encodes the list of process dictionaries column by column.
+
+    Instead of repeating every key for every process, the result holds one
+    list of values per field. Paths, names and users are stored once in the
+    "strings" table and referenced by their index. Missing values are None,
+    and fields missing from every process are left out.
+    """
+    fields = [
+        field
+        for field in COLUMNAR_FIELDS
+        if any(field in process for process in processes)
+    ]
+    strings = []
+    string_index = {}
+    columns = dict((field, []) for field in fields)
+
+    for process in processes:
+        for field in fields:
+            value = process.get(field)
+            if value is not None and field in INTERNED_FIELDS:
+                if value not in string_index:
+                    string_index[value] = len(strings)
+                    strings.append(value)
+                value = string_index[value]
+            columns[field].append(value)
+
+    return dict(
+        encoding="columnar",
+        count=len(processes),
+        interned=list(INTERNED_FIELDS),
+        strings=strings,
+        columns=columns,
+    )
 
 
 def main():
@@ -0,0 +1,93 @@
+"""
+Output writers for machine_stats
+"""
+
+import json
+import sys
+from collections.abc import Iterable
+from textwrap import indent
+
+
+def _expand(obj):
+    """Serialize lazy sequences, such as columnar process stats, as lists"""
+    if isinstance(obj, Iterable):
+        return list(obj)
+    raise TypeError("Object of type %s is not JSON serializable" % type(obj).__name__)
+
+
+def dumps(record, **kwargs):
+    """json.dumps() that also serializes lazy sequences"""
+    return json.dumps(record, default=_expand, **kwargs)
+
+
+class JSONDocumentWriter:
+    """Write a ``{key: [records]}`` JSON document one record at a time
+
+    The output is identical to printing
+    ``json.dumps({key: records}, indent=4, sort_keys=True)``, but every record
+    can be released as soon as it has been written.
+    """
+
+    streaming = False
+
+    def __init__(self, key, stream=None):
+        self._key = key
+        self._stream = stream if stream is not None else sys.stdout
+        self._opened = False
+        self._count = 0
+
+    def open(self):
+        """Start the document, even if no record is written afterwards"""
+        if self._opened:
+            return
+        self._stream.write("{\n    %s: [" % json.dumps(self._key))
+        self._opened = True
+
+    def write(self, record):
+        self.open()
+        text = dumps(record, indent=4, sort_keys=True)
+        self._stream.write(("," if self._count else "") + "\n" + indent(text, " " * 8))
+        self._count += 1
+
+    def close(self):
+        if not self._opened:
+            return
+        self._stream.write("\n    ]\n}\n" if self._count else "]\n}\n")
+        self._stream.flush()
+        self._opened = False
+
+
+class NDJSONWriter:
+    """Write one compact JSON record per line
+
+    Every record is a complete document on its own, so records are written as
+    soon as a host completes.
+    """
+
+    streaming = True
+
+    def __init__(self, key, stream=None):
+        del key  # Unused, records are not wrapped into a document
+        self._stream = stream if stream is not None else sys.stdout
+
+    def open(self):
+        pass
+
+    def write(self, record):
+        self._stream.write(dumps(record, separators=(",", ":")) + "\n")
+
+    def close(self):
+        self._stream.flush()
+
+
+WRITERS = {
+    "json": JSONDocumentWriter,
+    "ndjson": NDJSONWriter,
+}
+
+OUTPUT_FORMATS = list(WRITERS)
+
+
+def make_writer(output_format, key, stream=None):
+    """Return the writer for the given output format"""
+    return WRITERS[output_format](key, stream=stream)
@@ -1,18 +1,59 @@
 import argparse
 
 
+# Summary values of the cpu_utilization module reported as "cpu_<key>" custom
+# fields when the module returns them
+OPTIONAL_FIELDS = (
+    "p50",
+    "p95",
+    "p99",
+    "user",
+    "system",
+    "iowait",
+    "steal",
+    "core_peak",
+)
+
+# Extra seconds an asynchronous sampler is allowed to run past its sampling
+# window before Ansible gives up on it
+ASYNC_MARGIN = 30
+
+# Seconds between two async_status polls of an asynchronous sampler
+ASYNC_POLL_DELAY = 1
+
+
 def setup(app):
     timeout = app.args.cpu_utilization_timeout
+    interval = app.args.cpu_utilization_interval
     only_value = app.args.cpu_utilization_only_value
-    if timeout > 0:
-        app.add_playbook_tasks(
-            dict(
-                action=dict(
-                    module="cpu_utilization",
-                    args=dict(timeout=timeout, only_value=only_value),
-                ),
-            )
+    if timeout <= 0:
+        return
+
+    task = dict(
+        action=dict(
+            module="cpu_utilization",
+            args=dict(timeout=timeout, interval=interval, only_value=only_value),
+        ),
+    )
+    if not getattr(app.args, "cpu_utilization_async", False):
+        app.add_playbook_tasks(task)
+        return
+
+    # Start sampling before facts are gathered and collect the result once all
+    # other tasks are done, so the sampling window overlaps with them.
+    task.update({"async": timeout + ASYNC_MARGIN, "poll": 0, "register": "cpu_job"})
+    app.add_playbook_pre_tasks(task)
+    app.add_playbook_post_tasks(
+        dict(
+            action=dict(
+                module="async_status", args=dict(jid="{{ cpu_job.ansible_job_id }}")
+            ),
+            register="cpu_job_result",
+            until="cpu_job_result.finished",
+            retries=(timeout + ASYNC_MARGIN) // ASYNC_POLL_DELAY,
+            delay=ASYNC_POLL_DELAY,
         )
+    )
 
 
 def add_arguments(parser: argparse.ArgumentParser):
@@ -23,6 +64,19 @@ def add_arguments(parser: argparse.ArgumentParser):
         default=30,
         help="timeout sampling for CPU utilization",
     )
+    parser.add_argument(
+        "--cpu-utilization-interval",
+        metavar="SECONDS",
+        type=float,
+        default=1.0,
+        help="time between two CPU utilization samples, from 0.1 to 10 seconds "
+        "(default 1)",
+    )
+    parser.add_argument(
+        "--cpu-utilization-async",
+        action="store_true",
+        help="sample CPU utilization in the background while the other tasks run",
+    )
     parser.add_argument(
         "--cpu-utilization-only-value",
         action="store_true",
@@ -50,16 +104,17 @@ def ok_callback(parent, result):
                 },
             )
         else:
-            parent.update_results(
-                host,
-                {
-                    "custom_fields": {
-                        "cpu_sampling_timeout": cpu_sampling_timeout,
-                        "cpu_average": cpu_util["average"],
-                        "cpu_peak": cpu_util["peak"],
-                        "cpu_utilization_timestamp": cpu_util["rtc_date"]
-                        + " "
-                        + cpu_util["rtc_time"],
-                    }
-                },
-            )
+            custom_fields = {
+                "cpu_sampling_timeout": cpu_sampling_timeout,
+                "cpu_average": cpu_util["average"],
+                "cpu_peak": cpu_util["peak"],
+                "cpu_utilization_timestamp": cpu_util["rtc_date"]
+                + " "
+                + cpu_util["rtc_time"],
+            }
+            for key in OPTIONAL_FIELDS:
+                if key in cpu_util:
+                    custom_fields["cpu_" + key] = cpu_util[key]
+            if "interval" in cpu_util:
+                custom_fields["cpu_sampling_interval"] = cpu_util["interval"]
+            parent.update_results(host, {"custom_fields": custom_fields})
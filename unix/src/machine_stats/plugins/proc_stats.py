@@ -1,10 +1,33 @@
+from collections.abc import Sequence
+
+from machine_stats import non_negative_int, positive_int
+
+# Whether columnar process stats are written out as they are, set by setup()
+columnar_output = False
+
+
 def setup(app):
-    process_stats = app.args.process_stats
+    global columnar_output  # pylint: disable=global-statement
+    args = app.args
+    columnar_output = args.process_stats_columnar_output
+
+    process_stats = args.process_stats
     if process_stats:
         app.add_playbook_tasks(
             dict(
                 action=dict(
-                    module="proc_stats", args=dict(process_stats=process_stats)
+                    module="proc_stats",
+                    args=dict(
+                        process_stats=process_stats,
+                        engine=args.process_stats_engine,
+                        preload_users=args.process_stats_preload_users,
+                        encoding=args.process_stats_encoding,
+                        min_memory_mb=args.process_stats_min_memory,
+                        min_alive_time=args.process_stats_min_alive_time,
+                        exclude_kernel_threads=args.process_stats_exclude_kernel_threads,
+                        group_by_executable=args.process_stats_group_by_executable,
+                        top=args.process_stats_top,
+                    ),
                 ),
             )
         )
@@ -16,11 +39,110 @@ def add_arguments(parser):
         action="store_true",
         help="turn on collecting stats on running processes",
     )
+    parser.add_argument(
+        "--process-stats-engine",
+        choices=["fast", "legacy"],
+        default="fast",
+        help="how process stats are read on the target: 'fast' reads only the "
+        "needed /proc fields, 'legacy' parses every status file in full "
+        "(default 'fast')",
+    )
+    parser.add_argument(
+        "--process-stats-preload-users",
+        action="store_true",
+        help="read the whole passwd database once instead of looking up "
+        "every distinct process owner",
+    )
+    parser.add_argument(
+        "--process-stats-min-memory",
+        metavar="MB",
+        type=float,
+        default=0,
+        help="only report processes using at least MB of virtual memory",
+    )
+    parser.add_argument(
+        "--process-stats-min-alive-time",
+        metavar="SECONDS",
+        type=non_negative_int,
+        default=0,
+        help="only report processes running for at least SECONDS",
+    )
+    parser.add_argument(
+        "--process-stats-exclude-kernel-threads",
+        action="store_true",
+        help="leave out kernel threads",
+    )
+    parser.add_argument(
+        "--process-stats-group-by-executable",
+        action="store_true",
+        help="report one entry per executable with the number of processes "
+        "and their summed memory usage",
+    )
+    parser.add_argument(
+        "--process-stats-top",
+        metavar="N",
+        type=positive_int,
+        default=0,
+        help="only report the N processes (or executables) using the most memory",
+    )
+    parser.add_argument(
+        "--process-stats-encoding",
+        choices=["records", "columnar"],
+        default="records",
+        help="how process stats are sent back from the target: 'columnar' "
+        "sends one list per field with deduplicated strings, which is much "
+        "smaller on hosts running many processes (default 'records')",
+    )
+    parser.add_argument(
+        "--process-stats-columnar-output",
+        action="store_true",
+        help="keep columnar process stats in the output instead of expanding "
+        "them into one object per process",
+    )
+
+
+class ColumnarProcessStats(Sequence):
+    """Read-only list of process dictionaries backed by the columnar encoding
+    of the proc_stats module.
+
+    Process dictionaries are only built when they are accessed, typically
+    while the results are written out.
+    """
+
+    def __init__(self, payload):
+        self._strings = payload["strings"]
+        self._columns = payload["columns"]
+        self._interned = set(payload["interned"])
+        self._count = payload["count"]
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self._count))]
+        if index < 0:
+            index += self._count
+        if not 0 <= index < self._count:
+            raise IndexError("process index out of range")
+
+        process = {}
+        for field, values in self._columns.items():
+            value = values[index]
+            if value is None:
+                continue
+            if field in self._interned:
+                value = self._strings[value]
+            process[field] = value
+        return process
 
 
 def ok_callback(parent, result):
     host = result._host.get_name()
     process_stats = result._result.get("ansible_proc_stats")
+    if isinstance(process_stats, dict) and process_stats.get("encoding") == "columnar":
+        if not columnar_output:
+            process_stats = ColumnarProcessStats(process_stats)
     if process_stats is not None:
         parent.update_results(
             host,
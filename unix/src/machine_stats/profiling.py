@@ -0,0 +1,162 @@
+"""
+Run profiling for machine_stats
+"""
+
+import json
+import math
+from contextlib import contextmanager
+from time import perf_counter
+
+# Number of hosts listed in the profile as the slowest ones
+SLOWEST_HOSTS = 10
+
+# Controller-side phases, in report order
+PHASES = ("total", "runner", "runner startup", "events", "serialization")
+
+
+def percentile(values, p):
+    """Return the nearest-rank ``p`` percentile of sorted ``values``"""
+    if not values:
+        return 0.0
+    return values[max(0, math.ceil(p / 100.0 * len(values)) - 1)]
+
+
+class Profiler:
+    """Collect where the time of a run goes
+
+    Task durations come from the runner events of every host, so they include
+    the SSH connection setup of the first task on a host. Controller phases
+    are timed around the runner, the event handler and the output writer. The
+    runner phase includes the others, which don't overlap: the output
+    written while handling an event counts as serialization, not as events.
+    """
+
+    def __init__(self):
+        self.phases = {}
+        self._tasks = {}
+        self._hosts = {}
+        self._run_start = None
+        # Time spent in the nested phases of every phase being timed
+        self._nested = []
+
+    def add(self, phase, seconds):
+        self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+
+    @contextmanager
+    def phase(self, name):
+        """Time a block of controller work as part of phase ``name``, less the
+        time of the phases nested in it"""
+        start = perf_counter()
+        self._nested.append(0.0)
+        try:
+            yield
+        finally:
+            seconds = perf_counter() - start
+            self.add(name, seconds - self._nested.pop())
+            if self._nested:
+                self._nested[-1] += seconds
+
+    @contextmanager
+    def run(self):
+        """Time a runner invocation, including the start-up until its first event"""
+        start = self._run_start = perf_counter()
+        try:
+            yield
+        finally:
+            self._run_start = None
+            self.add("runner", perf_counter() - start)
+
+    def event(self):
+        """Record that the current runner invocation emitted an event"""
+        if self._run_start is not None:
+            self.add("runner startup", perf_counter() - self._run_start)
+            self._run_start = None
+
+    def task(self, host, task, seconds):
+        """Record the duration of a task on a host"""
+        self._tasks.setdefault(task, []).append(seconds)
+        tasks = self._hosts.setdefault(host, {})
+        tasks[task] = tasks.get(task, 0.0) + seconds
+
+    def report(self):
+        """Return the profile as a JSON-serializable dict"""
+        tasks = {}
+        for task, durations in self._tasks.items():
+            durations = sorted(durations)
+            tasks[task] = {
+                "count": len(durations),
+                "p50": percentile(durations, 50),
+                "p95": percentile(durations, 95),
+                "max": durations[-1],
+            }
+        slowest = sorted(
+            self._hosts.items(), key=lambda item: sum(item[1].values()), reverse=True
+        )[:SLOWEST_HOSTS]
+        return {
+            "phases": {
+                phase: self.phases[phase] for phase in PHASES if phase in self.phases
+            },
+            "tasks": tasks,
+            "slowest_hosts": [
+                {"host": host, "seconds": sum(host_tasks.values()), "tasks": host_tasks}
+                for host, host_tasks in slowest
+            ],
+        }
+
+    def recap(self):
+        """Return the profile as extra MACHINE STATS RECAP lines"""
+        report = self.report()
+        lines = [
+            (
+                "phases",
+                ", ".join(
+                    "%s %.2fs" % (phase, seconds)
+                    for phase, seconds in report["phases"].items()
+                ),
+            )
+        ]
+        for task, durations in sorted(report["tasks"].items()):
+            lines.append(
+                (
+                    "task %s" % task,
+                    "p50 %(p50).2fs, p95 %(p95).2fs, max %(max).2fs "
+                    "(%(count)d runs)" % durations,
+                )
+            )
+        if report["slowest_hosts"]:
+            lines.append(
+                (
+                    "slowest hosts",
+                    ", ".join(
+                        "%s %.2fs" % (host["host"], host["seconds"])
+                        for host in report["slowest_hosts"]
+                    ),
+                )
+            )
+        return lines
+
+    def write(self, path):
+        """Write the profile to ``path`` as JSON"""
+        with open(path, "w") as f:  # pylint: disable=invalid-name
+            json.dump(self.report(), f, indent=4, sort_keys=True)
+
+
+class TimedWriter:
+    """Output writer wrapper adding the time spent writing to a profiler"""
+
+    def __init__(self, writer, profiler):
+        self._writer = writer
+        self._profiler = profiler
+        self.streaming = writer.streaming
+
+    def open(self):
+        with self._profiler.phase("serialization"):
+            self._writer.open()
+
+    def write(self, record):
+        with self._profiler.phase("serialization"):
+            self._writer.write(record)
+
+    def close(self):
+        with self._profiler.phase("serialization"):
+            self._writer.close()
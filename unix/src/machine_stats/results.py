@@ -0,0 +1,48 @@
+"""
+Per-host results of a machine_stats run
+"""
+
+
+def deep_merge(target, source):
+    """Merge ``source`` into ``target`` in place and return ``target``
+
+    Nested dicts present on both sides are merged key by key instead of the
+    ``source`` one replacing the ``target`` one. Any other value of ``source``
+    replaces the value of ``target``.
+    """
+    for key, value in source.items():
+        current = target.get(key)
+        if isinstance(value, dict) and isinstance(current, dict):
+            deep_merge(current, value)
+        else:
+            target[key] = value
+    return target
+
+
+class HostResult:
+    """Contributions of the facts and of the plugins to the result of a host
+
+    Contributions are only kept until the host is done, then merged once into
+    the first one, so no dict gets copied however many plugins contribute.
+    Contributions are owned by the result from then on and may be modified.
+    """
+
+    __slots__ = ("_parts",)
+
+    def __init__(self, data=None):
+        self._parts = [] if data is None else [data]
+
+    def add(self, data):
+        """Add the fields of ``data``, merged over the earlier contributions"""
+        self._parts.append(data)
+
+    def build(self):
+        """Return the merged result, a dict of the fields of the host"""
+        parts = self._parts
+        if not parts:
+            return {}
+        server = parts[0]
+        for part in parts[1:]:
+            deep_merge(server, part)
+        self._parts = [server]
+        return server
@@ -0,0 +1,60 @@
+"""
+SSH connection profiles for machine_stats
+"""
+
+import os
+
+SSH_PROFILES = ("default", "performance")
+
+# How long an idle master connection is kept open
+CONTROL_PERSIST = "60s"
+
+# Markers of sudo refusing to run without a tty (requiretty), which breaks
+# pipelining because the module is fed through stdin instead of a file
+REQUIRETTY_MARKERS = ("requiretty", "must have a tty")
+
+
+def ssh_envvars(profile, private_data_dir):
+    """Return the Ansible environment variables of an SSH profile
+
+    The performance profile reuses one SSH connection per host for all tasks
+    (ControlMaster/ControlPersist) and pipelines modules through it instead of
+    copying them to a temporary file first. Control sockets live in a private
+    directory of the run and are named after a hash of the connection (%C) so
+    the path stays short and can't be guessed by other users.
+    """
+    if profile != "performance":
+        return {}
+
+    control_path_dir = os.path.join(private_data_dir, "cp")
+    os.makedirs(control_path_dir, mode=0o700, exist_ok=True)
+    ssh_args = os.environ.get("ANSIBLE_SSH_ARGS", "")
+    return {
+        "ANSIBLE_SSH_ARGS": " ".join(
+            filter(
+                None,
+                [
+                    ssh_args,
+                    "-o ControlMaster=auto",
+                    "-o ControlPersist=" + CONTROL_PERSIST,
+                ],
+            )
+        ),
+        "ANSIBLE_SSH_CONTROL_PATH_DIR": control_path_dir,
+        "ANSIBLE_SSH_CONTROL_PATH": "%(directory)s/%%C",
+        "ANSIBLE_PIPELINING": "True",
+        "ANSIBLE_MODULE_COMPRESSION": "ZIP_DEFLATED",
+    }
+
+
+def without_pipelining(envvars):
+    """Return ``envvars`` with pipelining turned off"""
+    return dict(envvars, ANSIBLE_PIPELINING="False")
+
+
+def requires_tty(result):
+    """Return whether a task failed because sudo requires a tty"""
+    output = " ".join(
+        str(result.get(key, "")) for key in ("msg", "module_stderr", "module_stdout")
+    )
+    return any(marker in output for marker in REQUIRETTY_MARKERS)
@@ -0,0 +1,169 @@
+"""
+SSH collection engine for machine_stats
+
+Instead of running the play through Ansible, the ssh engine opens one SSH
+connection per host and runs a single Python collector script on it: the
+machine_stats.collector module, carrying the machine_stats modules and the
+tasks of the play. The results are turned into runner events for the same
+event handler as the Ansible runs.
+"""
+
+import asyncio
+import json
+import os
+import time
+from collections import namedtuple
+
+from machine_stats import collector
+
+# Seconds to wait for an SSH connection to be established
+DEFAULT_CONNECT_TIMEOUT = 10
+
+# Run the collector, read from stdin, with the first Python of the host
+REMOTE_COMMAND = 'PY=$(command -v python3 || command -v python) && exec "$PY" -'
+
+SSHTarget = namedtuple("SSHTarget", "host address port user key_file password")
+
+
+def collector_script(modules, tasks, skipped=()):
+    """Return the collector script running ``tasks``, except the ``skipped``
+    ones which are reported as skipped"""
+    payload = dict(
+        modules=modules,
+        tasks=[
+            dict(task, skip=index in skipped, when=None)
+            for index, task in enumerate(tasks)
+        ],
+    )
+    with open(collector.__file__) as f:  # pylint: disable=invalid-name
+        source = f.read()
+    # A JSON string is a valid Python 2 and 3 string literal
+    return "%s\nmain(json.loads(%s))\n" % (source, json.dumps(json.dumps(payload)))
+
+
+class AsyncSSHTransport:
+    """Run commands on the hosts over SSH with asyncssh
+
+    Transports have a ``run`` coroutine and the ``errors`` raised when a host
+    can't be reached.
+    """
+
+    def __init__(self, connect_timeout=DEFAULT_CONNECT_TIMEOUT):
+        # pylint: disable-next=import-outside-toplevel
+        import asyncssh
+
+        self._asyncssh = asyncssh
+        self._connect_timeout = connect_timeout
+        # Same setting as Ansible, see machine_stats.default_config
+        self._host_key_checking = (
+            os.environ.get("ANSIBLE_HOST_KEY_CHECKING", "True").lower() != "false"
+        )
+        self.errors = (OSError, asyncio.TimeoutError, asyncssh.Error)
+
+    async def run(self, target, command, stdin):
+        """Run ``command`` on ``target`` and return its exit status and output"""
+        options = dict(
+            port=target.port or 22,
+            username=target.user,
+            password=target.password,
+            connect_timeout=self._connect_timeout,
+        )
+        if not self._host_key_checking:
+            options["known_hosts"] = None
+        if target.key_file:
+            options["client_keys"] = [target.key_file]
+        async with self._asyncssh.connect(target.address, **options) as connection:
+            result = await connection.run(command, input=stdin, check=False)
+        return result.exit_status, result.stdout, result.stderr
+
+
+class SSHEngine:
+    """Collect the hosts with a collector script run over SSH
+
+    Up to ``concurrency`` hosts are collected at the same time, each over a
+    single connection running a single command. Every task result is passed
+    to ``event_handler`` as an ansible_runner event, followed by a
+    ``playbook_on_stats`` event once all hosts are done.
+    """
+
+    def __init__(self, transport, modules, tasks, concurrency):
+        self._transport = transport
+        self._modules = modules
+        self._tasks = tasks
+        self._concurrency = concurrency
+        # Collector scripts, by the tasks they skip
+        self._scripts = {}
+
+    def run(self, targets, event_handler, extravars=None):
+        """Collect ``targets`` and pass the events to ``event_handler``"""
+        stats = {key: {} for key in ("ok", "dark", "failures", "skipped")}
+        stats["processed"] = {}
+        asyncio.run(self._run(targets, event_handler, extravars or {}, stats))
+        event_handler({"event": "playbook_on_stats", "event_data": stats})
+
+    async def _run(self, targets, event_handler, extravars, stats):
+        semaphore = asyncio.Semaphore(self._concurrency)
+
+        async def collect(target):
+            async with semaphore:
+                await self._collect(target, event_handler, extravars, stats)
+
+        await asyncio.gather(*(collect(target) for target in targets))
+
+    async def _collect(self, target, event_handler, extravars, stats):
+        host = target.host
+        stats["processed"][host] = 1
+
+        def emit(event):
+            counter = collector.EVENT_COUNTERS[event["event"]]
+            stats[counter][host] = stats[counter].get(host, 0) + 1
+            event_handler(event)
+
+        skipped = tuple(
+            index
+            for index, task in enumerate(self._tasks)
+            if not collector.applies(task, host, extravars)
+        )
+        if skipped not in self._scripts:
+            self._scripts[skipped] = collector_script(
+                self._modules, self._tasks, skipped
+            )
+        script = self._scripts[skipped]
+        start = time.perf_counter()
+        try:
+            status, stdout, stderr = await self._transport.run(
+                target, REMOTE_COMMAND, script
+            )
+        except self._transport.errors as e:  # pylint: disable=catching-non-exception
+            emit(
+                {
+                    "event": "runner_on_unreachable",
+                    "event_data": dict(host=host, res={"msg": str(e) or repr(e)}),
+                }
+            )
+            return
+
+        reported = 0
+        for line in stdout.splitlines():
+            try:
+                line = json.loads(line)
+            except ValueError:
+                continue
+            reported += 1
+            event = collector.runner_event(
+                host, self._tasks[line["task"]], line["res"], line["duration"]
+            )
+            emit(event)
+            if event["event"] == "runner_on_failed":
+                return
+
+        if reported < len(self._tasks):
+            msg = (stderr or "").strip() or "collector exited with status %s" % status
+            emit(
+                collector.runner_event(
+                    host,
+                    self._tasks[reported],
+                    {"failed": True, "msg": msg, "rc": status},
+                    time.perf_counter() - start,
+                )
+            )
@@ -0,0 +1,90 @@
+import argparse
+
+import pytest
+
+from src.machine_stats.cache import ResultCache, field_group, parse_ttl
+
+SERVER = {
+    "host_name": "web1",
+    "cpu_count": 2,
+    "ram_allocated_gb": 4.0,
+    "ram_used_gb": 1.5,
+    "custom_fields": {"cpu_average": 10.0},
+}
+
+
+def test_field_group():
+    assert field_group("cpu_name") == "static"
+    assert field_group("ram_used_gb") == "volatile"
+    assert field_group("process_stats") == "volatile"
+
+
+def test_parse_ttl():
+    assert parse_ttl("static=3600") == ("static", 3600)
+    with pytest.raises(argparse.ArgumentTypeError):
+        parse_ttl("hourly=3600")
+    with pytest.raises(argparse.ArgumentTypeError):
+        parse_ttl("static=soon")
+    with pytest.raises(argparse.ArgumentTypeError):
+        parse_ttl("static=-1")
+
+
+def test_plan_empty_cache(tmp_path):
+    cache = ResultCache(str(tmp_path))
+
+    assert cache.plan("web1") == {}
+    assert cache.describe() == "static 0 hits 1 misses, volatile 0 hits 1 misses"
+
+
+def test_store_and_serve_static_fields(tmp_path):
+    ResultCache(str(tmp_path), now=1000).store("web1", SERVER)
+
+    cache = ResultCache(str(tmp_path), now=2000)
+    served = cache.plan("web1")
+
+    assert served == {
+        "static": {"host_name": "web1", "cpu_count": 2, "ram_allocated_gb": 4.0}
+    }
+    assert cache.describe() == "static 1 hits 0 misses, volatile 0 hits 1 misses"
+
+
+def test_static_fields_expire(tmp_path):
+    ResultCache(str(tmp_path), now=1000).store("web1", SERVER)
+
+    cache = ResultCache(str(tmp_path), ttls={"static": 60}, now=2000)
+
+    assert cache.plan("web1") == {}
+
+
+def test_serve_whole_host(tmp_path):
+    ttls = {"volatile": 600}
+    ResultCache(str(tmp_path), ttls=ttls, now=1000).store("web1", SERVER)
+
+    cache = ResultCache(str(tmp_path), ttls=ttls, now=1200)
+    served = cache.plan("web1")
+
+    assert served["volatile"] == {
+        "ram_used_gb": 1.5,
+        "custom_fields": {"cpu_average": 10.0},
+    }
+    # Nothing was collected, so the cached entry is left alone.
+    cache.store("web1", SERVER)
+    assert ResultCache(str(tmp_path), ttls=ttls, now=1500).plan("web1") == served
+
+
+def test_store_keeps_served_group_time(tmp_path):
+    ResultCache(str(tmp_path), now=1000).store("web1", SERVER)
+
+    cache = ResultCache(str(tmp_path), now=80000)
+    cache.plan("web1")
+    cache.store("web1", dict(SERVER, ram_used_gb=2.0))
+
+    # The static fields are still as old as the first run.
+    cache = ResultCache(str(tmp_path), now=1000 + 24 * 60 * 60)
+    assert cache.plan("web1") == {}
+
+
+def test_store_host_name_with_separators(tmp_path):
+    ResultCache(str(tmp_path), now=1000).store("../web1", SERVER)
+
+    assert [path.name for path in tmp_path.iterdir()] == ["..%2Fweb1.json"]
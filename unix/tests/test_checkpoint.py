@@ -0,0 +1,47 @@
+import json
+
+from src.machine_stats.checkpoint import Checkpoint
+
+
+def test_record_appends_to_journal(tmp_path):
+    checkpoint = Checkpoint(str(tmp_path))
+    checkpoint.record("web1", {"host_name": "web1"})
+    checkpoint.record("web1", {"host_name": "web1"})
+
+    # Every line is flushed as soon as it is recorded.
+    with open(checkpoint.path) as f:
+        lines = f.read().splitlines()
+    assert [json.loads(line) for line in lines] == [
+        {"host": "web1", "result": {"host_name": "web1"}}
+    ]
+    assert "web1" in checkpoint
+    checkpoint.close()
+
+
+def test_resume_loads_journal(tmp_path):
+    checkpoint = Checkpoint(str(tmp_path))
+    checkpoint.record("web1", {"host_name": "web1"})
+    checkpoint.close()
+    with open(checkpoint.path, "a") as f:
+        f.write('{"host": "web2", "res')  # interrupted in the middle of a write
+
+    checkpoint = Checkpoint(str(tmp_path), resume=True)
+    checkpoint.record("web2", {"host_name": "web2"})
+    checkpoint.close()
+
+    assert Checkpoint(str(tmp_path), resume=True).resumed() == {
+        "web1": {"host_name": "web1"},
+        "web2": {"host_name": "web2"},
+    }
+
+
+def test_new_run_starts_new_journal(tmp_path):
+    checkpoint = Checkpoint(str(tmp_path))
+    checkpoint.record("web1", {"host_name": "web1"})
+    checkpoint.close()
+
+    checkpoint = Checkpoint(str(tmp_path))
+
+    assert checkpoint.resumed() == {}
+    assert "web1" not in checkpoint
+    checkpoint.close()
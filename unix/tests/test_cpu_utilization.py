@@ -1,34 +1,51 @@
+import argparse
+import os
+
 import pytest
 from unittest.mock import patch, MagicMock, mock_open
+from src.machine_stats import Application
+from src.machine_stats.plugins import cpu_utilization as cpu_utilization_plugin
 from src.machine_stats.modules.cpu_utilization import (
     cpu_utilization,
+    percentile,
+    sample_cpu_utilization,
     cpu_utilization_value,
+    get_cpu_times,
     run_module,
     get_perf,
     get_date_time,
 )
 
 
+def cpu_times(idle, total, **cores):
+    """Build a get_cpu_times() reading with the given idle and total time"""
+    times = {"cpu": [total - idle, 0, 0, idle, 0, 0, 0, 0]}
+    for core, (core_idle, core_total) in cores.items():
+        times[core] = [core_total - core_idle, 0, 0, core_idle, 0, 0, 0, 0]
+    return times
+
+
 @patch("src.machine_stats.modules.cpu_utilization.get_date_time")
-@patch("src.machine_stats.modules.cpu_utilization.get_perf")
-def test_cpu_utilization(mock_get_perf, mock_get_date_time):
+@patch("src.machine_stats.modules.cpu_utilization.get_cpu_times")
+def test_cpu_utilization(mock_get_cpu_times, mock_get_date_time):
     """
     Test the cpu_utilization function with mocked data.
     """
-    # Mock the return values of get_perf to simulate CPU stats
-    mock_get_perf.side_effect = [
-        (100, 200),  # First call: idle=100, total=200
-        (150, 300),  # Second call: idle=150, total=300
+    # Mock the return values of get_cpu_times to simulate CPU stats
+    mock_get_cpu_times.side_effect = [
+        cpu_times(100, 200),  # First call: idle=100, total=200
+        cpu_times(150, 300),  # Second call: idle=150, total=300
     ]
     # Mock the return value of get_date_time
     mock_get_date_time.return_value = ("2025-10-23", "12:00:00")
 
     # Call the function with a timeout of 1 second
-    average, peak, rtc_date, rtc_time = cpu_utilization(timeout=1)
+    summary, rtc_date, rtc_time = cpu_utilization(timeout=1)
 
     # Assert the results
-    assert average == 50.0
-    assert peak == 50.0
+    assert summary["average"] == 50.0
+    assert summary["peak"] == 50.0
+    assert summary["p95"] == 50.0
     assert rtc_date == "2025-10-23"
     assert rtc_time == "12:00:00"
 
@@ -79,16 +96,19 @@ def test_get_date_time():
 
 
 @patch("src.machine_stats.modules.cpu_utilization.get_date_time")
-@patch("src.machine_stats.modules.cpu_utilization.get_perf")
-def test_cpu_utilization_zero_delta(mock_get_perf, mock_get_date_time):
+@patch("src.machine_stats.modules.cpu_utilization.get_cpu_times")
+def test_cpu_utilization_zero_delta(mock_get_cpu_times, mock_get_date_time):
     """
     Test cpu_utilization when total_delta is zero.
+
+    The first reading is only the baseline, so no sample covers the time
+    since boot.
     """
-    mock_get_perf.side_effect = [(100, 200), (100, 200)]  # No change
+    mock_get_cpu_times.side_effect = [cpu_times(100, 200), cpu_times(100, 200)]
     mock_get_date_time.return_value = ("2025-10-23", "12:00:00")
-    average, peak, _, _ = cpu_utilization(timeout=1)
-    assert average == 50.0
-    assert peak == 50.0
+    summary, _, _ = cpu_utilization(timeout=1)
+    assert summary["average"] == 0.0
+    assert summary["peak"] == 0.0
 
 
 @patch("src.machine_stats.modules.cpu_utilization.get_date_time")
@@ -131,15 +151,29 @@ def test_run_module_check_mode(mock_ansible_module):
 def test_run_module_success_default(mock_ansible_module, mock_cpu_utilization):
     mock_module = MagicMock()
     mock_module.check_mode = False
-    mock_module.params = {"timeout": 1, "only_value": False}
+    mock_module.params = {
+        "timeout": 1,
+        "interval": 1.0,
+        "only_value": False,
+        "proc_root": "/proc",
+    }
     mock_ansible_module.return_value = mock_module
-    mock_cpu_utilization.return_value = (50.0, 75.0, "2025-10-23", "12:00:00")
+    mock_cpu_utilization.return_value = (
+        {"average": 50.0, "peak": 75.0, "p50": 45.0, "p95": 70.0, "p99": 74.0},
+        "2025-10-23",
+        "12:00:00",
+    )
 
     run_module()
 
+    mock_cpu_utilization.assert_called_with(1, 1.0, proc_root="/proc")
     expected_result = {
         "average": 50.0,
         "peak": 75.0,
+        "p50": 45.0,
+        "p95": 70.0,
+        "p99": 74.0,
+        "interval": 1.0,
         "rtc_date": "2025-10-23",
         "rtc_time": "12:00:00",
     }
@@ -153,7 +187,12 @@ def test_run_module_success_default(mock_ansible_module, mock_cpu_utilization):
 def test_run_module_success_only_value(mock_ansible_module, mock_cpu_utilization_value):
     mock_module = MagicMock()
     mock_module.check_mode = False
-    mock_module.params = {"timeout": 1, "only_value": True}
+    mock_module.params = {
+        "timeout": 1,
+        "interval": 1.0,
+        "only_value": True,
+        "proc_root": "/proc",
+    }
     mock_ansible_module.return_value = mock_module
     mock_cpu_utilization_value.return_value = (60.0, "2025-10-23", "12:00:00")
 
@@ -174,7 +213,12 @@ def test_run_module_success_only_value(mock_ansible_module, mock_cpu_utilization
 def test_run_module_fail(mock_ansible_module, mock_cpu_utilization):
     mock_module = MagicMock()
     mock_module.check_mode = False
-    mock_module.params = {"timeout": 1, "only_value": False}
+    mock_module.params = {
+        "timeout": 1,
+        "interval": 1.0,
+        "only_value": False,
+        "proc_root": "/proc",
+    }
     mock_ansible_module.return_value = mock_module
     error_message = "Test Exception"
     mock_cpu_utilization.side_effect = Exception(error_message)
@@ -184,3 +228,279 @@ def test_run_module_fail(mock_ansible_module, mock_cpu_utilization):
     mock_module.fail_json.assert_called_with(
         msg=error_message, changed=False, timeout=0, ansible_cpu_utilization=None
     )
+
+
+@patch("src.machine_stats.modules.cpu_utilization.monotonic")
+@patch("src.machine_stats.modules.cpu_utilization.sleep")
+@patch("src.machine_stats.modules.cpu_utilization.get_cpu_times")
+def test_sample_cpu_utilization(mock_get_cpu_times, mock_sleep, mock_monotonic):
+    """
+    Test that samples are taken every interval, after a baseline reading,
+    without drifting because of the time spent reading.
+    """
+    clock = [100.0]
+    readings = iter(
+        [
+            # Baseline, never reported
+            cpu_times(1000, 2000, cpu0=(500, 1000), cpu1=(500, 1000)),
+            # 10%, both cores equally busy
+            cpu_times(1090, 2100, cpu0=(545, 1050), cpu1=(545, 1050)),
+            # 50%, all of it on cpu1
+            cpu_times(1140, 2200, cpu0=(595, 1100), cpu1=(545, 1100)),
+            # 100%
+            cpu_times(1140, 2300, cpu0=(595, 1150), cpu1=(545, 1150)),
+            # 10%
+            cpu_times(1230, 2400, cpu0=(640, 1200), cpu1=(590, 1200)),
+        ]
+    )
+
+    def read(fd):
+        clock[0] += 0.01  # Reading takes some time
+        return next(readings)
+
+    def sleep(seconds):
+        clock[0] += seconds
+
+    mock_get_cpu_times.side_effect = read
+    mock_sleep.side_effect = sleep
+    mock_monotonic.side_effect = lambda: clock[0]
+
+    sampled = sample_cpu_utilization(timeout=1, interval=0.25)
+
+    assert sampled["samples"] == pytest.approx([10.0, 50.0, 100.0, 10.0])
+    assert sampled["per_core_peak"] == pytest.approx([100.0, 100.0])
+    delays = [call[0][0] for call in mock_sleep.call_args_list]
+    assert delays == pytest.approx([0.25, 0.24, 0.24, 0.24])
+    assert clock[0] == pytest.approx(101.02)
+
+
+def test_get_cpu_times(tmp_path):
+    """
+    Test reading the aggregate and per-core lines of /proc/stat at once.
+    """
+    stat_file = tmp_path / "stat"
+    stat_file.write_text(
+        "cpu  200 10 100 1600 40 0 10 40 0 0\n"
+        "cpu0 100 5 50 800 20 0 5 20 0 0\n"
+        "cpu1 100 5 50 800 20 0 5 20 0 0\n"
+        "intr 123456 0 0\n"
+        "ctxt 98765\n"
+    )
+    fd = os.open(str(stat_file), os.O_RDONLY)
+    try:
+        times = get_cpu_times(fd)
+    finally:
+        os.close(fd)
+
+    assert sorted(times) == ["cpu", "cpu0", "cpu1"]
+    assert times["cpu1"] == [100, 5, 50, 800, 20, 0, 5, 20, 0, 0]
+
+
+@patch("src.machine_stats.modules.cpu_utilization.get_date_time")
+@patch("src.machine_stats.modules.cpu_utilization.get_cpu_times")
+def test_cpu_utilization_breakdown(mock_get_cpu_times, mock_get_date_time):
+    """
+    Test the user/system/iowait/steal breakdown and the per-core peaks.
+    """
+    mock_get_cpu_times.side_effect = [
+        {
+            "cpu": [0, 0, 0, 0, 0, 0, 0, 0, 0, 0],
+            "cpu0": [0, 0, 0, 0, 0, 0, 0, 0, 0, 0],
+            "cpu1": [0, 0, 0, 0, 0, 0, 0, 0, 0, 0],
+        },
+        {
+            # user 30 + nice 10, system 10 + irq 5 + softirq 5, idle 20,
+            # iowait 10, steal 10
+            "cpu": [30, 10, 10, 20, 10, 5, 5, 10, 0, 0],
+            "cpu0": [30, 10, 10, 0, 0, 0, 0, 0, 0, 0],
+            "cpu1": [0, 0, 0, 20, 10, 5, 5, 10, 0, 0],
+        },
+    ]
+    mock_get_date_time.return_value = ("2025-10-23", "12:00:00")
+
+    summary, _, _ = cpu_utilization(timeout=1)
+
+    assert summary["user"] == 40.0
+    assert summary["system"] == 20.0
+    assert summary["iowait"] == 10.0
+    assert summary["steal"] == 10.0
+    assert summary["average"] == 80.0
+    assert summary["per_core_peak"] == [100.0, 60.0]
+    assert summary["core_peak"] == 100.0
+
+
+def test_percentile():
+    samples = [10.0, 20.0, 30.0, 40.0, 50.0]
+    assert percentile(samples, 50) == 30.0
+    assert percentile(samples, 95) == pytest.approx(48.0)
+    assert percentile(samples, 100) == 50.0
+    assert percentile([42.0], 99) == 42.0
+
+
+def test_get_perf_from_open_file(tmp_path):
+    """
+    Test get_perf re-reading an already open file descriptor.
+    """
+    stat_file = tmp_path / "stat"
+    stat_file.write_text(
+        "cpu  100 0 100 800 0 0 0 0 0 0\ncpu0 100 0 100 800 0 0 0 0 0 0\n"
+    )
+    fd = os.open(str(stat_file), os.O_RDONLY)
+    try:
+        assert get_perf(fd) == (800.0, 1000.0)
+        stat_file.write_text("cpu  200 0 100 900 0 0 0 0 0 0\n")
+        assert get_perf(fd) == (900.0, 1200.0)
+    finally:
+        os.close(fd)
+
+
+@patch("src.machine_stats.modules.cpu_utilization.sleep")
+def test_cpu_utilization_proc_root(mock_sleep, tmp_path):
+    """
+    Test cpu_utilization reading a /proc tree other than the host's one.
+    """
+    (tmp_path / "stat").write_text("cpu  100 0 100 800 0 0 0 0 0 0\n")
+    (tmp_path / "driver").mkdir()
+    (tmp_path / "driver" / "rtc").write_text(
+        "rtc_time\t: 12:00:00\nrtc_date\t: 2025-10-23\n"
+    )
+
+    summary, rtc_date, rtc_time = cpu_utilization(1, 1.0, proc_root=str(tmp_path))
+    assert summary["average"] == 0.0
+    assert (rtc_date, rtc_time) == ("2025-10-23", "12:00:00")
+
+    assert get_perf(proc_root=str(tmp_path)) == (800.0, 1000.0)
+    assert cpu_utilization_value(1, proc_root=str(tmp_path)) == (
+        0.0,
+        "2025-10-23",
+        "12:00:00",
+    )
+
+
+@patch("src.machine_stats.modules.cpu_utilization.AnsibleModule")
+def test_run_module_invalid_interval(mock_ansible_module):
+    mock_module = MagicMock()
+    mock_module.check_mode = False
+    mock_module.params = {"timeout": 1, "interval": 60.0, "only_value": False}
+    mock_ansible_module.return_value = mock_module
+
+    run_module()
+
+    mock_module.fail_json.assert_called_with(
+        msg="interval must be between 0.1 and 10.0 seconds",
+        changed=False,
+        timeout=0,
+        ansible_cpu_utilization=None,
+    )
+
+
+def test_ok_callback_percentiles():
+    parent = MagicMock()
+    result = MagicMock()
+    result._host.get_name.return_value = "web1"
+    result._result = {
+        "timeout": 30,
+        "ansible_cpu_utilization": {
+            "average": 10.0,
+            "peak": 90.0,
+            "p50": 5.0,
+            "p95": 60.0,
+            "p99": 85.0,
+            "user": 6.0,
+            "system": 2.0,
+            "iowait": 1.5,
+            "steal": 0.5,
+            "per_core_peak": [90.0, 40.0],
+            "core_peak": 90.0,
+            "interval": 0.5,
+            "rtc_date": "2025-10-23",
+            "rtc_time": "12:00:00",
+        },
+    }
+
+    cpu_utilization_plugin.ok_callback(parent, result)
+
+    parent.update_results.assert_called_once_with(
+        "web1",
+        {
+            "custom_fields": {
+                "cpu_sampling_timeout": 30,
+                "cpu_sampling_interval": 0.5,
+                "cpu_average": 10.0,
+                "cpu_peak": 90.0,
+                "cpu_p50": 5.0,
+                "cpu_p95": 60.0,
+                "cpu_p99": 85.0,
+                "cpu_user": 6.0,
+                "cpu_system": 2.0,
+                "cpu_iowait": 1.5,
+                "cpu_steal": 0.5,
+                "cpu_core_peak": 90.0,
+                "cpu_utilization_timestamp": "2025-10-23 12:00:00",
+            }
+        },
+    )
+
+
+def _app(**args):
+    """Build an Application with only the cpu_utilization plugin set up"""
+    args = argparse.Namespace(
+        cpu_utilization_timeout=30,
+        cpu_utilization_interval=1.0,
+        cpu_utilization_only_value=False,
+        measurement=False,
+        **args,
+    )
+    app = Application(plugins=MagicMock(), args=args)
+    cpu_utilization_plugin.setup(app)
+    return app
+
+
+def test_setup_samples_synchronously_by_default():
+    play = _app().play_source()
+
+    assert play["gather_facts"] == "yes"
+    assert [task["action"]["module"] for task in play["tasks"]] == ["cpu_utilization"]
+    assert "pre_tasks" not in play
+
+
+def test_setup_samples_asynchronously():
+    app = _app(cpu_utilization_async=True)
+    play = app.play_source()
+
+    # Sampling starts before facts are gathered and is collected last.
+    assert play["gather_facts"] == "no"
+    (start,) = play["pre_tasks"]
+    assert start["action"]["module"] == "cpu_utilization"
+    assert start["poll"] == 0
+    assert start["async"] > 30
+    assert [task["action"]["module"] for task in play["tasks"]] == ["setup"]
+    (collect,) = play["post_tasks"]
+    assert collect["action"]["module"] == "async_status"
+    assert collect["action"]["args"]["jid"] == "{{ cpu_job.ansible_job_id }}"
+    assert collect["retries"] * collect["delay"] >= start["async"]
+
+    results_callback = app._results_callback(play)
+    assert results_callback._expected_tasks == 3
+
+
+def test_get_cpu_times_many_cpus(tmp_path):
+    """
+    Test reading all the per-core lines when they don't fit in a single read.
+    """
+    cores = 2048
+    stat_file = tmp_path / "stat"
+    stat_file.write_text(
+        "cpu  200 10 100 1600 40 0 10 40 0 0\n"
+        + "".join("cpu%d 100 5 50 800 20 0 5 20 0 0\n" % core for core in range(cores))
+        + "intr 123456 0 0\n"
+    )
+    assert stat_file.stat().st_size > 65536
+    fd = os.open(str(stat_file), os.O_RDONLY)
+    try:
+        times = get_cpu_times(fd)
+    finally:
+        os.close(fd)
+
+    assert len(times) == cores + 1
+    assert times["cpu%d" % (cores - 1)] == [100, 5, 50, 800, 20, 0, 5, 20, 0, 0]
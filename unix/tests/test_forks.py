@@ -0,0 +1,63 @@
+from unittest.mock import patch
+
+import pytest
+from src.machine_stats.forks import ForkTuner, parse_forks
+
+
+def test_parse_forks():
+    assert parse_forks("25") == 25
+    assert parse_forks("auto") is None
+    with pytest.raises(ValueError):
+        parse_forks("0")
+
+
+def test_fixed_forks():
+    tuner = ForkTuner(forks=10, host_count=5000)
+    assert not tuner.adaptive
+    assert tuner.forks() == 10
+    assert tuner.describe() == "10"
+
+
+@patch("src.machine_stats.forks.fd_limit", return_value=1024)
+@patch("src.machine_stats.forks.os.cpu_count", return_value=4)
+def test_adaptive_forks_default_latency(mock_cpu_count, mock_fd_limit):
+    tuner = ForkTuner(host_count=5000)
+    # 4 CPUs * (5s / 0.5s) = 40, well under the (1024 - 64) / 8 fd bound
+    assert tuner.limits() == {"cpu": 40, "fd": 120, "hosts": 5000}
+    assert tuner.forks() == 40
+
+
+@patch("src.machine_stats.forks.fd_limit", return_value=1024)
+@patch("src.machine_stats.forks.os.cpu_count", return_value=4)
+def test_adaptive_forks_observed_latency(mock_cpu_count, mock_fd_limit):
+    tuner = ForkTuner(host_count=5000)
+    for host in ("a", "b", "c"):
+        tuner.observe(host, 2.0)
+        tuner.observe(host, 30.0)
+    assert tuner.latency == 32.0
+    # Slow hosts leave the CPU idle, the fd limit becomes the bound
+    assert tuner.forks() == 120
+    assert tuner.describe() == "120 (auto: cpu=256, fd=120, hosts=5000, latency=32.0s)"
+
+
+@patch("src.machine_stats.forks.fd_limit", return_value=None)
+@patch("src.machine_stats.forks.os.cpu_count", return_value=64)
+def test_adaptive_forks_capped_by_hosts(mock_cpu_count, mock_fd_limit):
+    assert ForkTuner(host_count=3).forks() == 3
+
+
+@patch("src.machine_stats.forks.fd_limit", return_value=1024)
+@patch("src.machine_stats.forks.os.cpu_count", return_value=4)
+def test_describe_reports_the_forks_used(mock_cpu_count, mock_fd_limit):
+    tuner = ForkTuner(host_count=5000)
+    tuner.record(tuner.forks())
+    # Latency observed after the run does not change what the run used
+    tuner.observe("a", 160.0)
+    assert tuner.describe() == "40 (auto: cpu=40, fd=120, hosts=5000, latency=5.0s)"
+
+    tuner.record(tuner.forks())
+    tuner.record(tuner.forks())
+    assert (
+        tuner.describe()
+        == "40, 120 (auto: cpu=1280, fd=120, hosts=5000, latency=160.0s)"
+    )
@@ -0,0 +1,70 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+SRC = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src")
+
+# Modules of Ansible, which take most of the import time of machine_stats
+ANSIBLE_PACKAGES = ("ansible", "ansible_runner")
+
+# Print the Ansible modules imported once the code under test has run, on the
+# last line of its output
+CHECK_IMPORTS = """
+import sys
+{code}
+print(" ".join(sorted(
+    name for name in sys.modules if name.split(".")[0] in {packages!r}
+)))
+"""
+
+
+def _ansible_imports(tmp_path, code):
+    """Run ``code`` in a new interpreter and return the Ansible modules it
+    imported"""
+    env = dict(os.environ, PYTHONPATH=SRC)
+    env.pop("ANSIBLE_CONFIG", None)
+    process = subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            CHECK_IMPORTS.format(code=code, packages=ANSIBLE_PACKAGES),
+        ],
+        cwd=str(tmp_path),
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return process.stdout.split("\n")[-2].split()
+
+
+def test_import_does_not_import_ansible(tmp_path):
+    assert _ansible_imports(tmp_path, "import machine_stats") == []
+
+
+@pytest.mark.parametrize("args", [["--version"], ["--help"]])
+def test_cli_does_not_import_ansible(tmp_path, args):
+    code = "\n".join(
+        [
+            "import machine_stats",
+            "sys.argv = ['machine_stats'] + %r" % args,
+            "try:",
+            "    machine_stats.main()",
+            "except SystemExit:",
+            "    pass",
+        ]
+    )
+
+    assert _ansible_imports(tmp_path, code) == []
+
+
+def test_lazy_imports():
+    import src.machine_stats as machine_stats
+    from src.machine_stats import callbacks
+
+    assert machine_stats.ResultCallback is callbacks.ResultCallback
+    assert machine_stats.cpu_name is callbacks.cpu_name
+    with pytest.raises(AttributeError):
+        machine_stats.no_such_name
@@ -0,0 +1,157 @@
+from unittest.mock import patch
+
+from src.machine_stats.modules.machine_facts import (
+    ipv4_addresses,
+    ipv6_addresses,
+    machine_facts,
+    read_cpuinfo,
+    read_meminfo,
+    read_mounts,
+    read_os_release,
+    run_module,
+)
+
+FIB_TRIE = """Main:
+  +-- 0.0.0.0/0 3 0 5
+     |-- 0.0.0.0
+        /0 universe UNICAST
+     +-- 127.0.0.0/8 2 0 2
+        |-- 127.0.0.1
+           /32 host LOCAL
+     |-- 172.31.9.62
+        /32 host LOCAL
+     |-- 172.31.15.255
+        /32 link BROADCAST
+Local:
+  +-- 0.0.0.0/0 3 0 5
+     |-- 172.31.9.62
+        /32 host LOCAL
+     |-- 172.17.0.1
+        /32 host LOCAL
+"""
+
+IF_INET6 = """00000000000000000000000000000001 01 80 10 80       lo
+fe8000000000000004ee9cfffe97418f 02 40 20 80     eth0
+"""
+
+CPUINFO = """processor\t: 0
+vendor_id\t: GenuineIntel
+model name\t: Intel(R) Xeon(R) Platinum 8259CL CPU @ 2.50GHz
+
+processor\t: 1
+vendor_id\t: GenuineIntel
+model name\t: Intel(R) Xeon(R) Platinum 8259CL CPU @ 2.50GHz
+"""
+
+
+def test_read_meminfo(tmp_path):
+    meminfo = tmp_path / "meminfo"
+    meminfo.write_text(
+        "MemTotal:        1982464 kB\nMemFree:          232448 kB\n"
+        "MemAvailable:    1012345 kB\n"
+    )
+
+    assert read_meminfo(str(meminfo)) == {
+        "ansible_memtotal_mb": 1936,
+        "ansible_memfree_mb": 227,
+    }
+
+
+def test_read_cpuinfo(tmp_path):
+    cpuinfo = tmp_path / "cpuinfo"
+    cpuinfo.write_text(CPUINFO)
+
+    model = "Intel(R) Xeon(R) Platinum 8259CL CPU @ 2.50GHz"
+    assert read_cpuinfo(str(cpuinfo)) == {
+        "ansible_processor": ["0", "GenuineIntel", model, "1", "GenuineIntel", model],
+        "ansible_processor_vcpus": 2,
+    }
+
+
+def test_read_mounts(tmp_path):
+    mounts = tmp_path / "mounts"
+    mounts.write_text(
+        "proc /proc proc rw 0 0\n"
+        "tmpfs /run tmpfs rw 0 0\n"
+        "/dev/root %s ext4 rw 0 0\n" % tmp_path
+    )
+
+    (mount,) = read_mounts(str(mounts))["ansible_mounts"]
+
+    assert mount["mount"] == str(tmp_path)
+    assert mount["device"] == "/dev/root"
+    assert mount["size_total"] >= mount["size_available"] > 0
+
+
+def test_read_os_release(tmp_path):
+    os_release = tmp_path / "os-release"
+    os_release.write_text('NAME="Ubuntu"\nVERSION_ID="18.04"\nID=ubuntu\n')
+
+    assert read_os_release([str(tmp_path / "missing"), str(os_release)]) == {
+        "ansible_distribution": "Ubuntu",
+        "ansible_distribution_version": "18.04",
+    }
+
+
+def test_read_os_release_unknown_id(tmp_path):
+    os_release = tmp_path / "os-release"
+    os_release.write_text('NAME="Example Linux"\nID=example\n')
+
+    assert read_os_release([str(os_release)]) == {
+        "ansible_distribution": "Example Linux",
+        "ansible_distribution_version": "",
+    }
+
+
+def test_ip_addresses(tmp_path):
+    fib_trie = tmp_path / "fib_trie"
+    fib_trie.write_text(FIB_TRIE)
+    if_inet6 = tmp_path / "if_inet6"
+    if_inet6.write_text(IF_INET6)
+
+    assert ipv4_addresses(str(fib_trie)) == ["172.31.9.62", "172.17.0.1"]
+    assert ipv6_addresses(str(if_inet6)) == ["fe80::4ee:9cff:fe97:418f"]
+    assert ipv6_addresses(str(tmp_path / "missing")) == []
+
+
+def test_machine_facts_has_reported_facts():
+    facts = machine_facts()
+
+    for key in (
+        "ansible_hostname",
+        "ansible_fqdn",
+        "ansible_all_ipv4_addresses",
+        "ansible_all_ipv6_addresses",
+        "ansible_memtotal_mb",
+        "ansible_memfree_mb",
+        "ansible_mounts",
+        "ansible_processor_vcpus",
+        "ansible_distribution",
+        "ansible_distribution_version",
+        "ansible_processor",
+    ):
+        assert key in facts
+
+
+@patch("src.machine_stats.modules.machine_facts.machine_facts")
+@patch("src.machine_stats.modules.machine_facts.AnsibleModule")
+def test_run_module(mock_ansible_module, mock_machine_facts):
+    mock_machine_facts.return_value = {"ansible_hostname": "web1"}
+
+    run_module()
+
+    mock_ansible_module.return_value.exit_json.assert_called_once_with(
+        changed=False, ansible_facts={"ansible_hostname": "web1"}
+    )
+
+
+@patch("src.machine_stats.modules.machine_facts.machine_facts")
+@patch("src.machine_stats.modules.machine_facts.AnsibleModule")
+def test_run_module_fail(mock_ansible_module, mock_machine_facts):
+    mock_machine_facts.side_effect = OSError("no /proc")
+
+    run_module()
+
+    mock_ansible_module.return_value.fail_json.assert_called_once_with(
+        msg="no /proc", changed=False, ansible_facts={}
+    )
@@ -1,4 +1,7 @@
 import argparse
+import io
+import json
+import os
 from unittest.mock import MagicMock, patch
 
 import pytest
@@ -11,7 +14,15 @@ from src.machine_stats import (
     cpu_name,
     ip_addresses,
     main,
+    non_negative_float,
+    non_negative_int,
+    Application,
+    MeasurementsResultCallback,
+    ResultCallback,
+    ShimResult,
 )
+from src.machine_stats.checkpoint import Checkpoint
+from src.machine_stats.output import NDJSONWriter
 
 
 def test_ram_allocated_gb():
@@ -92,3 +103,564 @@ def test_main(mock_app_cls, mock_pm_cls, mock_parser_cls):
         sources=['hosts'], plugins=mock_pm_cls.return_value, args=mock_args
     )
     mock_app_cls.return_value.run.assert_called_once()
+
+
+def _runner_event(event, host="web1", res=None):
+    return {"event": event, "event_data": {"host": host, "res": res or {}}}
+
+
+@patch('src.machine_stats.ResultCallback')
+@patch('src.machine_stats.ansible_runner.run')
+def test_run_ansible_streams_events(mock_run, mock_callback_cls):
+    plugins = MagicMock()
+    args = argparse.Namespace(measurement=False)
+    app = Application(plugins=plugins, args=args)
+    callback = mock_callback_cls.return_value
+    seen_during_run = []
+
+    def fake_run(**kwargs):
+        handler = kwargs["event_handler"]
+        handler(_runner_event("runner_on_ok", res={"ansible_facts": {}}))
+        # The callback is fed while the runner is still going.
+        seen_during_run.append(callback.v2_runner_on_ok.call_count)
+        handler(_runner_event("runner_on_unreachable", host="web2", res={"msg": "x"}))
+        handler(_runner_event("runner_on_failed", host="web3", res={"msg": "y"}))
+        handler(_runner_event("playbook_on_start"))
+        handler({"event": "playbook_on_stats", "event_data": {"ok": {"web1": 1}}})
+        return MagicMock()
+
+    mock_run.side_effect = fake_run
+
+    app._run_ansible({}, "/tmp/private", {})
+
+    assert seen_during_run == [1]
+    assert callback.v2_runner_on_ok.call_args[0][0]._host.get_name() == "web1"
+    assert callback.v2_runner_on_unreachable.call_args[0][0]._host.get_name() == "web2"
+    assert callback.v2_runner_on_failed.call_args[0][0]._host.get_name() == "web3"
+    stats = callback.v2_playbook_on_stats.call_args[0][0]
+    assert stats["ok"] == {"web1": 1}
+    assert stats["dark"] == {}
+
+
+@patch('src.machine_stats.list_hosts', return_value=["web1", "web2", "web3"])
+@patch('src.machine_stats.ansible_runner.run')
+def test_run_ansible_batches(mock_run, mock_list_hosts, tmp_path, capsys):
+    plugins = MagicMock()
+    args = argparse.Namespace(measurement=False, batch_size=2)
+    app = Application(sources=["hosts"], plugins=plugins, args=args)
+    limits = []
+
+    def fake_run(**kwargs):
+        with open(kwargs["limit"][1:]) as f:
+            hosts = f.read().split()
+        limits.append(hosts)
+        handler = kwargs["event_handler"]
+        for host in hosts:
+            facts = {
+                "ansible_hostname": host,
+                "ansible_fqdn": host,
+                "ansible_all_ipv4_addresses": [],
+                "ansible_all_ipv6_addresses": [],
+                "ansible_memtotal_mb": 1024,
+                "ansible_memfree_mb": 512,
+                "ansible_processor_vcpus": 1,
+                "ansible_distribution": "Ubuntu",
+                "ansible_distribution_version": "24.04",
+                "ansible_processor": ["cpu"],
+            }
+            handler(_runner_event("runner_on_ok", host=host, res={"ansible_facts": facts}))
+        handler({"event": "playbook_on_stats", "event_data": {
+            "ok": {host: 1 for host in hosts},
+            "processed": {host: 1 for host in hosts},
+        }})
+        return MagicMock()
+
+    mock_run.side_effect = fake_run
+
+    app._run_ansible({}, str(tmp_path), {})
+
+    assert limits == [["web1", "web2"], ["web3"]]
+    output = json.loads(capsys.readouterr().out)
+    assert [server["host_name"] for server in output["servers"]] == ["web1", "web2", "web3"]
+
+
+def test_measurements_result_callback_writes_measurements(capsys):
+    callback = MeasurementsResultCallback(plugins=MagicMock())
+    callback.update_results("web1", {
+        "host_name": "web1",
+        "custom_fields": {
+            "cpu_average": 1.0,
+            "cpu_peak": 2.0,
+            "cpu_iowait": 3.0,
+            "cpu_sampling_timeout": 30,
+            "cpu_utilization_timestamp": "2025-10-23 12:00:00",
+        },
+    })
+    callback.v2_playbook_on_stats({})
+
+    output = json.loads(capsys.readouterr().out)
+    assert sorted(m["field_name"] for m in output["measurements"]) == [
+        "cpu_average_timeseries",
+        "cpu_iowait_timeseries",
+        "cpu_peak_timeseries",
+    ]
+    assert output["measurements"][0]["external_timestamp"] == "2025-10-23 12:00:00"
+
+
+def test_result_callback_streams_completed_hosts():
+    stream = io.StringIO()
+    callback = ResultCallback(
+        plugins=MagicMock(), writer=NDJSONWriter("servers", stream), expected_tasks=2
+    )
+
+    def result(host, res):
+        return ShimResult(_runner_event("runner_on_ok", host=host, res=res))
+
+    callback.update_results("web1", {"host_name": "web1"})
+    callback.update_results("web2", {"host_name": "web2"})
+    callback.v2_runner_on_ok(result("web1", {}))
+    assert stream.getvalue() == ""
+
+    callback.v2_runner_on_skipped(result("web1", {}))
+    assert stream.getvalue() == '{"host_name":"web1"}\n'
+
+    callback.v2_runner_on_unreachable(result("web2", {"msg": "unreachable"}))
+    callback.v2_playbook_on_stats({})
+    assert stream.getvalue().splitlines() == ['{"host_name":"web1"}', '{"host_name":"web2"}']
+
+
+def test_result_callback_ignores_interpreter_discovery_facts(capsys):
+    callback = ResultCallback(plugins=MagicMock(), expected_tasks=2)
+    # Ansible adds the discovered interpreter to the first result of a host,
+    # e.g. the async cpu_utilization pre_task.
+    callback.v2_runner_on_ok(ShimResult(_runner_event("runner_on_ok", res={
+        "ansible_facts": {"discovered_interpreter_python": "/usr/bin/python3"},
+    })))
+    callback.v2_runner_on_ok(ShimResult(_runner_event("runner_on_ok", res={
+        "ansible_facts": _facts("web1"),
+    })))
+    callback.v2_playbook_on_stats({})
+
+    (server,) = json.loads(capsys.readouterr().out)["servers"]
+    assert server["host_name"] == "web1"
+
+
+def test_play_source_minimal_fact_gathering():
+    args = argparse.Namespace(fact_gathering="minimal")
+    app = Application(plugins=MagicMock(), args=args)
+    app.add_playbook_tasks(dict(action=dict(module="proc_stats")))
+
+    play = app.play_source()
+
+    assert play["gather_facts"] == "no"
+    assert [task["action"]["module"] for task in play["tasks"]] == [
+        "machine_facts",
+        "proc_stats",
+    ]
+
+
+@patch('src.machine_stats.ansible_runner.run')
+def test_run_ansible_falls_back_without_pipelining(mock_run, tmp_path, capsys):
+    args = argparse.Namespace(measurement=False, ssh_profile="performance")
+    app = Application(plugins=MagicMock(), args=args)
+    runs = []
+
+    def fake_run(**kwargs):
+        runs.append((kwargs["limit"], kwargs["envvars"]["ANSIBLE_PIPELINING"]))
+        handler = kwargs["event_handler"]
+        if kwargs["limit"] is None:
+            handler(_runner_event("runner_on_ok", host="web1"))
+            handler(_runner_event("runner_on_failed", host="web2", res={
+                "msg": "MODULE FAILURE",
+                "module_stderr": "sudo: sorry, you must have a tty to run sudo",
+            }))
+            handler({"event": "playbook_on_stats", "event_data": {
+                "ok": {"web1": 1}, "failures": {"web2": 1},
+            }})
+        else:
+            with open(kwargs["limit"][1:]) as f:
+                assert f.read().split() == ["web2"]
+            handler({"event": "playbook_on_stats", "event_data": {"ok": {"web2": 1}}})
+        return MagicMock()
+
+    mock_run.side_effect = fake_run
+
+    with patch.object(ResultCallback, "v2_playbook_on_stats") as on_stats:
+        app._run_ansible({}, str(tmp_path), {})
+
+    assert runs == [(None, "True"), ("@" + str(tmp_path / "requiretty"), "False")]
+    stats = on_stats.call_args[0][0]
+    assert stats["ok"] == {"web1": 1, "web2": 1}
+    assert stats["failures"] == {}
+    assert "web2" not in capsys.readouterr().err
+
+
+@patch('src.machine_stats.ansible_runner.run')
+def test_run_ansible_reruns_tty_hosts_from_a_clean_record(mock_run, tmp_path):
+    output = tmp_path / "output.ndjson"
+    args = argparse.Namespace(
+        measurement=False, ssh_profile="performance", output_format="ndjson"
+    )
+    app = Application(plugins=MagicMock(), args=args)
+    play = dict(tasks=[dict(action=dict(module="setup")), dict(action=dict(module="ping"))])
+
+    def fake_run(**kwargs):
+        handler = kwargs["event_handler"]
+        if kwargs["limit"] is None:
+            handler(_runner_event("runner_on_ok", host="web2", res={"ansible_facts": {
+                "ansible_memtotal_mb": 4096, "ansible_memfree_mb": 0,
+            }}))
+            handler(_runner_event("runner_on_failed", host="web2", res={
+                "msg": "MODULE FAILURE",
+                "module_stderr": "sudo: sorry, you must have a tty to run sudo",
+            }))
+        else:
+            handler(_runner_event("runner_on_ok", host="web2"))
+            handler(_runner_event("runner_on_ok", host="web2", res={
+                "ansible_facts": _facts("web2"),
+            }))
+        return MagicMock()
+
+    mock_run.side_effect = fake_run
+
+    with open(output, "w") as stream:
+        app._run_ansible(play, str(tmp_path), {}, stream)
+
+    (server,) = [json.loads(line) for line in output.read_text().splitlines()]
+    assert server["host_name"] == "web2"
+    assert server["ram_allocated_gb"] == 1.0
+
+
+def _facts(host):
+    return {
+        "ansible_hostname": host,
+        "ansible_fqdn": host,
+        "ansible_all_ipv4_addresses": [],
+        "ansible_all_ipv6_addresses": [],
+        "ansible_memtotal_mb": 1024,
+        "ansible_memfree_mb": 512,
+        "ansible_processor_vcpus": 1,
+        "ansible_distribution": "Ubuntu",
+        "ansible_distribution_version": "24.04",
+        "ansible_processor": ["cpu"],
+    }
+
+
+@patch('src.machine_stats.list_hosts', return_value=["web1", "web2"])
+@patch('src.machine_stats.ansible_runner.run')
+def test_run_ansible_serves_cached_static_fields(mock_run, mock_list_hosts, tmp_path, capsys):
+    args = argparse.Namespace(measurement=False, cache=str(tmp_path / "cache"))
+    runs = []
+
+    def fake_run(**kwargs):
+        with open(kwargs["limit"][1:]) as f:
+            hosts = f.read().split()
+        cached_hosts = kwargs["extravars"]["machine_stats_cached_hosts"]
+        runs.append((hosts, cached_hosts))
+        handler = kwargs["event_handler"]
+        for host in hosts:
+            if host in cached_hosts:
+                facts = {"ansible_memtotal_mb": 1024, "ansible_memfree_mb": 256}
+            else:
+                facts = _facts(host)
+            handler(_runner_event("runner_on_ok", host=host, res={"ansible_facts": facts}))
+            # The other fact gathering task is skipped.
+            handler(_runner_event("runner_on_skipped", host=host))
+        return MagicMock()
+
+    mock_run.side_effect = fake_run
+
+    app = Application(sources=["hosts"], plugins=MagicMock(), args=args)
+    play = app.play_source()
+    app._run_ansible(play, str(tmp_path), {})
+    first = json.loads(capsys.readouterr().out)
+
+    app = Application(sources=["hosts"], plugins=MagicMock(), args=args)
+    app._run_ansible(play, str(tmp_path), {})
+    second = json.loads(capsys.readouterr().out)
+
+    assert [task.get("when") for task in play["tasks"]] == [
+        "inventory_hostname not in machine_stats_cached_hosts",
+        "inventory_hostname in machine_stats_cached_hosts",
+    ]
+    assert runs == [(["web1", "web2"], []), (["web1", "web2"], ["web1", "web2"])]
+    assert [server["ram_used_gb"] for server in first["servers"]] == [0.5, 0.5]
+    assert [server["ram_used_gb"] for server in second["servers"]] == [0.75, 0.75]
+    assert [server["host_name"] for server in second["servers"]] == ["web1", "web2"]
+
+
+@patch('src.machine_stats.list_hosts', return_value=["web1", "web2"])
+@patch('src.machine_stats.ansible_runner.run')
+def test_run_ansible_drops_cached_fields_of_unreachable_hosts(mock_run, mock_list_hosts, tmp_path, capsys):
+    args = argparse.Namespace(measurement=False, cache=str(tmp_path / "cache"))
+    unreachable = []
+
+    def fake_run(**kwargs):
+        handler = kwargs["event_handler"]
+        for host in ("web1", "web2"):
+            if host in unreachable:
+                handler(_runner_event("runner_on_unreachable", host=host, res={"msg": "timeout"}))
+                continue
+            handler(_runner_event("runner_on_ok", host=host, res={"ansible_facts": _facts(host)}))
+            handler(_runner_event("runner_on_skipped", host=host))
+        return MagicMock()
+
+    mock_run.side_effect = fake_run
+
+    app = Application(sources=["hosts"], plugins=MagicMock(), args=args)
+    app._run_ansible(app.play_source(), str(tmp_path), {})
+    capsys.readouterr()
+
+    unreachable.append("web1")
+    app = Application(sources=["hosts"], plugins=MagicMock(), args=args)
+    app._run_ansible(app.play_source(), str(tmp_path), {})
+
+    output = json.loads(capsys.readouterr().out)
+    assert [server["host_name"] for server in output["servers"]] == ["web2"]
+
+
+@pytest.mark.parametrize("measurement", [False, True])
+@patch('src.machine_stats.list_hosts', return_value=["web1"])
+@patch('src.machine_stats.ansible_runner.run')
+def test_run_ansible_completes_failed_hosts_from_cache(mock_run, mock_list_hosts, tmp_path, capsys, measurement):
+    args = argparse.Namespace(measurement=measurement, cache=str(tmp_path / "cache"))
+    failing = []
+
+    def fake_run(**kwargs):
+        handler = kwargs["event_handler"]
+        if kwargs["extravars"]["machine_stats_cached_hosts"]:
+            facts = {"ansible_memtotal_mb": 1024, "ansible_memfree_mb": 256}
+        else:
+            facts = _facts("web1")
+        handler(_runner_event("runner_on_ok", host="web1", res={"ansible_facts": facts}))
+        handler(_runner_event("runner_on_skipped", host="web1"))
+        if failing:
+            handler(_runner_event("runner_on_failed", host="web1", res={"msg": "proc_stats failed"}))
+        else:
+            handler(_runner_event("runner_on_ok", host="web1"))
+        return MagicMock()
+
+    def ok_callback(parent, result):
+        parent.update_results(result._host.get_name(), {"custom_fields": {
+            "cpu_average": 1.0, "cpu_utilization_timestamp": "2025-10-23 12:00:00",
+        }})
+
+    mock_run.side_effect = fake_run
+    plugins = MagicMock()
+    plugins.ok_callback.side_effect = ok_callback
+
+    def run():
+        app = Application(sources=["hosts"], plugins=plugins, args=args)
+        app.add_playbook_tasks(dict(action=dict(module="proc_stats")))
+        app._run_ansible(app.play_source(), str(tmp_path), {})
+        return json.loads(capsys.readouterr().out)
+
+    run()
+    # The last task fails on the run serving the static fields from the cache.
+    failing.append("web1")
+    output = run()
+
+    if measurement:
+        (record,) = output["measurements"]
+        assert record["measurable"] == {"host_name": "web1"}
+    else:
+        (server,) = output["servers"]
+        assert server["host_name"] == "web1"
+        assert server["ram_used_gb"] == 0.75
+    cached = json.loads((tmp_path / "cache" / "web1.json").read_text())
+    assert cached["static"]["fields"]["host_name"] == "web1"
+    assert cached["volatile"]["fields"]["ram_used_gb"] == 0.75
+
+
+@patch('src.machine_stats.list_hosts', return_value=["web1", "web2", "web3"])
+@patch('src.machine_stats.ansible_runner.run')
+def test_run_ansible_resumes_from_checkpoint(mock_run, mock_list_hosts, tmp_path, capsys):
+    checkpoint_dir = str(tmp_path / "checkpoint")
+    limits = []
+
+    def interrupted_run(**kwargs):
+        handler = kwargs["event_handler"]
+        handler(_runner_event("runner_on_ok", host="web1", res={"ansible_facts": _facts("web1")}))
+        raise KeyboardInterrupt
+
+    def fake_run(**kwargs):
+        with open(kwargs["limit"][1:]) as f:
+            hosts = f.read().split()
+        limits.append(hosts)
+        handler = kwargs["event_handler"]
+        for host in hosts:
+            handler(_runner_event("runner_on_ok", host=host, res={"ansible_facts": _facts(host)}))
+        return MagicMock()
+
+    args = argparse.Namespace(measurement=False, checkpoint=checkpoint_dir, resume=False)
+    app = Application(sources=["hosts"], plugins=MagicMock(), args=args)
+    mock_run.side_effect = interrupted_run
+    with pytest.raises(KeyboardInterrupt):
+        # A host is done after its only task, so it is journaled right away.
+        app._run_ansible({"gather_facts": "yes"}, str(tmp_path), {})
+    capsys.readouterr()
+
+    args.resume = True
+    app = Application(sources=["hosts"], plugins=MagicMock(), args=args)
+    mock_run.side_effect = fake_run
+    app._run_ansible({"gather_facts": "yes"}, str(tmp_path), {})
+
+    assert limits == [["web2", "web3"]]
+    output = json.loads(capsys.readouterr().out)
+    assert [server["host_name"] for server in output["servers"]] == ["web1", "web2", "web3"]
+
+
+@patch('src.machine_stats.list_hosts', return_value=["web1", "web2"])
+@patch('src.machine_stats.ansible_runner.run')
+def test_run_ansible_does_not_cache_resumed_hosts(mock_run, mock_list_hosts, tmp_path, capsys):
+    cache_dir = tmp_path / "cache"
+
+    def fake_run(**kwargs):
+        with open(kwargs["limit"][1:]) as f:
+            hosts = f.read().split()
+        handler = kwargs["event_handler"]
+        for host in hosts:
+            handler(_runner_event("runner_on_ok", host=host, res={"ansible_facts": _facts(host)}))
+            handler(_runner_event("runner_on_skipped", host=host))
+        return MagicMock()
+
+    args = argparse.Namespace(
+        measurement=False, checkpoint=str(tmp_path / "checkpoint"), resume=True,
+        cache=str(cache_dir),
+    )
+    checkpoint = Checkpoint(args.checkpoint)
+    checkpoint.record("web1", {"host_name": "web1"})
+    checkpoint.close()
+    mock_run.side_effect = fake_run
+
+    app = Application(sources=["hosts"], plugins=MagicMock(), args=args)
+    app._run_ansible(app.play_source(), str(tmp_path), {})
+
+    output = json.loads(capsys.readouterr().out)
+    assert [server["host_name"] for server in output["servers"]] == ["web1", "web2"]
+    # The journaled result of web1 is not made fresh again in the cache.
+    assert sorted(os.listdir(cache_dir)) == ["web2.json"]
+
+
+@patch('src.machine_stats.time.sleep')
+@patch('src.machine_stats.list_hosts', return_value=["web1", "web2", "web3"])
+@patch('src.machine_stats.ansible_runner.run')
+def test_run_ansible_retries_failed_hosts(mock_run, mock_list_hosts, mock_sleep, tmp_path, capsys):
+    args = argparse.Namespace(
+        measurement=False, batch_size=3, retries=2, retry_backoff=5.0, retry_forks=2
+    )
+    app = Application(sources=["hosts"], plugins=MagicMock(), args=args)
+    runs = []
+    # Attempts left before each host succeeds
+    failures = {"web2": 1, "web3": 5}
+
+    def fake_run(**kwargs):
+        with open(kwargs["limit"][1:]) as f:
+            hosts = f.read().split()
+        runs.append((hosts, kwargs["forks"]))
+        handler = kwargs["event_handler"]
+        for host in hosts:
+            if failures.get(host, 0):
+                failures[host] -= 1
+                handler(_runner_event("runner_on_ok", host=host, res={"ansible_facts": _facts(host)}))
+                handler(_runner_event("runner_on_unreachable", host=host, res={"msg": "timeout"}))
+                handler({"event": "playbook_on_stats", "event_data": {"dark": {host: 1}, "processed": {host: 1}}})
+            else:
+                handler(_runner_event("runner_on_ok", host=host, res={"ansible_facts": _facts(host)}))
+                handler({"event": "playbook_on_stats", "event_data": {"ok": {host: 1}, "processed": {host: 1}}})
+        return MagicMock()
+
+    mock_run.side_effect = fake_run
+
+    with patch.object(ResultCallback, "v2_playbook_on_stats", autospec=True) as on_stats:
+        on_stats.side_effect = lambda callback, stats: callback._writer.close()
+        app._run_ansible({"gather_facts": "yes"}, str(tmp_path), {})
+
+    assert runs == [
+        (["web1", "web2", "web3"], 10),
+        (["web2", "web3"], 2),
+        (["web3"], 2),
+    ]
+    assert [call.args[0] for call in mock_sleep.call_args_list] == [5.0, 10.0]
+    stats = on_stats.call_args[0][1]
+    assert stats["attempts"] == {"web2": 2, "web3": 3}
+    assert stats["dark"] == {"web3": 1}
+    assert stats["ok"] == {"web1": 1, "web2": 1}
+    # Failed attempts are not written out, only the last one.
+    output = json.loads(capsys.readouterr().out)
+    assert [server["host_name"] for server in output["servers"]] == ["web1", "web2", "web3"]
+
+
+@patch('src.machine_stats.ansible_runner.run')
+def test_run_ansible_profile(mock_run, tmp_path, capsys):
+    profile_file = tmp_path / "profile.json"
+    args = argparse.Namespace(measurement=False, profile_file=str(profile_file))
+    app = Application(plugins=MagicMock(), args=args)
+
+    def fake_run(**kwargs):
+        handler = kwargs["event_handler"]
+        for host, duration in (("web1", 1.5), ("web2", 4.0)):
+            event = _runner_event("runner_on_ok", host=host, res={"ansible_facts": _facts(host)})
+            event["event_data"].update(task_action="setup", duration=duration)
+            handler(event)
+        return MagicMock()
+
+    mock_run.side_effect = fake_run
+
+    app._run_ansible({"gather_facts": "yes"}, str(tmp_path), {})
+
+    profile = json.loads(profile_file.read_text())
+    assert set(profile["phases"]) == {
+        "total", "runner", "runner startup", "events", "serialization"
+    }
+    assert profile["tasks"]["setup"]["max"] == 4.0
+    assert [host["host"] for host in profile["slowest_hosts"]] == ["web2", "web1"]
+    recap = capsys.readouterr().err
+    assert "task setup: p50 1.50s, p95 4.00s, max 4.00s (2 runs)" in recap
+
+
+@pytest.mark.parametrize("debug_artifacts", [None, "/tmp/artifacts"])
+@patch('src.machine_stats.ResultCallback')
+@patch('src.machine_stats.ansible_runner.run')
+def test_run_ansible_debug_artifacts(mock_run, mock_callback_cls, debug_artifacts):
+    args = argparse.Namespace(measurement=False, debug_artifacts=debug_artifacts)
+    app = Application(plugins=MagicMock(), args=args)
+    written = []
+
+    def fake_run(**kwargs):
+        handler = kwargs["event_handler"]
+        written.append(handler(_runner_event("runner_on_ok")))
+        return MagicMock()
+
+    mock_run.side_effect = fake_run
+
+    app._run_ansible({}, "/tmp/private", {})
+
+    options = mock_run.call_args[1]
+    if debug_artifacts is None:
+        # Events stay in memory, nothing but the play is written.
+        assert written == [False]
+        assert options["verbosity"] == 0
+        assert options["suppress_output_file"] is True
+        assert "artifact_dir" not in options
+    else:
+        assert written == [True]
+        assert options["verbosity"] == 3
+        assert options["artifact_dir"] == debug_artifacts
+
+
+def test_non_negative_int():
+    assert non_negative_int("0") == 0
+    assert non_negative_int("3") == 3
+    # e.g. --retries -1 would park the failed hosts without ever retrying them
+    with pytest.raises(argparse.ArgumentTypeError):
+        non_negative_int("-1")
+
+
+def test_non_negative_float():
+    assert non_negative_float("0") == 0.0
+    assert non_negative_float("2.5") == 2.5
+    # e.g. --retry-backoff -1 would fail the sleep once the inventory has run
+    for value in ("-1", "nan"):
+        with pytest.raises(argparse.ArgumentTypeError):
+            non_negative_float(value)
@@ -0,0 +1,61 @@
+import io
+import json
+
+from src.machine_stats.output import JSONDocumentWriter, make_writer
+
+
+def _write(records, key="servers", open_first=False):
+    stream = io.StringIO()
+    writer = JSONDocumentWriter(key, stream=stream)
+    if open_first:
+        writer.open()
+    for record in records:
+        writer.write(record)
+    writer.close()
+    return stream.getvalue()
+
+
+def test_json_document_writer_matches_json_dumps():
+    records = [
+        {"host_name": "web1", "ip_addresses": ["10.0.0.1", "::1"], "cpu_count": 2},
+        {"host_name": "web2", "custom_fields": {"cpu_peak": 1.5, "cpu_average": 0.5}},
+    ]
+    expected = json.dumps({"servers": records}, indent=4, sort_keys=True) + "\n"
+    assert _write(records) == expected
+
+
+def test_json_document_writer_empty_document():
+    expected = json.dumps({"measurements": []}, indent=4, sort_keys=True) + "\n"
+    assert _write([], key="measurements", open_first=True) == expected
+
+
+def test_json_document_writer_nothing_written():
+    assert _write([]) == ""
+
+
+def test_ndjson_writer():
+    stream = io.StringIO()
+    writer = make_writer("ndjson", "servers", stream=stream)
+    writer.open()
+    writer.write({"host_name": "web1", "cpu_count": 2})
+    writer.write({"host_name": "web2"})
+    writer.close()
+    lines = stream.getvalue().splitlines()
+    assert lines == ['{"host_name":"web1","cpu_count":2}', '{"host_name":"web2"}']
+
+
+def test_writers_expand_lazy_sequences():
+    records = [{"host_name": "web1", "process_stats": ({"pid": pid} for pid in (1, 2))}]
+    expected = (
+        json.dumps(
+            {
+                "servers": [
+                    {"host_name": "web1", "process_stats": [{"pid": 1}, {"pid": 2}]}
+                ]
+            },
+            indent=4,
+            sort_keys=True,
+        )
+        + "\n"
+    )
+    assert _write(records) == expected
@@ -0,0 +1,61 @@
+from src.machine_stats import PluginManager
+
+
+def _plugins(tmp_path):
+    (tmp_path / "alpha.py").write_text(
+        "def setup(app):\n"
+        "    app.append('alpha')\n"
+        "def ok_callback(parent, result):\n"
+        "    parent.append(('alpha', result))\n"
+    )
+    (tmp_path / "beta.py").write_text(
+        "def ok_callback(parent, result):\n" "    parent.append(('beta', result))\n"
+    )
+    return PluginManager(searchpath=[str(tmp_path)])
+
+
+def test_plugin_manager_dispatches_in_plugin_order(tmp_path):
+    plugins = _plugins(tmp_path)
+
+    calls = []
+    plugins.ok_callback(calls, 1)
+    plugins.ok_callback(calls, 2)
+
+    assert calls == [("alpha", 1), ("beta", 1), ("alpha", 2), ("beta", 2)]
+
+
+def test_plugin_manager_skips_plugins_without_hook(tmp_path):
+    plugins = _plugins(tmp_path)
+
+    # beta has no setup, alpha still gets called
+    app = []
+    plugins.setup(app)
+    plugins.no_such_hook("anything")
+
+    assert app == ["alpha"]
+
+
+def test_plugin_manager_loads_plugins_once(tmp_path, monkeypatch):
+    plugins = _plugins(tmp_path)
+    loaded = []
+    load_plugin = plugins._source.load_plugin
+
+    def counting_load_plugin(name):
+        loaded.append(name)
+        return load_plugin(name)
+
+    monkeypatch.setattr(plugins._source, "load_plugin", counting_load_plugin)
+
+    for result in range(3):
+        plugins.ok_callback([], result)
+    plugins.setup([])
+
+    assert loaded == ["alpha", "beta"]
+    assert plugins.ok_callback is plugins.ok_callback
+
+
+def test_plugin_manager_builtin_plugins():
+    plugins = PluginManager()
+
+    assert [name for name, _ in plugins.plugins()] == ["cpu_utilization", "proc_stats"]
+    assert len(plugins.hooks("ok_callback")) == 2
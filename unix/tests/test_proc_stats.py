@@ -1,6 +1,10 @@
+import argparse
+
 import pytest
 from unittest.mock import patch, mock_open, MagicMock
-from src.machine_stats.modules.proc_stats import parse_status, process_stats, run_module, _get_process_exe_info, _parse_proc_status_file, _get_username_from_uid
+from src.machine_stats.modules import proc_stats
+from src.machine_stats.plugins import proc_stats as proc_stats_plugin
+from src.machine_stats.modules.proc_stats import encode_columnar, filter_processes, group_by_executable, top_processes, parse_status, process_stats, read_process, run_module, _get_process_exe_info, _parse_proc_status_file, _get_username_from_uid
 
 @patch('src.machine_stats.modules.proc_stats.Path')
 def test__get_process_exe_info_success(mock_path):
@@ -128,7 +132,7 @@ def test_process_stats(mock_scandir, mock_parse_status):
         {}  # This empty dict should be filtered out
     ]
 
-    stats = process_stats()
+    stats = process_stats(engine="legacy")
 
     assert len(stats) == 1
     assert stats[0]['name'] == 'nginx'
@@ -165,7 +169,9 @@ def test_run_module_check_mode(mock_ansible_module):
 @patch("src.machine_stats.modules.proc_stats.AnsibleModule")
 def test_run_module_success(mock_ansible_module, mock_process_stats):
     mock_module = MagicMock()
-    mock_module.params = {"process_stats": True}
+    mock_module.params = {"process_stats": True, "engine": "fast", "preload_users": False, "encoding": "records",
+                          "min_memory_mb": 0, "min_alive_time": 0, "exclude_kernel_threads": False,
+                          "group_by_executable": False, "top": 0, "proc_root": "/proc"}
     mock_module.check_mode = False
     mock_ansible_module.return_value = mock_module
 
@@ -177,11 +183,29 @@ def test_run_module_success(mock_ansible_module, mock_process_stats):
     mock_module.exit_json.assert_called_with(changed=False, ansible_proc_stats=expected_stats)
 
 
+@patch("src.machine_stats.modules.proc_stats.process_stats")
+@patch("src.machine_stats.modules.proc_stats.AnsibleModule")
+def test_run_module_proc_root(mock_ansible_module, mock_process_stats):
+    mock_module = MagicMock()
+    mock_module.params = {"process_stats": True, "engine": "fast", "preload_users": False, "encoding": "records",
+                          "min_memory_mb": 0, "min_alive_time": 0, "exclude_kernel_threads": False,
+                          "group_by_executable": False, "top": 0, "proc_root": "/host/proc"}
+    mock_module.check_mode = False
+    mock_ansible_module.return_value = mock_module
+    mock_process_stats.return_value = []
+
+    run_module()
+
+    mock_process_stats.assert_called_with(engine="fast", proc_root="/host/proc", preload_users=False)
+
+
 @patch("src.machine_stats.modules.proc_stats.process_stats")
 @patch("src.machine_stats.modules.proc_stats.AnsibleModule")
 def test_run_module_fail(mock_ansible_module, mock_process_stats):
     mock_module = MagicMock()
-    mock_module.params = {"process_stats": True}
+    mock_module.params = {"process_stats": True, "engine": "fast", "preload_users": False, "encoding": "records",
+                          "min_memory_mb": 0, "min_alive_time": 0, "exclude_kernel_threads": False,
+                          "group_by_executable": False, "top": 0, "proc_root": "/proc"}
     mock_module.check_mode = False
     mock_ansible_module.return_value = mock_module
 
@@ -191,3 +215,211 @@ def test_run_module_fail(mock_ansible_module, mock_process_stats):
     run_module()
 
     mock_module.fail_json.assert_called_with(msg=error_message, changed=False, ansible_proc_stats=None)
+
+
+def _fake_process(proc_root, pid, exe=None, status=None):
+    process_path = proc_root / str(pid)
+    process_path.mkdir()
+    if exe is not None:
+        (process_path / "exe").symlink_to(exe)
+    (process_path / "status").write_text(status or (
+        "Name:\tnginx\nUmask:\t0022\nState:\tS (sleeping)\nPid:\t%d\nPPid:\t1\n"
+        "Uid:\t0\t0\t0\t0\nGid:\t0\t0\t0\t0\nVmPeak:\t  2048 kB\n"
+        "VmSize:\t  1024 kB\nVmRSS:\t   512 kB\n" % pid
+    ))
+    return str(process_path)
+
+
+@patch('src.machine_stats.modules.proc_stats._get_username_from_uid', return_value='root')
+def test_read_process(mock_get_username, tmp_path):
+    process_path = _fake_process(tmp_path, 42, exe="/usr/sbin/nginx")
+
+    stats = read_process(process_path)
+
+    assert stats['path'] == '/usr/sbin'
+    assert stats['name'] == 'nginx'
+    assert stats['pid'] == 42
+    assert stats['ppid'] == 1
+    assert stats['memory_used_mb'] == 1
+    assert stats['max_memory_used_mb'] == 2
+    assert stats['user'] == 'root'
+    assert stats['total_alive_time'] >= 0
+    mock_get_username.assert_called_with('0\t0\t0\t0')
+
+
+@patch('src.machine_stats.modules.proc_stats.time', return_value=1672531260)
+@patch('src.machine_stats.modules.proc_stats._get_username_from_uid', return_value='root')
+def test_read_process_matches_parse_status(mock_get_username, mock_time, tmp_path):
+    with_exe = _fake_process(tmp_path, 42, exe="/usr/sbin/nginx")
+    kernel_thread = _fake_process(
+        tmp_path, 2, status="Name:\tkthreadd\nPid:\t2\nPPid:\t0\nUid:\t0\t0\t0\t0\n"
+    )
+
+    for process_path in (with_exe, kernel_thread):
+        assert read_process(process_path) == parse_status(process_path)
+
+
+@patch('src.machine_stats.modules.proc_stats._get_username_from_uid', return_value='root')
+def test_read_process_vm_size_across_reads(mock_get_username, tmp_path):
+    status = (
+        "Name:\tjava\nPid:\t42\nPPid:\t1\nUid:\t0\t0\t0\t0\n"
+        "VmPeak:\t 2097152 kB\nVmSize:\t 1048576 kB\nVmRSS:\t   512 kB\n"
+    )
+    process_path = _fake_process(tmp_path, 42, status=status)
+    # The first read ends in the middle of the VmSize value
+    sizes = [status.index("VmSize:") + len("VmSize:\t 10"), 4096, 4096]
+    real_read = proc_stats.os.read
+
+    with patch('src.machine_stats.modules.proc_stats.os.read',
+               side_effect=lambda fd, size: real_read(fd, sizes.pop(0))):
+        stats = read_process(process_path)
+
+    assert stats['memory_used_mb'] == 1024
+    assert stats['max_memory_used_mb'] == 2048
+
+
+def test_read_process_exited(tmp_path):
+    assert read_process(str(tmp_path / "12345")) == {}
+
+
+@patch('src.machine_stats.modules.proc_stats._get_username_from_uid', return_value='root')
+def test_process_stats_fast_engine(mock_get_username, tmp_path):
+    _fake_process(tmp_path, 42, exe="/usr/sbin/nginx")
+    _fake_process(tmp_path, 43, exe="/usr/bin/python3")
+    (tmp_path / "self").mkdir()
+
+    stats = process_stats(proc_root=str(tmp_path))
+
+    assert sorted(process['pid'] for process in stats) == [42, 43]
+
+
+@patch('src.machine_stats.modules.proc_stats.getpwuid')
+def test__get_username_from_uid_cached(mock_getpwuid):
+    proc_stats._usernames.clear()
+    mock_getpwuid.return_value.pw_name = 'www-data'
+    assert _get_username_from_uid('33\t33\t33\t33') == 'www-data'
+    assert _get_username_from_uid('33\t33\t33\t33') == 'www-data'
+    mock_getpwuid.assert_called_once_with(33)
+
+
+@patch('src.machine_stats.modules.proc_stats.getpwuid')
+@patch('src.machine_stats.modules.proc_stats.getpwall')
+def test_process_stats_preload_users(mock_getpwall, mock_getpwuid, tmp_path):
+    mock_getpwall.return_value = [
+        MagicMock(pw_uid=0, pw_name='root'),
+        MagicMock(pw_uid=0, pw_name='toor'),
+    ]
+    _fake_process(tmp_path, 42, exe="/usr/sbin/nginx")
+    _fake_process(tmp_path, 43, exe="/usr/sbin/nginx")
+
+    stats = process_stats(proc_root=str(tmp_path), preload_users=True)
+
+    assert [process['user'] for process in stats] == ['root', 'root']
+    mock_getpwall.assert_called_once_with()
+    mock_getpwuid.assert_not_called()
+
+
+PROCESSES = [
+    {'path': '/usr/sbin', 'name': 'nginx', 'user': 'www-data', 'pid': 10, 'ppid': 1,
+     'memory_used_mb': 10.5, 'max_memory_used_mb': 12.0, 'total_alive_time': 60},
+    {'path': '/usr/sbin', 'name': 'nginx', 'user': 'www-data', 'pid': 11, 'ppid': 10,
+     'memory_used_mb': 9.5, 'max_memory_used_mb': 11.0, 'total_alive_time': 59},
+    {'path': '/', 'name': 'kthreadd', 'user': 'root', 'pid': 2, 'ppid': 0,
+     'total_alive_time': 600},
+]
+
+
+def test_encode_columnar():
+    encoded = encode_columnar(PROCESSES)
+
+    assert encoded['encoding'] == 'columnar'
+    assert encoded['count'] == 3
+    assert encoded['strings'] == ['/usr/sbin', 'nginx', 'www-data', '/', 'kthreadd', 'root']
+    assert encoded['columns']['path'] == [0, 0, 3]
+    assert encoded['columns']['pid'] == [10, 11, 2]
+    assert encoded['columns']['memory_used_mb'] == [10.5, 9.5, None]
+
+
+def test_columnar_process_stats_expands_records():
+    processes = proc_stats_plugin.ColumnarProcessStats(encode_columnar(PROCESSES))
+
+    assert len(processes) == 3
+    assert list(processes) == PROCESSES
+    assert processes[-1] == PROCESSES[-1]
+    assert processes[1:] == PROCESSES[1:]
+
+
+def test_ok_callback_columnar():
+    parent = MagicMock()
+    result = MagicMock()
+    result._host.get_name.return_value = 'web1'
+    result._result = {'ansible_proc_stats': encode_columnar(PROCESSES)}
+
+    proc_stats_plugin.ok_callback(parent, result)
+
+    host, data = parent.update_results.call_args[0]
+    assert host == 'web1'
+    assert isinstance(data['process_stats'], proc_stats_plugin.ColumnarProcessStats)
+    assert list(data['process_stats']) == PROCESSES
+
+
+def test_filter_processes():
+    assert filter_processes(PROCESSES) == PROCESSES
+    assert filter_processes(PROCESSES, exclude_kernel_threads=True) == PROCESSES[:2]
+    assert filter_processes(PROCESSES, min_memory_mb=10) == PROCESSES[:1]
+    assert filter_processes(PROCESSES, min_alive_time=60) == [PROCESSES[0], PROCESSES[2]]
+
+
+def test_group_by_executable():
+    groups = group_by_executable(PROCESSES)
+
+    assert groups == [
+        {'path': '/usr/sbin', 'name': 'nginx', 'count': 2, 'memory_used_mb': 20.0,
+         'max_memory_used_mb': 23.0, 'total_alive_time': 60, 'users': ['www-data']},
+        {'path': '/', 'name': 'kthreadd', 'count': 1, 'memory_used_mb': 0,
+         'max_memory_used_mb': 0, 'total_alive_time': 600, 'users': ['root']},
+    ]
+
+
+def test_top_processes():
+    assert top_processes(PROCESSES, 1) == PROCESSES[:1]
+    assert [p['pid'] for p in top_processes(PROCESSES, 5)] == [10, 11, 2]
+
+
+def test_encode_columnar_groups():
+    encoded = encode_columnar(group_by_executable(PROCESSES))
+
+    assert 'pid' not in encoded['columns']
+    assert encoded['columns']['count'] == [2, 1]
+    assert encoded['columns']['users'] == [['www-data'], ['root']]
+    assert list(proc_stats_plugin.ColumnarProcessStats(encoded)) == group_by_executable(PROCESSES)
+
+
+@patch("src.machine_stats.modules.proc_stats.process_stats")
+@patch("src.machine_stats.modules.proc_stats.AnsibleModule")
+def test_run_module_filters_on_target(mock_ansible_module, mock_process_stats):
+    mock_module = MagicMock()
+    mock_module.params = {"process_stats": True, "engine": "fast", "preload_users": False,
+                          "encoding": "records", "min_memory_mb": 0, "min_alive_time": 0,
+                          "exclude_kernel_threads": True, "group_by_executable": True,
+                          "top": 1, "proc_root": "/proc"}
+    mock_module.check_mode = False
+    mock_ansible_module.return_value = mock_module
+    mock_process_stats.return_value = PROCESSES
+
+    run_module()
+
+    stats = mock_module.exit_json.call_args[1]['ansible_proc_stats']
+    assert [(group['name'], group['count']) for group in stats] == [('nginx', 2)]
+
+
+def test_add_arguments_rejects_negative_filters():
+    parser = argparse.ArgumentParser()
+    proc_stats_plugin.add_arguments(parser)
+
+    args = parser.parse_args(["--process-stats-top", "5", "--process-stats-min-alive-time", "0"])
+    assert (args.process_stats_top, args.process_stats_min_alive_time) == (5, 0)
+    for argv in (["--process-stats-top", "0"], ["--process-stats-top", "-1"],
+                 ["--process-stats-min-alive-time", "-60"]):
+        with pytest.raises(SystemExit):
+            parser.parse_args(argv)
@@ -0,0 +1,108 @@
+import io
+import json
+import time
+
+from src.machine_stats.output import NDJSONWriter
+from src.machine_stats.profiling import Profiler, TimedWriter, percentile
+
+
+def test_percentile():
+    values = list(range(1, 101))
+    assert percentile(values, 50) == 50
+    assert percentile(values, 95) == 95
+    assert percentile([3.0], 95) == 3.0
+    assert percentile([], 50) == 0.0
+
+
+def test_report():
+    profiler = Profiler()
+    for index in range(20):
+        profiler.task("web%d" % index, "setup", 1.0 + index)
+        profiler.task("web%d" % index, "proc_stats", 0.5)
+    profiler.add("runner", 30.0)
+    profiler.add("total", 31.0)
+
+    report = profiler.report()
+
+    assert list(report["phases"]) == ["total", "runner"]
+    assert report["tasks"]["setup"] == {
+        "count": 20,
+        "p50": 10.0,
+        "p95": 19.0,
+        "max": 20.0,
+    }
+    assert report["tasks"]["proc_stats"]["p95"] == 0.5
+    assert len(report["slowest_hosts"]) == 10
+    assert report["slowest_hosts"][0] == {
+        "host": "web19",
+        "seconds": 20.5,
+        "tasks": {"setup": 20.0, "proc_stats": 0.5},
+    }
+
+
+def test_recap():
+    profiler = Profiler()
+    profiler.task("web1", "setup", 2.0)
+    profiler.add("total", 3.0)
+
+    assert profiler.recap() == [
+        ("phases", "total 3.00s"),
+        ("task setup", "p50 2.00s, p95 2.00s, max 2.00s (1 runs)"),
+        ("slowest hosts", "web1 2.00s"),
+    ]
+
+
+def test_runner_startup():
+    profiler = Profiler()
+
+    with profiler.run():
+        profiler.event()
+        profiler.event()
+
+    assert set(profiler.phases) == {"runner", "runner startup"}
+    assert profiler.phases["runner startup"] <= profiler.phases["runner"]
+
+
+def test_write(tmp_path):
+    profiler = Profiler()
+    profiler.task("web1", "setup", 2.0)
+    path = tmp_path / "profile.json"
+
+    profiler.write(str(path))
+
+    assert json.loads(path.read_text())["tasks"]["setup"]["count"] == 1
+
+
+def test_timed_writer():
+    stream = io.StringIO()
+    profiler = Profiler()
+    writer = TimedWriter(NDJSONWriter("servers", stream), profiler)
+
+    writer.open()
+    writer.write({"host_name": "web1"})
+    writer.close()
+
+    assert writer.streaming
+    assert stream.getvalue() == '{"host_name":"web1"}\n'
+    assert "serialization" in profiler.phases
+
+
+class SlowWriter:
+    streaming = True
+
+    def write(self, record):
+        time.sleep(0.05)
+
+
+def test_nested_phases_do_not_overlap():
+    profiler = Profiler()
+    writer = TimedWriter(SlowWriter(), profiler)
+
+    with profiler.run():
+        with profiler.phase("events"):
+            # e.g. a host written out as soon as its last event is handled
+            writer.write({"host_name": "web1"})
+
+    assert profiler.phases["serialization"] >= 0.05
+    assert profiler.phases["events"] < 0.05
+    assert profiler.phases["runner"] >= 0.05
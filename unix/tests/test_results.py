@@ -0,0 +1,58 @@
+import json
+from unittest.mock import MagicMock
+
+from src.machine_stats import ResultCallback
+from src.machine_stats.results import HostResult, deep_merge
+
+
+def test_deep_merge():
+    target = {"a": 1, "nested": {"x": 1, "deeper": {"k": 1}}, "list": [1]}
+    source = {"b": 2, "nested": {"y": 2, "deeper": {"l": 2}}, "list": [2]}
+
+    assert deep_merge(target, source) is target
+    assert target == {
+        "a": 1,
+        "b": 2,
+        "nested": {"x": 1, "y": 2, "deeper": {"k": 1, "l": 2}},
+        "list": [2],
+    }
+
+
+def test_deep_merge_replaces_non_dict_values():
+    assert deep_merge({"a": {"x": 1}}, {"a": None}) == {"a": None}
+    assert deep_merge({"a": 1}, {"a": {"x": 1}}) == {"a": {"x": 1}}
+
+
+def test_host_result_merges_once():
+    facts = {"host_name": "web1", "custom_fields": {"cpu_average": 1.0}}
+    result = HostResult(facts)
+    result.add({"process_stats": []})
+    result.add({"custom_fields": {"cpu_peak": 2.0, "cpu_average": 3.0}})
+
+    server = result.build()
+
+    # Merged into the first contribution, without any copy
+    assert server is facts
+    assert server == {
+        "host_name": "web1",
+        "custom_fields": {"cpu_average": 3.0, "cpu_peak": 2.0},
+        "process_stats": [],
+    }
+    assert result.build() is server
+
+
+def test_host_result_empty():
+    assert HostResult().build() == {}
+
+
+def test_result_callback_merges_custom_fields(capsys):
+    callback = ResultCallback(plugins=MagicMock())
+    callback.update_results("web1", {"host_name": "web1"})
+    callback.update_results("web1", {"custom_fields": {"cpu_average": 1.0}})
+    callback.update_results("web1", {"custom_fields": {"cpu_peak": 2.0}})
+    callback.v2_playbook_on_stats({})
+
+    output = json.loads(capsys.readouterr().out)
+    assert output["servers"] == [
+        {"host_name": "web1", "custom_fields": {"cpu_average": 1.0, "cpu_peak": 2.0}}
+    ]
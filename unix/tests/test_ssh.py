@@ -0,0 +1,42 @@
+import os
+
+from src.machine_stats.ssh import requires_tty, ssh_envvars, without_pipelining
+
+
+def test_ssh_envvars_default():
+    assert ssh_envvars("default", "/nonexistent") == {}
+
+
+def test_ssh_envvars_performance(tmp_path, monkeypatch):
+    monkeypatch.setenv("ANSIBLE_SSH_ARGS", "-o ServerAliveInterval=10")
+
+    envvars = ssh_envvars("performance", str(tmp_path))
+
+    assert envvars["ANSIBLE_SSH_ARGS"] == (
+        "-o ServerAliveInterval=10 -o ControlMaster=auto -o ControlPersist=60s"
+    )
+    assert envvars["ANSIBLE_SSH_CONTROL_PATH"] == "%(directory)s/%%C"
+    assert envvars["ANSIBLE_PIPELINING"] == "True"
+    control_path_dir = envvars["ANSIBLE_SSH_CONTROL_PATH_DIR"]
+    assert control_path_dir.startswith(str(tmp_path))
+    assert os.stat(control_path_dir).st_mode & 0o777 == 0o700
+
+
+def test_without_pipelining():
+    envvars = {"ANSIBLE_PIPELINING": "True", "ANSIBLE_SSH_ARGS": "-C"}
+
+    assert without_pipelining(envvars) == {
+        "ANSIBLE_PIPELINING": "False",
+        "ANSIBLE_SSH_ARGS": "-C",
+    }
+    assert envvars["ANSIBLE_PIPELINING"] == "True"
+
+
+def test_requires_tty():
+    assert requires_tty(
+        {
+            "msg": "MODULE FAILURE",
+            "module_stderr": "sudo: sorry, you must have a tty to run sudo\n",
+        }
+    )
+    assert not requires_tty({"msg": "Permission denied"})
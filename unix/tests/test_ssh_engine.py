@@ -0,0 +1,239 @@
+import argparse
+import asyncio
+import json
+import os
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from src.machine_stats import Application
+from src.machine_stats.collector import collector_tasks, read_modules
+from src.machine_stats.ssh_engine import REMOTE_COMMAND, SSHEngine, SSHTarget
+
+MODULES_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    "src",
+    "machine_stats",
+    "modules",
+)
+
+
+class LocalTransport:
+    """Transport running the commands on this machine instead of over SSH"""
+
+    errors = (OSError,)
+
+    def __init__(self, unreachable=()):
+        self.unreachable = unreachable
+        self.commands = []
+
+    async def run(self, target, command, stdin):
+        if target.host in self.unreachable:
+            raise OSError("Connection refused")
+        self.commands.append((target.host, command))
+        process = await asyncio.create_subprocess_shell(
+            command,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+        )
+        stdout, stderr = await process.communicate(stdin.encode())
+        return process.returncode, stdout.decode(), stderr.decode()
+
+
+def _target(host):
+    return SSHTarget(host, "127.0.0.1", None, None, None, None)
+
+
+def _engine(transport, play_source):
+    return SSHEngine(
+        transport, read_modules(MODULES_DIR), collector_tasks(play_source), 10
+    )
+
+
+def test_collector_tasks():
+    play_source = dict(
+        gather_facts="no",
+        pre_tasks=[
+            dict(
+                action=dict(module="cpu_utilization", args=dict(timeout=1)),
+                **{"async": 31, "poll": 0}
+            )
+        ],
+        tasks=[
+            dict(action=dict(module="setup", args=dict(gather_timeout=180))),
+            dict(action=dict(module="proc_stats", args=dict(top=5)), when="x"),
+        ],
+        post_tasks=[dict(action=dict(module="async_status", args=dict(jid="1")))],
+    )
+
+    assert collector_tasks(play_source) == [
+        dict(
+            module="cpu_utilization", args=dict(timeout=1), when=None, **{"async": True}
+        ),
+        dict(module="machine_facts", args={}, when=None),
+        dict(module="proc_stats", args=dict(top=5), when="x"),
+        dict(module="async_status", args={}, when=None, async_status=True),
+    ]
+    assert collector_tasks(dict(gather_facts="yes", tasks=[]))[0]["module"] == (
+        "machine_facts"
+    )
+
+
+def test_collector_tasks_unknown_module():
+    with pytest.raises(ValueError):
+        collector_tasks(dict(tasks=[dict(action=dict(module="shell"))]))
+
+
+def test_ssh_engine_collects_hosts():
+    transport = LocalTransport(unreachable=("down",))
+    engine = _engine(
+        transport,
+        dict(
+            gather_facts="yes",
+            tasks=[dict(action=dict(module="proc_stats", args=dict(top=3)))],
+        ),
+    )
+    events = []
+
+    engine.run([_target("web1"), _target("down")], events.append)
+
+    assert transport.commands == [("web1", REMOTE_COMMAND)]
+    by_event = {}
+    for event in events:
+        by_event.setdefault(event["event"], []).append(event["event_data"])
+    facts, proc_stats = by_event["runner_on_ok"]
+    assert facts["host"] == "web1"
+    assert facts["task_action"] == "machine_facts"
+    assert "ansible_hostname" in facts["res"]["ansible_facts"]
+    assert len(proc_stats["res"]["ansible_proc_stats"]) <= 3
+    assert by_event["runner_on_unreachable"] == [
+        {"host": "down", "res": {"msg": "Connection refused"}}
+    ]
+    stats = events[-1]["event_data"]
+    assert events[-1]["event"] == "playbook_on_stats"
+    assert stats["ok"] == {"web1": 2}
+    assert stats["dark"] == {"down": 1}
+
+
+def test_ssh_engine_skips_and_async_tasks(tmp_path):
+    (tmp_path / "stat").write_text("cpu  100 0 100 800 0 0 0 0 0 0\n")
+    (tmp_path / "driver").mkdir()
+    (tmp_path / "driver" / "rtc").write_text(
+        "rtc_time\t: 12:00:00\nrtc_date\t: 2025-10-23\n"
+    )
+    cpu_args = dict(timeout=1, interval=0.5, proc_root=str(tmp_path))
+    engine = _engine(
+        LocalTransport(),
+        dict(
+            pre_tasks=[
+                dict(
+                    action=dict(module="cpu_utilization", args=cpu_args),
+                    **{"async": 31, "poll": 0}
+                )
+            ],
+            tasks=[
+                dict(
+                    action=dict(module="machine_facts"),
+                    when="inventory_hostname not in cached",
+                )
+            ],
+            post_tasks=[dict(action=dict(module="async_status"))],
+        ),
+    )
+    events = []
+
+    engine.run([_target("web1")], events.append, {"cached": ["web1"]})
+
+    assert [event["event"] for event in events] == [
+        "runner_on_ok",
+        "runner_on_skipped",
+        "runner_on_ok",
+        "playbook_on_stats",
+    ]
+    cpu = events[2]["event_data"]["res"]
+    assert cpu["timeout"] == 1
+    assert cpu["ansible_cpu_utilization"]["rtc_date"] == "2025-10-23"
+
+
+def test_ssh_engine_reports_module_failures():
+    engine = _engine(
+        LocalTransport(),
+        dict(
+            tasks=[
+                dict(action=dict(module="cpu_utilization", args=dict(interval=60.0))),
+                dict(action=dict(module="machine_facts")),
+            ]
+        ),
+    )
+    events = []
+
+    engine.run([_target("web1")], events.append)
+
+    assert [event["event"] for event in events] == [
+        "runner_on_failed",
+        "playbook_on_stats",
+    ]
+    assert "interval" in events[0]["event_data"]["res"]["msg"]
+
+
+@patch("src.machine_stats.list_connections")
+@patch("src.machine_stats.ssh_engine.AsyncSSHTransport", LocalTransport)
+def test_run_ansible_with_ssh_engine(mock_list_connections, tmp_path, capsys):
+    mock_list_connections.return_value = {
+        host: dict(
+            address="127.0.0.1", port=None, user=None, key_file=None, password=None
+        )
+        for host in ("web1", "web2")
+    }
+    args = argparse.Namespace(
+        measurement=False, engine="ssh", fact_gathering="minimal", ssh_concurrency=5
+    )
+    app = Application(plugins=MagicMock(), args=args)
+    app.add_playbook_tasks(dict(action=dict(module="proc_stats", args=dict(top=1))))
+
+    app._run_ansible(app.play_source(), str(tmp_path), {})
+
+    captured = capsys.readouterr()
+    servers = json.loads(captured.out)["servers"]
+    assert len(servers) == 2
+    assert all(
+        "host_name" in server and "ram_allocated_gb" in server for server in servers
+    )
+    # The ssh engine does not use Ansible forks.
+    assert "ssh concurrency: 5" in captured.err
+    assert "forks:" not in captured.err
+
+
+@patch("src.machine_stats.ansible_runner.run")
+def test_run_local(mock_run, tmp_path, capsys):
+    proc_root = tmp_path / "proc"
+    proc_root.mkdir()
+    (proc_root / "stat").write_text("cpu  100 0 100 800 0 0 0 0 0 0\n")
+    (proc_root / "driver").mkdir()
+    (proc_root / "driver" / "rtc").write_text(
+        "rtc_time\t: 12:00:00\nrtc_date\t: 2025-10-23\n"
+    )
+    output = tmp_path / "output.json"
+    args = argparse.Namespace(
+        measurement=False, local=True, fact_gathering="minimal", output=str(output)
+    )
+    app = Application(plugins=MagicMock(), args=args)
+    app.add_playbook_pre_tasks(
+        dict(
+            action=dict(
+                module="cpu_utilization",
+                args=dict(timeout=1, interval=0.5, proc_root=str(proc_root)),
+            ),
+            **{"async": 31, "poll": 0}
+        )
+    )
+    app.add_playbook_tasks(dict(action=dict(module="proc_stats", args=dict(top=1))))
+    app.add_playbook_post_tasks(dict(action=dict(module="async_status")))
+
+    app.run()
+
+    mock_run.assert_not_called()
+    (server,) = json.loads(output.read_text())["servers"]
+    assert "host_name" in server and "ram_allocated_gb" in server
+    assert "localhost" in capsys.readouterr().err